@@ -1,53 +1,81 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
-import sys
+from array import array
 
+import numpy as np
 from backtrader import Analyzer
-from backtrader.utils import AutoOrderedDict, AutoDict
-from backtrader.utils.py3 import MAXINT
 
 
 # profitPercAbs = trade.history[1].event.order.executed.price / trade.price
 # profitPercAbs = 1 - profitPercAbs if trade.history[1].event.order.executed.size > 0 else profitPercAbs - 1
 
+def summary(values):
+    """count, mean, std (sample), min, max and win rate (share > 0) of an array of returns."""
+    a = np.frombuffer(values, dtype=np.float64)
+    if not len(a):
+        return dict(count=0, mean=np.nan, std=np.nan, min=np.nan, max=np.nan, win_rate=np.nan)
+    return dict(count=len(a), mean=float(a.mean()), std=float(a.std(ddof=1)) if len(a) > 1 else np.nan,
+                min=float(a.min()), max=float(a.max()), win_rate=float((a > 0).mean()))
+
+
 class TradeReturn(Analyzer):
+    """
+    Returns of each closed trade, from its history (strategy tradehistory on):
+
+    returns_close: exit price against the size weighted average price of the trade's events while open
+    returns_open: size weighted average exit price against the price of each of those events, once the
+                  position in the trade's data is flat
+
+    The weighted averages are running sums over one pass of the trade history, and the returns are
+    kept in array('d'). get_analysis also gives summary statistics (`stats`) and a histogram
+    (`bins` bins over `hist_range`, default the range of the returns) of both.
+    """
+    params = (('bins', 20), ('hist_range', None))
 
     def create_analysis(self):
-        self.returns_close = []
-        self.returns_open = []
+        self.returns_close = array('d')
+        self.returns_open = array('d')
 
     def notify_trade(self, trade):
-        # sum(x * y for x, y in zip(rate, amount)) / sum(amount)
-        if trade.status == trade.Closed:
-            history = trade.history
-            count = 0
-            open_sizes = []
-            close_sizes = []
-            open_prices = []
-            close_prices = []
-            for h in history:
-                if h.status.status == 1:
-                    count += 1
-                    open_prices.append(h.event.price)
-                    open_sizes.append(h.event.size)
-                if h.status.status == 2:
-                    close_prices.append(h.event.price)
-                    close_sizes.append(h.event.size)
-                    avg_open = sum(x * y for x, y in zip(open_prices, open_sizes)) / sum(open_sizes)
-                    num = h.event.order.executed.price
-                    profit_pc = num / avg_open
+        if trade.status != trade.Closed:
+            return
+
+        open_value = open_size = 0.0
+        close_value = close_size = 0.0
+        open_prices = []
+        h = None
+        for h in trade.history:
+            status = h.status.status
+            if status == 1:
+                open_prices.append(h.event.price)
+                open_value += h.event.price * h.event.size
+                open_size += h.event.size
+            elif status == 2:
+                close_value += h.event.price * h.event.size
+                close_size += h.event.size
+                if open_size:
+                    profit_pc = h.event.order.executed.price / (open_value / open_size)
                     profit_pc = 1 - profit_pc if h.event.order.executed.size > 0 else profit_pc - 1
                     self.returns_close.append(round(profit_pc, 4))
 
-            if self.strategy.position.size == 0:
-                avg_close = sum(x * y for x, y in zip(close_prices, close_sizes)) / sum(close_sizes)
-                for open_price in open_prices:
-                    profit_pc_open = avg_close / open_price
-                    profit_pc_open = 1 - profit_pc_open if h.event.order.executed.size > 0 else profit_pc_open - 1
-                    self.returns_open.append(round(profit_pc_open, 4))
+        if close_size and self.strategy.getposition(trade.data).size == 0:
+            avg_close = close_value / close_size
+            closing_buy = h.event.order.executed.size > 0
+            for open_price in open_prices:
+                profit_pc_open = avg_close / open_price
+                profit_pc_open = 1 - profit_pc_open if closing_buy else profit_pc_open - 1
+                self.returns_open.append(round(profit_pc_open, 4))
 
-        # if last_event.event.
+    def histogram(self, values):
+        a = np.frombuffer(values, dtype=np.float64)
+        hist_range = self.p.hist_range or ((a.min(), a.max()) if len(a) else (0.0, 1.0))
+        counts, edges = np.histogram(a, bins=self.p.bins, range=hist_range)
+        return dict(counts=counts, edges=edges)
 
     def get_analysis(self):
-        return dict(returns_close=self.returns_close, returns_open=self.returns_open)
+        return dict(returns_close=self.returns_close,
+                    returns_open=self.returns_open,
+                    stats=dict(close=summary(self.returns_close), open=summary(self.returns_open)),
+                    histogram=dict(close=self.histogram(self.returns_close),
+                                   open=self.histogram(self.returns_open)))
@@ -0,0 +1,60 @@
+"""
+Run strategies_bt.candles_v2 on every Oanda H4 file in data/ with signals evaluated bar by bar
+and with precompute_signals=True, check that both produce the same transactions and time them.
+Then the same on all the files as datas of one strategy, where every data has to hold next()
+back for the same warmup in both modes.
+
+    python benchmarks/bench_candles_v2.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import backtrader as bt
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from initialize import APP_PATH  # noqa: E402
+from strategies_bt.candles_v2 import MyStrategy  # noqa: E402
+
+
+def run(frames, precompute_signals, runonce=True):
+    """frames: dict of data name -> DataFrame"""
+    cerebro = bt.Cerebro(stdstats=False, runonce=runonce)
+    for name, df in frames.items():
+        cerebro.adddata(bt.feeds.PandasData(dataname=df, timeframe=bt.TimeFrame.Minutes, compression=240),
+                        name=name)
+    cerebro.broker.setcash(1_000)
+    cerebro.broker.setcommission(commission=0.0, leverage=50)
+    cerebro.addstrategy(MyStrategy, precompute_signals=precompute_signals, trace=False)
+    cerebro.addanalyzer(bt.analyzers.Transactions, _name='transactions')
+    start = time.perf_counter()
+    strategy = cerebro.run()[0]
+    elapsed = time.perf_counter() - start
+    return elapsed, strategy.analyzers.transactions.get_analysis(), cerebro.broker.getvalue(), strategy._minperiods
+
+
+def compare(label, frames, runonce, total):
+    ref_time, ref_transactions, ref_value, ref_minperiods = run(frames, False, runonce)
+    new_time, new_transactions, new_value, new_minperiods = run(frames, True, runonce)
+    total['bar_by_bar'] += ref_time
+    total['precomputed'] += new_time
+    same = ref_transactions == new_transactions and ref_value == new_value and ref_minperiods == new_minperiods
+    print(f'{label:<45} runonce={runonce!s:<5} bar by bar {ref_time:6.3f}s  '
+          f'precomputed {new_time:6.3f}s  transactions {len(ref_transactions):3d}  identical {same}')
+
+
+if __name__ == '__main__':
+    Path('output').mkdir(exist_ok=True)
+    total = dict(bar_by_bar=0.0, precomputed=0.0)
+    frames = dict()
+    for csv_file in sorted(Path(f'{APP_PATH}/data').glob('data_oanda_*_H4.csv')):
+        name = '_'.join(csv_file.stem.split('_')[2:4])
+        frames[name] = pd.read_csv(csv_file, index_col='datetime', parse_dates=True)
+        for runonce in (True, False):
+            compare(csv_file.stem, {name: frames[name]}, runonce, total)
+    for runonce in (True, False):
+        compare(f'{len(frames)} datas', frames, runonce, total)
+    print(f"total bar by bar {total['bar_by_bar']:.2f}s, precomputed {total['precomputed']:.2f}s, "
+          f"speedup {total['bar_by_bar'] / total['precomputed']:.2f}x")
@@ -0,0 +1,63 @@
+"""
+Load the Oanda H4 files in data/ (and synthetic long histories) with bt.feeds.PandasData and with
+providers.numpy_feed.NumpyData, check that both give the same line values and time the preload.
+
+    python benchmarks/bench_feeds.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from initialize import APP_PATH  # noqa: E402
+from providers.market_store import index_to_ns  # noqa: E402
+from providers.numpy_feed import NumpyData  # noqa: E402
+
+
+def to_arrays(df):
+    arrays = dict(time=index_to_ns(df.index))
+    arrays.update({column: df[column].to_numpy(dtype=float) for column in ('open', 'high', 'low', 'close', 'volume')})
+    return arrays
+
+
+def preload(feed):
+    """Preload feed like cerebro does and return its lines as numpy arrays."""
+    feed.setenvironment(bt.Cerebro())
+    feed._start()
+    feed.preload()
+    return {name: np.array(getattr(feed.lines, name).array) for name in feed.lines.getlinealiases()}
+
+
+def same_lines(a, b):
+    return a.keys() == b.keys() and all(np.array_equal(a[k], b[k], equal_nan=True) for k in a)
+
+
+def run(name, frames):
+    start = time.perf_counter()
+    pandas_lines = [preload(bt.feeds.PandasData(dataname=df)) for df in frames]
+    pandas_time = time.perf_counter() - start
+    arrays = [to_arrays(df) for df in frames]
+    start = time.perf_counter()
+    numpy_lines = [preload(NumpyData(dataname=a)) for a in arrays]
+    numpy_time = time.perf_counter() - start
+    same = all(same_lines(a, b) for a, b in zip(pandas_lines, numpy_lines))
+    bars = sum(len(df) for df in frames)
+    print(f'{name:<30} {len(frames):4d} feeds {bars:9d} bars  PandasData {pandas_time:7.3f}s  '
+          f'NumpyData {numpy_time:7.3f}s  ({pandas_time / numpy_time:.0f}x)  identical {same}')
+
+
+if __name__ == '__main__':
+    frames = [pd.read_csv(csv_file, index_col='datetime', parse_dates=True)
+              for csv_file in sorted(Path(f'{APP_PATH}/data').glob('data_oanda_*_H4.csv'))]
+    run('oanda H4 files', frames)
+
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2018-01-01', periods=5_000, freq='1h')
+    frames = [pd.DataFrame(rng.random((len(index), 5)), index=index,
+                           columns=['open', 'high', 'low', 'close', 'volume']) for _ in range(20)]
+    run('synthetic 20 x 5000 1h bars', frames)
@@ -0,0 +1,142 @@
+"""
+Compare indicators in indicators/custom_indicators.py against their previous per-bar implementations
+on the Oanda CSVs in data/, in both runonce (vectorized) and next (event driven) mode, and check the
+kernels of indicators/rolling.py (update and compute) against the matching backtrader indicators.
+
+    python benchmarks/bench_indicators.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from indicators import custom_indicators, rolling  # noqa: E402
+from initialize import APP_PATH  # noqa: E402
+
+
+class SlopeSklearn(bt.Indicator):
+    # previous implementation: one sklearn fit per bar
+    lines = ('slope',)
+    params = (('period', 20),)
+
+    def __init__(self):
+        self.addminperiod(self.params.period)
+
+    def next(self):
+        from sklearn.linear_model import LinearRegression
+        y = self.data.get(size=self.p.period)
+        x = np.array(range(1, self.p.period + 1)).reshape(-1, 1)
+        reg = LinearRegression()
+        reg.fit(x, y)
+        self.lines.slope[0] = reg.coef_[0]
+
+
+class EMAVAStdev(bt.Indicator):
+    # previous implementation: statistics.stdev over a copy of the window on every bar
+    lines = ('emava',)
+    params = (('period', 20), ('coeff', 1),)
+
+    def __init__(self):
+        self.addminperiod(self.p.period)
+
+    def next(self):
+        from math import isnan
+        from statistics import stdev
+        std = stdev(self.data.get(size=self.p.period))
+        alpha = (2.0 / (1.0 + self.p.period)) * (1 + std * 10)
+        alpha1 = 1 - alpha
+        if isnan(self.lines.emava[-1]):
+            self.lines.emava[0] = self.data[0]
+        else:
+            self.lines.emava[0] = self.lines.emava[-1] * alpha1 + self.data[0] * alpha
+
+
+class IndicatorStrategy(bt.Strategy):
+    params = (('indicator', None), ('period', 20))
+
+    def __init__(self):
+        self.ind = [self.p.indicator(d, period=self.p.period) for d in self.datas]
+
+
+KERNELS = dict(sum=(rolling.RollingSum, bt.indicators.SumN),
+               mean=(rolling.RollingMean, bt.indicators.SMA),
+               stdev=(lambda period: rolling.RollingStdev(period, ddof=0), bt.indicators.StdDev),
+               max=(rolling.RollingMax, bt.indicators.Highest),
+               min=(rolling.RollingMin, bt.indicators.Lowest),
+               ema=(rolling.EMA, bt.indicators.EMA))
+
+
+class KernelReferenceStrategy(bt.Strategy):
+    params = (('period', 20),)
+
+    def __init__(self):
+        self.ind = {name: [indicator(d.close, period=self.p.period) for d in self.datas]
+                    for name, (kernel, indicator) in KERNELS.items()}
+
+
+def check_kernels(frames, period=20):
+    cerebro = bt.Cerebro(stdstats=False)
+    for name, df in frames.items():
+        cerebro.adddata(bt.feeds.PandasData(dataname=df), name=name)
+    cerebro.addstrategy(KernelReferenceStrategy, period=period)
+    strategy = cerebro.run()[0]
+    for name, (kernel, indicator) in KERNELS.items():
+        diffs = []
+        for d, ind in zip(strategy.datas, strategy.ind[name]):
+            close = np.asarray(d.close.array)
+            reference = np.asarray(ind.lines[0].array)
+            k = kernel(period)
+            diffs.append(relative_diff(reference, k.compute(close)))
+            diffs.append(relative_diff(reference, np.array([k.update(x) for x in close])))
+        print(f'kernel {name:<6} vs bt.indicators.{indicator.__name__:<10} max rel diff {max(diffs):.2e}')
+
+
+def load_data(pattern='*_2017-01-01_2018-01-01_H4.csv'):
+    frames = {}
+    for csv_file in sorted(Path(f'{APP_PATH}/data').glob(f'data_oanda_{pattern}')):
+        df = pd.read_csv(csv_file, index_col='datetime', parse_dates=True)
+        frames[csv_file.name.split('_')[2] + '_' + csv_file.name.split('_')[3]] = df
+    return frames
+
+
+def run(indicator, frames, runonce, period=20):
+    cerebro = bt.Cerebro(stdstats=False, runonce=runonce)
+    for name, df in frames.items():
+        cerebro.adddata(bt.feeds.PandasData(dataname=df), name=name)
+    cerebro.addstrategy(IndicatorStrategy, indicator=indicator, period=period)
+    start = time.perf_counter()
+    strategy = cerebro.run()[0]
+    elapsed = time.perf_counter() - start
+    values = [np.asarray(ind.lines[0].array) for ind in strategy.ind]
+    return elapsed, values
+
+
+def compare(name, reference, candidate, frames):
+    for runonce in (True, False):
+        ref_time, ref_values = run(reference, frames, runonce)
+        new_time, new_values = run(candidate, frames, runonce)
+        max_diff = max(relative_diff(r, n) for r, n in zip(ref_values, new_values))
+        mode = 'runonce' if runonce else 'next'
+        print(f'{name:<10} {mode:<8} reference {ref_time:7.3f}s  new {new_time:7.3f}s  '
+              f'speedup {ref_time / new_time:6.1f}x  max rel diff {max_diff:.2e}')
+
+
+def relative_diff(reference, candidate):
+    # EMA_VA diverges on high priced instruments (alpha > 1), compare finite values only
+    finite = np.isfinite(reference) & np.isfinite(candidate)
+    if not finite.any():
+        return 0.0
+    reference, candidate = reference[finite], candidate[finite]
+    return float(np.max(np.abs(reference - candidate) / np.maximum(np.abs(reference), 1e-12)))
+
+
+if __name__ == '__main__':
+    frames = load_data()
+    check_kernels(frames)
+    compare('Slope', SlopeSklearn, custom_indicators.Slope, frames)
+    compare('EMA_VA', EMAVAStdev, custom_indicators.EMA_VA, frames)
@@ -0,0 +1,80 @@
+"""
+Persist a poll of candles into an fx_data table of growing size with clean_df_db_dups + to_sql
+(reads every key of the table back) and with upsert_df (unique index + ON CONFLICT DO NOTHING),
+on SQLite. Both must leave the same rows; upsert_df should not slow down as the table grows.
+
+upsert_df gets tz-aware times, as the trader writes them, over a history written by to_sql. The old
+path gets unix seconds: clean_df_db_dups merges the keys it reads back as strings, which never
+equal datetimes on SQLite.
+
+    python benchmarks/bench_upsert.py
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from helpers_functions import clean_df_db_dups, upsert_df  # noqa: E402
+
+KEYS = ['time', 'instrument', 'granularity']
+INSTRUMENTS = ['EUR_USD', 'GBP_USD', 'AUD_USD', 'NZD_USD', 'XAU_USD', 'XAG_USD', 'USD_JPY', 'USD_CAD']
+
+
+def candles(start, periods, unix=False):
+    # unix=True: time as unix seconds, for clean_df_db_dups
+    rng = np.random.default_rng(start)
+    times = 1_483_228_800 + 14_400 * np.arange(start, start + periods)
+    if not unix:
+        times = pd.to_datetime(times, unit='s', utc=True)
+    frames = [pd.DataFrame(dict(complete=True, volume=rng.integers(100, 5000, periods), time=times,
+                                open=rng.random(periods), high=rng.random(periods), low=rng.random(periods),
+                                close=rng.random(periods), instrument=instrument, granularity='H4'))
+              for instrument in INSTRUMENTS]
+    return pd.concat(frames, ignore_index=True)
+
+
+def old_write(df, engine):
+    df = clean_df_db_dups(df.copy(), 'fx_data', engine, KEYS)
+    if len(df) > 0:
+        df.to_sql('fx_data', engine, if_exists='append', index=False)
+
+
+def new_write(df, engine):
+    upsert_df(df, 'fx_data', engine, KEYS)
+
+
+def timed(write, df, engine, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        write(df, engine)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as folder:
+        old_engine = create_engine(f'sqlite:///{folder}/old.db')
+        new_engine = create_engine(f'sqlite:///{folder}/new.db')
+        size = 0
+        for table_bars in (1_000, 10_000, 50_000, 200_000):
+            candles(size, table_bars - size, unix=True).to_sql('fx_data', old_engine, if_exists='append', index=False)
+            candles(size, table_bars - size).to_sql('fx_data', new_engine, if_exists='append', index=False)
+            size = table_bars
+            # one poll: the last 2 candles again (still in the response) and 3 new ones per instrument
+            old_time = timed(old_write, candles(size - 2, 5, unix=True), old_engine)
+            new_time = timed(new_write, candles(size - 2, 5), new_engine)
+            size += 3
+            rows = [pd.read_sql('SELECT * FROM fx_data ORDER BY instrument, time', engine)
+                    for engine in (old_engine, new_engine)]
+            rows[1]['time'] = (pd.to_datetime(rows[1]['time']) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+            same = rows[0].equals(rows[1]) and not rows[1].duplicated(KEYS).any()
+            print(f'table {len(rows[1]):8d} rows  poll {5 * len(INSTRUMENTS)} rows  clean_df_db_dups + to_sql '
+                  f'{old_time * 1e3:8.2f}ms  upsert_df {new_time * 1e3:6.2f}ms  '
+                  f'({old_time / new_time:.0f}x)  same rows {same}')
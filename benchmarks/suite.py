@@ -0,0 +1,251 @@
+"""
+Benchmark suite of a whole backtest, offline, stage by stage.
+
+Scenarios: the one year Oanda H4 files in data/ as one multi-asset run, and synthetic random walk
+data of --instruments x --bars. Each scenario runs in a fresh process and is timed per stage:
+
+    data_read          csv / synthetic bars to numpy arrays
+    data_preload       feeds preloaded by cerebro (NumpyData, or PandasData with --feed pandas)
+    indicator_setup    strategy __init__ (indicators created)
+    indicator_compute  indicators computed over the whole history (runonce, 0 with --next)
+    event_loop         strategy prenext/next over all bars, orders and broker
+    analyzers          analyzers stopped and turned into result rows
+    output             last trace chunk flushed and result csv written (earlier chunks fall in event_loop)
+
+Bars/s (bars of all feeds / backtest time) and the peak RSS of the process are reported,
+and the results are saved to benchmarks/results/<timestamp>_<commit>.json.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --instruments 20 --bars 20000 --strategy strategies_bt.buy_top_performer
+    python benchmarks/suite.py --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import analyzers  # noqa: E402
+from helpers_functions import analyzers_row, trade_analysis_row, write_csv_rows  # noqa: E402
+from initialize import APP_PATH  # noqa: E402
+from providers.market_store import arrays_to_df, index_to_ns  # noqa: E402
+from providers.numpy_feed import NumpyData  # noqa: E402
+
+STAGES = ('data_read', 'data_preload', 'indicator_setup', 'indicator_compute', 'event_loop', 'analyzers', 'output')
+RESULTS_PATH = Path(__file__).resolve().parent / 'results'
+
+
+def oanda_arrays():
+    arrays = dict()
+    for csv_file in sorted(Path(f'{APP_PATH}/data').glob('data_oanda_*_2017-01-01_2018-01-01_H4.csv')):
+        df = pd.read_csv(csv_file, index_col='datetime', parse_dates=True)
+        df = df[~df.index.duplicated(keep='last')]
+        a = dict(time=index_to_ns(df.index))
+        a.update({column: df[column].to_numpy(dtype=float) for column in ('open', 'high', 'low', 'close', 'volume')})
+        arrays['_'.join(csv_file.stem.split('_')[2:4])] = a
+    return arrays
+
+
+def synthetic_arrays(instruments, bars, seed=0):
+    """Random walk H1 OHLCV bars, the same for a given seed."""
+    rng = np.random.default_rng(seed)
+    times = index_to_ns(pd.date_range('2015-01-01', periods=bars, freq='1h'))
+    arrays = dict()
+    for i in range(instruments):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.004, bars)))
+        open_ = np.r_[close[0], close[:-1]]
+        spread = np.abs(rng.normal(0, 0.002, bars)) * close
+        arrays[f'SYN{i:03d}'] = dict(time=times, open=open_, high=np.maximum(open_, close) + spread,
+                                     low=np.minimum(open_, close) - spread, close=close,
+                                     volume=rng.integers(100, 10_000, bars).astype(float))
+    return arrays
+
+
+def timed_strategy(strategy, marks):
+    """Subclass of strategy writing perf_counter marks of its life cycle into `marks`."""
+
+    class Timed(strategy):
+
+        def __init__(self, *args, **kwargs):
+            marks.setdefault('init_start', time.perf_counter())
+            super(Timed, self).__init__(*args, **kwargs)
+            marks['init_end'] = time.perf_counter()
+
+        def start(self):
+            super(Timed, self).start()
+            marks['start'] = time.perf_counter()
+
+        def prenext(self):
+            marks.setdefault('loop_start', time.perf_counter())
+            super(Timed, self).prenext()
+
+        def nextstart(self):
+            marks.setdefault('loop_start', time.perf_counter())
+            super(Timed, self).nextstart()
+
+        def stop(self):
+            marks['loop_end'] = time.perf_counter()
+            super(Timed, self).stop()
+            marks['stop_end'] = time.perf_counter()
+
+    Timed.__module__ = strategy.__module__
+    return Timed
+
+
+def run_scenario(scenario, strategy_name, runonce=True, feed='numpy', trace=True):
+    """One backtest with stage timings, run from a temporary directory (trace files land in its output/)."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir('output')
+        try:
+            return _run_scenario(scenario, strategy_name, runonce, feed, trace)
+        finally:
+            os.chdir(cwd)
+
+
+def _run_scenario(scenario, strategy_name, runonce, feed, trace):
+    start = time.perf_counter()
+    if scenario['name'] == 'oanda_h4':
+        data, compression = oanda_arrays(), 240
+    else:
+        data, compression = synthetic_arrays(scenario['instruments'], scenario['bars']), 60
+    data_read = time.perf_counter() - start
+
+    cerebro = bt.Cerebro(stdstats=False, runonce=runonce)
+    for name, arrays in data.items():
+        if feed == 'pandas':
+            data_feed = bt.feeds.PandasData(dataname=arrays_to_df(arrays), timeframe=bt.TimeFrame.Minutes,
+                                            compression=compression)
+        else:
+            data_feed = NumpyData(dataname=arrays, timeframe=bt.TimeFrame.Minutes, compression=compression)
+        cerebro.adddata(data_feed, name=name)
+    cerebro.broker.setcash(1_000)
+    cerebro.broker.set_shortcash(False)
+    cerebro.broker.setcommission(commission=0.0, leverage=50)
+
+    marks = dict()
+    strategy = importlib.import_module(strategy_name).MyStrategy
+    cerebro.addstrategy(timed_strategy(strategy, marks), trace=trace)
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="ta")
+    cerebro.addanalyzer(bt.analyzers.SQN, _name="sqn")
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe")
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="draw_down")
+    cerebro.addanalyzer(bt.analyzers.Returns, _name="returns")
+    cerebro.addanalyzer(analyzers.TradeReturn, _name="trade_return")
+
+    run_start = time.perf_counter()
+    first_strategy = cerebro.run()[0]
+    run_end = time.perf_counter()
+
+    trade_analysis = trade_analysis_row(first_strategy.analyzers, list(data), 1_000)
+    analyzers_result = analyzers_row(first_strategy, 'multiple_instruments')
+    analyzers_end = time.perf_counter()
+    write_csv_rows('output/analysis.csv', [trade_analysis])
+    write_csv_rows('output/analyzers_result.csv', [analyzers_result])
+    output_end = time.perf_counter()
+
+    loop_start = marks.get('loop_start', marks['loop_end'])
+    stages = dict(data_read=data_read,
+                  data_preload=marks['init_start'] - run_start,
+                  indicator_setup=marks['init_end'] - marks['init_start'],
+                  indicator_compute=loop_start - marks['start'],
+                  event_loop=marks['loop_end'] - loop_start,
+                  # analyzers stop after the strategy inside cerebro.run
+                  analyzers=(run_end - marks['stop_end']) + (analyzers_end - run_end),
+                  output=(marks['stop_end'] - marks['loop_end']) + (output_end - analyzers_end))
+    bars = int(sum(len(a['time']) for a in data.values()))
+    backtest_time = run_end - run_start
+    return dict(scenario=scenario['name'], instruments=len(data), bars=bars, runonce=runonce, feed=feed,
+                trace=trace, strategy=strategy_name, stages=stages, total=sum(stages.values()),
+                bars_per_second=bars / backtest_time, final_value=first_strategy.broker.getvalue(),
+                # ru_maxrss is in KiB on Linux
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def run_isolated(*args):
+    """run_scenario in a new process, so the peak memory is the scenario's own."""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_scenario, args)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_PATH,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_result(result):
+    stages = '  '.join(f'{stage} {result["stages"][stage]:.3f}' for stage in STAGES)
+    print(f'{result["scenario"]:<22} {result["bars"]:9d} bars  {result["bars_per_second"]:9.0f} bars/s  '
+          f'peak {result["peak_rss_mb"]:7.1f} MB  total {result["total"]:.3f}s\n    {stages}')
+
+
+def compare(old_file, new_file):
+    old, new = (json.loads(Path(f).read_text()) for f in (old_file, new_file))
+    print(f'{old["commit"]} -> {new["commit"]}')
+    old_results = {(r['scenario'], r['bars'], r['runonce'], r['feed']): r for r in old['results']}
+    for result in new['results']:
+        previous = old_results.get((result['scenario'], result['bars'], result['runonce'], result['feed']))
+        if previous is None:
+            continue
+        print(f'{result["scenario"]} ({result["bars"]} bars) bars/s {previous["bars_per_second"]:.0f} -> '
+              f'{result["bars_per_second"]:.0f}, peak {previous["peak_rss_mb"]:.0f} -> {result["peak_rss_mb"]:.0f} MB')
+        for stage in STAGES:
+            before, after = previous['stages'][stage], result['stages'][stage]
+            change = f'{100 * (after - before) / before:+.0f}%' if before else ''
+            print(f'    {stage:<18} {before:8.3f}s -> {after:8.3f}s  {change}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Backtest benchmark suite')
+    parser.add_argument('--instruments', default=10, type=int, help='Synthetic instruments')
+    parser.add_argument('--bars', default=5_000, type=int, help='Synthetic bars per instrument')
+    parser.add_argument('--strategy', default='strategies_bt.candles_v2', help='Module with a MyStrategy class')
+    parser.add_argument('--feed', default='numpy', choices=['numpy', 'pandas'])
+    parser.add_argument('--next', action='store_true', help='Event driven indicators (runonce=False)')
+    parser.add_argument('--no_trace', action='store_true', help='Strategy trace files off')
+    parser.add_argument('--skip_oanda', action='store_true', help='Only the synthetic scenario')
+    parser.add_argument('--output', default=None, help='Results json file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two results files and exit')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    scenarios = [] if args.skip_oanda else [dict(name='oanda_h4')]
+    scenarios.append(dict(name=f'synthetic_{args.instruments}x{args.bars}', instruments=args.instruments,
+                          bars=args.bars))
+    results = []
+    for scenario in scenarios:
+        result = run_isolated(scenario, args.strategy, not args.next, args.feed, not args.no_trace)
+        print_result(result)
+        results.append(result)
+
+    commit = git_commit()
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    output = Path(args.output or RESULTS_PATH / f'{timestamp}_{commit}.json')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(dict(commit=commit, timestamp=timestamp, python=platform.python_version(),
+                                      numpy=np.__version__, backtrader=bt.__version__, results=results), indent=2))
+    print(f'results saved to {output}')
@@ -1,8 +1,14 @@
 import argparse
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(description='Customized Strategy')
+def parse_args(strict=False):
+    """
+    strict: exit on unknown flags, as the entry points (main.py, optimize.py) do so a typo does not fall
+    back to the defaults. Otherwise they are ignored: this is also called when main is imported, e.g.
+    from benchmarks or pytest, with their own flags on the command line.
+    """
+    # no prefix matching, so the strict and the tolerant parse read the same flags
+    parser = argparse.ArgumentParser(description='Customized Strategy', allow_abbrev=False)
 
     parser.add_argument('--strategy_name', '-sn', default='buy_top_performer')
 
@@ -17,18 +23,54 @@ def parse_args():
     parser.add_argument('--granularity', default='H1', type=str,
                         help='Granularity of data')
 
+    parser.add_argument('--base_granularity', default='H1', type=str,
+                        help='Granularity downloaded and stored, --granularity bars are resampled from it')
+
     parser.add_argument('--only_long', '-ol', default=True, action='store_true',
                         help='Do only long operations')
 
     parser.add_argument('--write_csv', '-wcsv', default=True, action='store_true',
                         help='Tell the writer to produce a csv stream')
 
-    parser.add_argument('--show_plot', '-sp', default=True, action='store_true',
-                        help='show plot')
+    parser.add_argument('--show_plot', '-sp', default=False, action='store_true',
+                        help='show plot (interactive window, needs a display and --plot_mode sync)')
+
+    parser.add_argument('--plot_mode', default='async', choices=['sync', 'async', 'defer', 'off'],
+                        help='sync: backtrader plot inside the backtest, async: rendered by background processes, '
+                             'defer: plot data saved to render later with plotting.py, off: no plots')
+
+    parser.add_argument('--plot_workers', default=1, type=int,
+                        help='Processes rendering plots with --plot_mode async')
+
+    parser.add_argument('--dpi', default=150, type=int,
+                        help='Resolution of the saved plots')
 
     parser.add_argument('--same_account', '-da', default=True, action='store_false',
                         help='Use the same account for all instrument. Otherwise different account for each instrument')
 
+    parser.add_argument('--workers', '-w', default=1, type=int,
+                        help='Number of worker processes used when each instrument has its own account')
+
+    parser.add_argument('--concurrency', default=10, type=int,
+                        help='Maximum number of concurrent kline requests when downloading the universe')
+
+    parser.add_argument('--resume', default=None, type=str,
+                        help='Output folder of an interrupted run to resume from its checkpoint')
+
+    parser.add_argument('--search', default='grid', choices=['grid', 'random'],
+                        help='Parameter search of optimize.py: full grid or random combinations')
+
+    parser.add_argument('--samples', default=20, type=int,
+                        help='Number of combinations drawn by the random search')
+
+    parser.add_argument('--profile', default='off', choices=['off', 'timing', 'cprofile', 'tracemalloc'],
+                        help='Per phase timing of start_backtest saved as profile_*.json next to the analysis csv, '
+                             'optionally with a cProfile or tracemalloc capture of cerebro.run')
+
+    parser.add_argument('--results_db', default='output/results.db', type=str,
+                        help='sqlite results store the analysis rows are also written to (empty to disable), '
+                             'see results_store.py for the leaderboard queries')
+
     parser.add_argument('--cash', default=1_000, type=int,
                         help='Starting Cash')
 
@@ -57,4 +99,4 @@ def parse_args():
     # parser.add_argument('--numfigs', '-n', default=1,
     #                     help='Plot using numfigs figures')
 
-    return parser.parse_args(args=[])
\ No newline at end of file
+    return parser.parse_args() if strict else parser.parse_known_args()[0]
\ No newline at end of file
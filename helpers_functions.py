@@ -4,8 +4,10 @@ from __future__ import (absolute_import, division, print_function,
 import csv
 import math
 import os
+from array import array
 
 import backtrader as bt
+import numpy as np
 import pandas as pd
 from functools import reduce
 
@@ -60,6 +62,103 @@ def clean_df_db_dups(df, tablename, engine, dup_cols=[],
     return df
 
 
+# (engine, table, key columns) -> reflected sa.Table with the unique index in place
+_upsert_tables = dict()
+
+
+def ensure_unique_index(engine, tablename, key_cols, df=None):
+    """
+    Reflected sa.Table of tablename, with a unique index on key_cols (created if missing, and the
+    table too from df's columns). The result is cached per (engine, table, key_cols), so the
+    reflection only runs on the first write.
+    """
+    import sqlalchemy as sa
+
+    cache_key = (engine, tablename, tuple(key_cols))
+    table = _upsert_tables.get(cache_key)
+    if table is not None:
+        return table
+
+    inspector = sa.inspect(engine)
+    if not inspector.has_table(tablename):
+        if df is None:
+            raise ValueError(f'table {tablename} does not exist and no df to create it from')
+        df.head(0).to_sql(tablename, engine, index=False)
+        inspector = sa.inspect(engine)
+    indexes = inspector.get_indexes(tablename) + inspector.get_unique_constraints(tablename)
+    table = sa.Table(tablename, sa.MetaData(), autoload_with=engine)
+    if not any(index.get('unique', True) and list(index['column_names']) == list(key_cols) for index in indexes):
+        try:
+            sa.Index(f"ux_{tablename}_{'_'.join(key_cols)}", *(table.c[col] for col in key_cols),
+                     unique=True).create(engine)
+        except sa.exc.IntegrityError as e:
+            raise ValueError(f'{tablename} has duplicate {key_cols} rows, '
+                             f'remove them before adding the unique index') from e
+    _upsert_tables[cache_key] = table
+    return table
+
+
+def insert_ignore(table, cols, key_cols, dialect_name):
+    """
+    INSERT of cols into table skipping rows whose key_cols already exist, per dialect, with one bind
+    parameter per column (named after it) typed by the table's columns:
+    ON CONFLICT DO NOTHING (sqlite, postgresql), INSERT IGNORE (mysql), otherwise (mssql, ...)
+    INSERT ... SELECT ... WHERE NOT EXISTS.
+    """
+    import sqlalchemy as sa
+
+    if dialect_name in ('sqlite', 'postgresql'):
+        if dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=list(key_cols))
+    if dialect_name == 'mysql':
+        return sa.insert(table).prefix_with('IGNORE')
+    params = {col: sa.bindparam(col, type_=table.c[col].type) for col in cols}
+    exists = sa.exists().where(sa.and_(*(table.c[col] == params[col] for col in key_cols)))
+    return sa.insert(table).from_select(list(cols), sa.select(*(params[col] for col in cols)).where(~exists))
+
+
+def _db_values(series):
+    # python values for the db driver: datetime for timestamps, None for missing values
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = list(series.dt.to_pydatetime())
+    else:
+        values = series.tolist()
+    if series.hasnans:
+        values = [None if isna else value for value, isna in zip(values, series.isna().tolist())]
+    return values
+
+
+def upsert_df(df, tablename, engine, key_cols, batch_size=1000):
+    """
+    Insert the rows of df whose key_cols are not in tablename yet, without reading the table: a
+    unique index on key_cols (see ensure_unique_index) and insert_ignore's statement for the
+    dialect, executed `batch_size` rows at a time. The values are bound through the table's column
+    types, so they are stored as to_sql stores them (e.g. timestamps on SQLite) and compare equal
+    to the rows already there.
+    Replaces clean_df_db_dups + to_sql; the cost depends on len(df), not on the size of the table.
+    Returns the number of rows inserted (when the driver reports it, else the rows sent).
+    """
+    if not len(df):
+        return 0
+    key_cols = list(key_cols)
+    table = ensure_unique_index(engine, tablename, key_cols, df)
+    df = df.drop_duplicates(key_cols, keep='last')
+    cols = list(df.columns)
+    statement = insert_ignore(table, cols, key_cols, engine.dialect.name)
+    rows = [dict(zip(cols, row)) for row in zip(*(_db_values(df[col]) for col in cols))]
+
+    inserted = 0
+    with engine.begin() as connection:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            result = connection.execute(statement, batch)
+            inserted += result.rowcount if result.rowcount >= 0 else len(batch)
+    return inserted
+
+
 def save_analyzers_excel(strategy, instrument, excel_file):
     writer = pd.ExcelWriter(excel_file, engine='xlsxwriter')
 
@@ -84,34 +183,136 @@ def save_analyzers_excel(strategy, instrument, excel_file):
         results_df.to_excel(writer, sheet_name=analyzer_name)
 
 
-def save_analyzers(strategy, instrument, csv_file):
+# analyzers left out of the rows (their output is not a flat summary)
+SKIPPED_ANALYZERS = ('PyFolio', 'Transactions', 'PositionsValue')
+SERIES_TYPES = (list, tuple, np.ndarray, array)
+
+
+class AnalyzerSerializer(object):
+    """
+    Turns analyzer results (nested dicts, e.g. the AutoOrderedDict of TradeAnalyzer) into row columns.
+
+    The column layout of an analyzer is computed once, by walking the tree iteratively, and cached
+    per analyzer name: later results with the same shape are read through the cached paths without
+    building keys or intermediate dicts. A TradeAnalyzer with or without trades has a different shape,
+    so a few layouts are kept per name. Columns are named like flatten_dict({name: analysis}).
+    List valued outputs (e.g. TradeReturn returns_close) are not put in the row, they are returned
+    separately as arrays (series).
+    """
+    max_layouts = 8
+
+    def __init__(self, separator='_'):
+        self.separator = separator
+        self.layouts = dict()
+
+    def build_layout(self, name, analysis):
+        # nodes: (parent node, key, number of keys) of every dict, parents first; node 0 is the root
+        nodes = [(None, None, len(analysis))]
+        leaves, columns, series = [], [], []
+        stack = [(0, name, iter(analysis.items()))]
+        while stack:
+            node, prefix, items = stack[-1]
+            for key, value in items:
+                column = f'{prefix}{self.separator}{key}'
+                if isinstance(value, dict):
+                    nodes.append((node, key, len(value)))
+                    stack.append((len(nodes) - 1, column, iter(value.items())))
+                    break
+                if isinstance(value, SERIES_TYPES):
+                    series.append((node, key, column))
+                else:
+                    leaves.append((node, key))
+                    columns.append(column)
+            else:
+                stack.pop()
+        return nodes, leaves, columns, series
+
+    @staticmethod
+    def read(layout, analysis):
+        """Columns, values and series of analysis through layout, None if its shape differs."""
+        nodes, leaves, columns, series = layout
+        if not isinstance(analysis, dict) or len(analysis) != nodes[0][2]:
+            return None
+        values = [analysis]
+        try:
+            for parent, key, size in nodes[1:]:
+                value = values[parent][key]
+                if not isinstance(value, dict) or len(value) != size:
+                    return None
+                values.append(value)
+            row = []
+            for parent, key in leaves:
+                value = values[parent][key]
+                if isinstance(value, (dict,) + SERIES_TYPES):
+                    return None
+                row.append(value)
+            arrays = dict()
+            for parent, key, column in series:
+                value = values[parent][key]
+                if not isinstance(value, SERIES_TYPES):
+                    return None
+                arrays[column] = value
+        except KeyError:
+            return None
+        return columns, row, arrays
+
+    def serialize(self, name, analysis):
+        """(columns, values, series) of the analysis of analyzer `name`."""
+        if not isinstance(analysis, dict):
+            return [name], [analysis], dict()
+        layouts = self.layouts.setdefault(name, [])
+        for layout in layouts:
+            result = self.read(layout, analysis)
+            if result is not None:
+                return result
+        layout = self.build_layout(name, analysis)
+        layouts.insert(0, layout)
+        del layouts[self.max_layouts:]
+        return self.read(layout, analysis)
+
+
+analyzer_serializer = AnalyzerSerializer()
+
+
+def analyzers_row(strategy, instrument, series=None):
+    """
+    Flat row of all analyzer results of a strategy (or OptReturn). List valued results are left
+    out of the row; pass a dict as `series` to collect them (column name -> values).
+    """
     results = dict(instrument=instrument)
-    for i, analyzer in enumerate(strategy.analyzers):
-        analysis = dict()
-        analysis[type(analyzer).__name__] = analyzer.get_analysis()
+    for analyzer in strategy.analyzers:
+        name = type(analyzer).__name__
+        if name in SKIPPED_ANALYZERS:
+            continue
+        columns, values, arrays = analyzer_serializer.serialize(name, analyzer.get_analysis())
+        results.update(zip(columns, values))
+        if series is not None:
+            series.update(arrays)
+    return results
 
-        if type(analyzer).__name__ in ['PyFolio', 'Transactions', 'PositionsValue']:
-            pass
-            # returns, positions, transactions, gross_lev = analyzer.get_pf_items()
-            # pf.create_full_tear_sheet(
-            #     returns,
-            #     positions=positions,
-            #     transactions=transactions,
-            #     gross_lev=gross_lev,
-            #     round_trips=True)
-        else:
-            results.update(flatten_dict(analysis))
 
-    csv_columns = results.keys()
+def save_analyzers(strategy, instrument, csv_file):
+    write_csv_rows(csv_file, [analyzers_row(strategy, instrument)])
+
 
-    file_exists = os.path.isfile(csv_file)
+def write_csv_rows(csv_file, rows, mode='a'):
+    """
+    Write a list of result dicts to csv_file in one go.
+    The header is the union of the row keys (in order of first appearance)
+    and is only written when the file is new or opened with mode='w'.
+    """
+    if not rows:
+        return
+    csv_columns = list(dict.fromkeys(key for row in rows for key in row))
+
+    file_exists = os.path.isfile(csv_file) and mode == 'a'
     try:
-        with open(csv_file, 'a', newline='') as csv_file:
+        with open(csv_file, mode, newline='') as f:
 
-            writer = csv.DictWriter(csv_file, fieldnames=csv_columns)
+            writer = csv.DictWriter(f, fieldnames=csv_columns)
             if not file_exists:
                 writer.writeheader()
-            writer.writerow(results)
+            writer.writerows(rows)
 
     except IOError:
         print("I/O error")
@@ -120,8 +321,21 @@ def save_analyzers(strategy, instrument, csv_file):
 # code to convert ini_dict to flattened dictionary
 # default seperater '_'
 def flatten_dict(dd, separator='_', prefix=''):
-    res = {prefix + separator + str(k) if prefix else k: v for kk, vv in dd.items() for k, v in
-           flatten_dict(vv, separator, kk).items()} if isinstance(dd, dict) else {prefix: dd}
+    if not isinstance(dd, dict):
+        return {prefix: dd}
+    res = dict()
+    # depth first with a stack of item iterators, keys in the same order as a recursive walk
+    stack = [(prefix, iter(dd.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            key = f'{prefix}{separator}{k}' if prefix else k
+            if isinstance(v, dict):
+                stack.append((key, iter(v.items())))
+                break
+            res[key] = v
+        else:
+            stack.pop()
     return res
 
 
@@ -154,7 +368,7 @@ def my_position_size(cash, stop_price, entry_price, risk):
     return qty
 
 
-def save_trade_analysis(analyzer, instrument, csv_file, start_value):
+def trade_analysis_row(analyzer, instrument, start_value):
     trade_analyzer = analyzer.ta.get_analysis()
     drawdown_analyzer = analyzer.draw_down.get_analysis()
     returns_analyzer = analyzer.returns.get_analysis()
@@ -199,19 +413,11 @@ def save_trade_analysis(analyzer, instrument, csv_file, start_value):
         biggest_win_pct=biggest_win_pct,
         biggest_loss_pct=biggest_loss_pct,
     )
-    csv_columns = results.keys()
-
-    file_exists = os.path.isfile(csv_file)
-    try:
-        with open(csv_file, 'a', newline='') as csv_file:
+    return results
 
-            writer = csv.DictWriter(csv_file, fieldnames=csv_columns)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(results)
 
-    except IOError:
-        print("I/O error")
+def save_trade_analysis(analyzer, instrument, csv_file, start_value):
+    write_csv_rows(csv_file, [trade_analysis_row(analyzer, instrument, start_value)])
 
 
 def print_trade_analysis(analyzer):
@@ -1,26 +1,43 @@
+from array import array
+
 import backtrader as bt
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import MinMaxScaler
 from backtrader.indicators import MovingAverageBase, ExponentialSmoothing, StandardDeviation, MovAv
-from statistics import stdev
-from math import fsum, isnan
+
+from indicators import rolling
 
 
 class Slope(bt.Indicator):
+    """
+    Least squares slope of the last `period` values against x = 1..period.
+
+    next() streams each bar into a rolling.RollingSlope kernel (O(1) per bar),
+    once() computes the whole buffer with the kernel's batch API.
+    """
     lines = ('slope',)
     params = (('period', 20),)
 
     def __init__(self):
         self.addminperiod(self.params.period)
+        self.kernel = rolling.RollingSlope(self.p.period)
+        self.bar = 0
+
+    def nextstart(self):
+        self.bar = len(self)
+        self.lines.slope[0] = self.kernel.seed(self.data.get(size=self.p.period))
 
     def next(self):
-        y = self.data.get(size=self.p.period)
-        x = np.array(range(1, self.p.period + 1)).reshape(-1, 1)
-        reg = LinearRegression()  # create object for the class
-        reg.fit(x, y)
-        self.lines.slope[0] = reg.coef_[0]
-        # 💩
+        # next() runs again on the same bar when another data feed ticks, then the last update is redone
+        if len(self) == self.bar:
+            self.lines.slope[0] = self.kernel.replace(self.data[0])
+        else:
+            self.bar = len(self)
+            self.lines.slope[0] = self.kernel.update(self.data[0])
+
+    def once(self, start, end):
+        darray = np.frombuffer(self.data.array, dtype=float)
+        slope = self.kernel.compute(darray[start - self.p.period + 1:end])
+        self.lines.slope.array[start:end] = array('d', slope[self.p.period - 1:])
 
 
 # class MACD(Indicator):
@@ -34,6 +51,25 @@ class Slope(bt.Indicator):
 #         self.l.signal = EMA(self.l.macd, period=self.p.period_signal)
 #         self.l.histo = self.l.macd - self.l.signal
 
+class WarmUp(bt.Indicator):
+    """
+    Computes nothing: holds a strategy's next() back for the first `period` bars of its data, as the
+    indicators it stands in for would (e.g. when signals are precomputed outside of bt).
+    """
+    lines = ('warmup',)
+    params = (('period', 1),)
+    plotinfo = dict(plot=False)
+
+    def __init__(self):
+        self.addminperiod(self.p.period)
+
+    def next(self):
+        pass
+
+    def once(self, start, end):
+        pass
+
+
 class DummyInd(bt.Indicator):
     lines = ('dummyline',)
 
@@ -44,6 +80,13 @@ class DummyInd(bt.Indicator):
 
 
 class ExponentialMovingAverageVolatilityAdjusted(bt.Indicator):
+    """
+    EMA whose smoothing factor grows with the sample standard deviation of the last `period` values:
+    alpha = 2 / (1 + period) * (1 + 10 * stdev)
+
+    Built on a rolling.RollingStdev kernel and a rolling.EMA kernel seeded with the first value:
+    next() updates both in O(1) per bar, once() uses their batch APIs over the whole buffer.
+    """
     alias = ('EMA_VA',)
     lines = ('emava',)
     params = (('period', 20), ('coeff', 1),)
@@ -51,16 +94,33 @@ class ExponentialMovingAverageVolatilityAdjusted(bt.Indicator):
 
     def __init__(self):
         self.addminperiod(self.p.period)
+        self.stdev = rolling.RollingStdev(self.p.period)
+        self.ema = rolling.EMA(self.p.period, warmup=1)
+        self.bar = 0
+
+    def alpha(self, std):
+        return (2.0 / (1.0 + self.p.period)) * (1 + std * 10)
+
+    def nextstart(self):
+        self.bar = len(self)
+        self.ema.reset()
+        std = self.stdev.seed(self.data.get(size=self.p.period))
+        self.lines.emava[0] = self.ema.update(self.data[0], self.alpha(std))
 
     def next(self):
-        std = stdev(self.data.get(size=self.p.period))
-        alpha = (2.0 / (1.0 + self.p.period)) * (1 + std * 10)
-        alpha1 = 1 - alpha
-        # self.lines.emava[0] = fsum(self.data.get(size=self.p.period)) / self.p.period
-        if isnan(self.lines.emava[-1]):
-            self.lines.emava[0] = self.data[0]
+        # next() runs again on the same bar when another data feed ticks, then the last update is redone
+        if len(self) == self.bar:
+            std = self.stdev.replace(self.data[0])
+            self.lines.emava[0] = self.ema.replace(self.data[0], self.alpha(std))
         else:
-            self.lines.emava[0] = self.lines.emava[-1] * alpha1 + self.data[0] * alpha
+            self.bar = len(self)
+            std = self.stdev.update(self.data[0])
+            self.lines.emava[0] = self.ema.update(self.data[0], self.alpha(std))
 
-        # self.lines.emava = 1
-        # print('debug emava', self.l.emava[-1], alpha1, self.data[0], alpha)
+    def once(self, start, end):
+        period = self.p.period
+        darray = np.frombuffer(self.data.array, dtype=float)
+        alphas = self.alpha(self.stdev.compute(darray[start - period + 1:end])[period - 1:])
+        larray = self.lines.emava.array
+        emava = self.ema.compute(darray[start:end], alphas, initial=larray[start - 1] if start else float('nan'))
+        larray[start:end] = array('d', emava)
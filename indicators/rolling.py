@@ -0,0 +1,264 @@
+"""
+Rolling window kernels on NumPy ring buffers: sum, mean, variance / stdev, min / max, OLS slope and EMA.
+
+Every kernel has a streaming and a batch API:
+
+    kernel = RollingStdev(20)
+    kernel.update(x)        value over the last `period` values after pushing x (NaN until `period` values)
+    kernel.replace(x)       redo the last update with x instead (bt calls next() again on the same bar
+                            when another data feed ticks)
+    kernel.seed(values)     restart from the last `period` of values
+    kernel.compute(values)  the whole array at once, NaN for the first period - 1 values
+
+update() is O(1): running sums are moved by the value entering and the value leaving the window,
+and re-summed from the buffer every `period` updates so the rounding error does not accumulate.
+
+Equivalence with statistics / numpy / backtrader references is checked in tests/test_rolling.py.
+"""
+import operator
+from abc import ABC, abstractmethod
+from math import fsum, isnan, nan, sqrt
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _rolling(values, period, func):
+    values = np.asarray(values, dtype=float)
+    out = np.full(len(values), nan)
+    if len(values) >= period:
+        out[period - 1:] = func(sliding_window_view(values, period))
+    return out
+
+
+class RollingKernel(ABC):
+    """
+    Base kernel: ring buffer of the last `period` values. Subclasses implement _push(x, old), which
+    returns the new value given the value entering (x) and the one leaving the window (old, NaN while
+    filling up), and list in _state the attributes replace() has to restore.
+    """
+    _state = ()
+
+    def __init__(self, period):
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.full(self.period, nan)
+        self.pos = 0
+        self.count = 0
+        self.value = nan
+        self._saved = None
+        for name in self._state:
+            setattr(self, name, 0.0)
+
+    def window(self):
+        """The values in the window, oldest first."""
+        return np.concatenate((self.buffer[self.pos:], self.buffer[:self.pos]))
+
+    def update(self, x, *args):
+        old = float(self.buffer[self.pos])
+        self._saved = (old, self.value) + tuple(getattr(self, name) for name in self._state)
+        self.buffer[self.pos] = x
+        self.pos = (self.pos + 1) % self.period
+        self.count += 1
+        self.value = self._push(x, old, *args)
+        return self.value
+
+    def replace(self, x, *args):
+        if self._saved is None:
+            return self.update(x, *args)
+        old, self.value, *state = self._saved
+        for name, value in zip(self._state, state):
+            setattr(self, name, value)
+        self.count -= 1
+        self.pos = (self.pos - 1) % self.period
+        self.buffer[self.pos] = old
+        return self.update(x, *args)
+
+    def seed(self, values):
+        self.reset()
+        for x in values[-self.period:]:
+            self.update(x)
+        return self.value
+
+    @abstractmethod
+    def _push(self, x, old):
+        """New value after x entered and old left the window."""
+
+    @abstractmethod
+    def compute(self, values):
+        """Kernel over the whole of values, NaN for the first period - 1."""
+
+
+class RollingSum(RollingKernel):
+    _state = ('total',)
+
+    def _push(self, x, old):
+        if self.count <= self.period:
+            self.total += x
+        elif self.count % self.period == 0:
+            self.total = fsum(self.buffer.tolist())
+        else:
+            self.total += x - old
+        return self.total if self.count >= self.period else nan
+
+    def compute(self, values):
+        return _rolling(values, self.period, lambda w: w.sum(axis=1))
+
+
+class RollingMean(RollingSum):
+
+    def _push(self, x, old):
+        return super(RollingMean, self)._push(x, old) / self.period
+
+    def compute(self, values):
+        return _rolling(values, self.period, lambda w: w.mean(axis=1))
+
+
+class RollingVariance(RollingKernel):
+    """Variance with `ddof` delta degrees of freedom (1: sample variance as statistics.variance, 0: population)."""
+    _state = ('mean', 'm2')
+
+    def __init__(self, period, ddof=1):
+        self.ddof = ddof
+        super(RollingVariance, self).__init__(period)
+
+    def _push(self, x, old):
+        n = self.period
+        if self.count < n:
+            # Welford while the window fills up
+            delta = x - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (x - self.mean)
+            return nan
+        if self.count % n == 0:
+            window = self.buffer.tolist()
+            self.mean = fsum(window) / n
+            self.m2 = fsum((v - self.mean) ** 2 for v in window)
+        else:
+            # the value leaving the window is swapped for the new one
+            mean = self.mean
+            self.mean = mean + (x - old) / n
+            self.m2 = max(self.m2 + (x - old) * (x - self.mean + old - mean), 0.0)
+        return self.m2 / (n - self.ddof)
+
+    def compute(self, values):
+        return _rolling(values, self.period, lambda w: w.var(axis=1, ddof=self.ddof))
+
+
+class RollingStdev(RollingVariance):
+
+    def _push(self, x, old):
+        return sqrt(super(RollingStdev, self)._push(x, old))
+
+    def compute(self, values):
+        return _rolling(values, self.period, lambda w: w.std(axis=1, ddof=self.ddof))
+
+
+class RollingMax(RollingKernel):
+    """
+    Highest value of the window. The extreme and the update it came from are kept; the window is
+    only scanned again when that value leaves it.
+    """
+    _state = ('extreme', 'at')
+    better = operator.ge
+    arg = staticmethod(np.argmax)
+    reduce = staticmethod(np.max)
+
+    def _push(self, x, old):
+        if self.count == 1 or self.better(x, self.extreme):
+            self.extreme, self.at = x, self.count
+        elif self.count - self.at >= self.period:
+            window = self.window()
+            # latest occurrence, so it stays in the window the longest
+            i = self.period - 1 - int(self.arg(window[::-1]))
+            self.extreme, self.at = float(window[i]), self.count - self.period + 1 + i
+        return self.extreme if self.count >= self.period else nan
+
+    def compute(self, values):
+        return _rolling(values, self.period, lambda w: self.reduce(w, axis=1))
+
+
+class RollingMin(RollingMax):
+    better = operator.le
+    arg = staticmethod(np.argmin)
+    reduce = staticmethod(np.min)
+
+
+class RollingSlope(RollingKernel):
+    """
+    Least squares slope of the window against x = 1..period:
+    slope = (sum(x * y) - mean(x) * sum(y)) / sum((x - mean(x)) ** 2)
+    """
+    _state = ('sum_y', 'sum_xy')
+
+    def __init__(self, period):
+        super(RollingSlope, self).__init__(period)
+        x = np.arange(1, period + 1, dtype=float)
+        self.x = x
+        self.x_mean = x.mean()
+        self.sxx = ((x - self.x_mean) ** 2).sum()
+        self.weights = (x - self.x_mean) / self.sxx
+
+    def _push(self, x, old):
+        n = self.period
+        if self.count <= n:
+            self.sum_y += x
+            self.sum_xy += self.count * x
+        elif self.count % n == 0:
+            # pos is back at 0: the buffer is in window order
+            self.sum_y = self.buffer.sum()
+            self.sum_xy = np.dot(self.x, self.buffer)
+        else:
+            # shift x down by one for the values already in the window, new value enters at x = period
+            self.sum_xy += n * x - self.sum_y
+            self.sum_y += x - old
+        if self.count < n:
+            return nan
+        return float((self.sum_xy - self.x_mean * self.sum_y) / self.sxx)
+
+    def compute(self, values):
+        values = np.asarray(values, dtype=float)
+        out = np.full(len(values), nan)
+        if len(values) >= self.period:
+            out[self.period - 1:] = np.correlate(values, self.weights, mode='valid')
+        return out
+
+
+class EMA(RollingKernel):
+    """
+    Exponential moving average: value = previous * (1 - alpha) + x * alpha, alpha = 2 / (1 + period)
+    unless given. Seeded with the mean of the first `warmup` values (default period, like bt's EMA);
+    a NaN average is seeded again the same way. update(x, alpha) and compute(values, alphas) take
+    a per value alpha for adaptive averages. The ring buffer only holds the warmup values.
+    """
+
+    def __init__(self, period, alpha=None, warmup=None):
+        self.alpha = 2.0 / (1.0 + period) if alpha is None else alpha
+        super(EMA, self).__init__(warmup or period)
+
+    def _push(self, x, old, alpha=None):
+        if self.count < self.period:
+            return nan
+        if isnan(self.value):
+            return fsum(self.buffer.tolist()) / self.period
+        alpha = self.alpha if alpha is None else alpha
+        return self.value * (1.0 - alpha) + x * alpha
+
+    def compute(self, values, alphas=None, initial=nan):
+        """EMA of values; `initial` is the average before values[0] (NaN: seeded from values)."""
+        values = np.asarray(values, dtype=float).tolist()
+        alphas = [self.alpha] * len(values) if alphas is None else np.asarray(alphas, dtype=float).tolist()
+        out = np.full(len(values), nan)
+        prev = initial
+        for i, (x, alpha) in enumerate(zip(values, alphas)):
+            if i + 1 < self.period and isnan(prev):
+                continue
+            if isnan(prev):
+                prev = fsum(values[i + 1 - self.period:i + 1]) / self.period
+            else:
+                prev = prev * (1.0 - alpha) + x * alpha
+            out[i] = prev
+        return out
+
@@ -0,0 +1,77 @@
+"""
+NumPy versions of the backtrader indicators used for signal precomputation.
+
+They follow backtrader's arithmetic step by step (fsum seeded smoothing, the same
+operation order) so the values match the bt lines bit for bit.
+Leading values without enough history are NaN.
+"""
+from math import fsum
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def exp_smoothing(x, period, alpha, first=0):
+    """bt.indicators.ExponentialSmoothing: seeded with the mean of the first `period` values from index `first`."""
+    out = np.full(len(x), np.nan)
+    seed = first + period - 1
+    if seed >= len(x):
+        return out
+    values = x.tolist()
+    alpha1 = 1.0 - alpha
+    prev = fsum(values[first:seed + 1]) / period
+    out[seed] = prev
+    for i in range(seed + 1, len(values)):
+        out[i] = prev = prev * alpha1 + values[i] * alpha
+    return out
+
+
+def ema(x, period, first=0):
+    return exp_smoothing(x, period, 2.0 / (1.0 + period), first)
+
+
+def smoothed_ma(x, period, first=0):
+    return exp_smoothing(x, period, 1.0 / period, first)
+
+
+def _rolling(x, period, func):
+    out = np.full(len(x), np.nan)
+    if len(x) >= period:
+        out[period - 1:] = func(sliding_window_view(x, period), axis=1)
+    return out
+
+
+def highest(x, period):
+    return _rolling(x, period, np.max)
+
+
+def lowest(x, period):
+    return _rolling(x, period, np.min)
+
+
+def delay(x, ago):
+    """x(-ago) in backtrader: the value `ago` bars before."""
+    out = np.full(len(x), np.nan)
+    out[ago:] = x[:len(x) - ago]
+    return out
+
+
+def rsi(close, period=14, lookback=1):
+    """bt.indicators.RSI with the default smoothed moving average and safediv=False (x / 0 -> inf)."""
+    up = np.full(len(close), np.nan)
+    down = np.full(len(close), np.nan)
+    up[lookback:] = np.maximum(close[lookback:] - close[:-lookback], 0.0)
+    down[lookback:] = np.maximum(close[:-lookback] - close[lookback:], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = smoothed_ma(up, period, first=lookback) / smoothed_ma(down, period, first=lookback)
+        return 100.0 - 100.0 / (1.0 + rs)
+
+
+def ichimoku(high, low, tenkan=9, kijun=26, senkou=52, senkou_lead=26):
+    """bt.indicators.Ichimoku lines tenkan_sen, kijun_sen, senkou_span_a and senkou_span_b."""
+    tenkan_sen = (highest(high, tenkan) + lowest(low, tenkan)) / 2.0
+    kijun_sen = (highest(high, kijun) + lowest(low, kijun)) / 2.0
+    senkou_span_a = delay((tenkan_sen + kijun_sen) / 2.0, senkou_lead)
+    senkou_span_b = delay((highest(high, senkou) + lowest(low, senkou)) / 2.0, senkou_lead)
+    return dict(tenkan_sen=tenkan_sen, kijun_sen=kijun_sen,
+                senkou_span_a=senkou_span_a, senkou_span_b=senkou_span_b)
@@ -1,7 +1,11 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import asyncio
 import importlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from pprint import pprint
 
@@ -9,7 +13,8 @@ import matplotlib
 
 from bt_args import parse_args
 
-matplotlib.use('TkAgg')
+# headless unless plots are shown in a window (--show_plot)
+matplotlib.use('TkAgg' if parse_args().show_plot else 'Agg')
 
 import datetime
 import random
@@ -17,9 +22,18 @@ import random
 import backtrader as bt
 import matplotlib.pyplot as plt
 
-from helpers_functions import print_dict, save_trade_analysis, save_analyzers
+from helpers_functions import print_dict, trade_analysis_row, analyzers_row, write_csv_rows
+from plotting import PlotQueue, plot_payload
+from profiling import PhaseProfiler
+from results_store import ResultsStore
 from providers.forex.oanda_functions import get_historical_data_factory
-from providers.cryto.binance_functions import get_historical_data, binance_client, get_symbol_info
+from providers.cryto.binance_functions import get_historical_data, get_historical_arrays
+from providers.cryto.exchange_info import exchange_info
+from providers.numpy_feed import NumpyData
+from providers.shared_data import DataPlane, attach
+from providers.resample import feed_timeframe
+from providers.cryto.async_download import download_universe
+from binance.helpers import date_to_milliseconds
 import analyzers
 
 
@@ -33,13 +47,19 @@ def forex_data(instrument, start_str, end_str):
     return get_historical_data_factory(instrument, params)
 
 
-def crypto_data(instrument, start_str, end_str=None, interval='4h'):
-    # binance
-    params = dict(interval=interval, start_str=start_str, end_str=end_str)
+def crypto_data(instrument, start_str, end_str=None, interval='4h', base_interval=None):
+    # binance, resampled from base_interval bars when given
+    params = dict(interval=interval, start_str=start_str, end_str=end_str, base_interval=base_interval)
     # params = dict(interval='4h', start_str='1 year ago UTC', end_str=end_str)
     return get_historical_data(instrument, params)
 
 
+def crypto_arrays(instrument, start_str, end_str=None, interval='4h', base_interval=None):
+    # same as crypto_data as time + OHLCV numpy arrays (for NumpyData), no DataFrame in between
+    params = dict(interval=interval, start_str=start_str, end_str=end_str, base_interval=base_interval)
+    return get_historical_arrays(instrument, params)
+
+
 def save_plots(cerebro, numfigs=1, iplot=True, start=None, end=None,
                width=16, height=9, dpi=300, tight=True, use=None, file_path='', show=False, **kwargs):
     from backtrader import plot
@@ -60,7 +80,7 @@ def save_plots(cerebro, numfigs=1, iplot=True, start=None, end=None,
     for fig in figs:
         for f in fig:
             f.set_size_inches(width, height)
-            f.savefig(file_path, bbox_inches='tight')
+            f.savefig(file_path, dpi=dpi, bbox_inches='tight')
             if show:
                 plt.show()
     return figs
@@ -68,7 +88,21 @@ def save_plots(cerebro, numfigs=1, iplot=True, start=None, end=None,
 
 # saveplots(cerebro, file_path='savefig.png')  # run it
 
-def start_backtest(strategy, instrument_list, session_id=None, show_plot=False, output_path=None):
+plot_queue = None
+
+
+def get_plot_queue():
+    # background renderer of this process, created on first use
+    global plot_queue
+    if plot_queue is None:
+        args = parse_args()
+        plot_queue = PlotQueue(workers=args.plot_workers, dpi=args.dpi)
+    return plot_queue
+
+
+def start_backtest(strategy, instrument_list, session_id=None, show_plot=False, output_path=None, save_results=True,
+                   profiler=None, plot_mode=None, data_plane=None):
+    # data_plane: instrument -> providers.shared_data manifest entry, attached instead of fetched
     if session_id is None:
         session_id = ''.join([str(random.randint(0, 9)) for _ in range(4)])
     timestamp = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d%H%M%S')
@@ -78,6 +112,11 @@ def start_backtest(strategy, instrument_list, session_id=None, show_plot=False,
         output_path = 'output'
     if not Path(output_path).is_dir():
         Path(output_path).mkdir(parents=True, exist_ok=True)
+    plot_mode = plot_mode or args.plot_mode
+    if profiler is None:
+        # --profile timing / cprofile / tracemalloc, off by default
+        profiler = PhaseProfiler(enabled=args.profile != 'off', cprofile=args.profile == 'cprofile',
+                                 trace_malloc=args.profile == 'tracemalloc')
 
     # Create a cerebro entity
     cerebro = bt.Cerebro()
@@ -95,33 +134,41 @@ def start_backtest(strategy, instrument_list, session_id=None, show_plot=False,
     data = []
     granularity = args.granularity
     interval = granularity[::-1].lower()
-    if granularity == 'H1':
-        compression = 60
-    if granularity == 'H4':
-        compression = 60 * 4
+    base_interval = args.base_granularity[::-1].lower()
+    timeframe, compression = feed_timeframe(granularity)
 
     shorlisted_instruments = []
     i = 0
     for instrument in instrument_list:
-        # check if tradeable first
-        symbol_info = get_symbol_info(instrument)
-        if symbol_info.get('status') != 'TRADING' or \
-                not symbol_info.get('isSpotTradingAllowed'):
+        # check if tradeable first (cached exchange info snapshot, no request per instrument)
+        with profiler.phase('symbol_check', instrument):
+            tradeable = exchange_info.is_tradeable(instrument)
+        if not tradeable:
             continue
 
         # df = forex_data(instrument, args.start_date, args.end_date)
         try:
-            df = crypto_data(instrument, args.from_date, args.to_date, interval=interval)
+            with profiler.phase('data_fetch', instrument):
+                if data_plane and instrument in data_plane:
+                    arrays = attach(data_plane[instrument])
+                else:
+                    arrays = crypto_arrays(instrument, args.from_date, args.to_date, interval=interval,
+                                           base_interval=base_interval)
         except Exception as e:
             print(instrument, e)
             continue
-        df.dropna(inplace=True)
-        if not df.empty:
+        # stored klines never contain NaN (see get_all.klines_to_df)
+        if len(arrays['time']):
             shorlisted_instruments.append(instrument)
-            data.append(bt.feeds.PandasData(dataname=df, timeframe=bt.TimeFrame.Minutes, compression=compression))
-            cerebro.adddata(data[i], name=instrument)
+            with profiler.phase('feed_create', instrument):
+                data.append(NumpyData(dataname=arrays, timeframe=timeframe, compression=compression))
+                cerebro.adddata(data[i], name=instrument)
             i += 1
 
+    if not shorlisted_instruments:
+        print('No data available for', instrument_list)
+        return None
+
     # Set our desired cash start
     cerebro.broker.setcash(args.cash)
     cerebro.broker.set_shortcash(False)
@@ -143,100 +190,275 @@ def start_backtest(strategy, instrument_list, session_id=None, show_plot=False,
     cerebro.addanalyzer(analyzers.TradeReturn, _name="trade_return")
 
     # Run over everything
-    strategies = cerebro.run()
+    strategies = profiler.run('cerebro_run', cerebro.run)
     first_strategy = strategies[0]
 
-    for analyzer in first_strategy.analyzers:
-        analyzer.print()
+    current_instrument = shorlisted_instruments[0] if len(shorlisted_instruments) == 1 else 'multiple_instruments'
 
-    save_trade_analysis(
-        first_strategy.analyzers,
-        shorlisted_instruments,
-        f'{output_path}/analysis_{strategy.__module__}_{session_id}.csv',
-        starting_value
-    )
+    with profiler.phase('analyzers'):
+        for analyzer in first_strategy.analyzers:
+            analyzer.print()
 
-    current_instrument = shorlisted_instruments[0] if len(shorlisted_instruments) == 1 else 'multiple_instruments'
+        trade_analysis = trade_analysis_row(first_strategy.analyzers, shorlisted_instruments, starting_value)
 
-    save_analyzers(first_strategy, current_instrument,
-                   f'{output_path}/analyzers_result_{strategy.__module__}_{session_id}.csv')
+        # list valued outputs (TradeReturn) kept apart, for the results store
+        series = dict()
+        analyzers_result = analyzers_row(first_strategy, current_instrument, series)
+
+    if save_results:
+        with profiler.phase('save_results'):
+            write_csv_rows(f'{output_path}/analysis_{strategy.__module__}_{session_id}.csv', [trade_analysis])
+            write_csv_rows(f'{output_path}/analyzers_result_{strategy.__module__}_{session_id}.csv',
+                           [analyzers_result])
+            store_results(strategy, session_id, [dict(trade_analysis=trade_analysis, analyzers=analyzers_result,
+                                                      series=series)])
 
     print_dict(first_strategy.analyzers.draw_down.get_analysis())
     portfolio_value = cerebro.broker.getvalue()
     print(f'Final Portfolio Value: ${portfolio_value:.2f}')
 
-    plt.style.use('tableau-colorblind10')
-    plt.rc('grid', color='k', linestyle='-', alpha=0.1)
-    plt.rc('legend', loc='best')
-
-    plot_args = dict(style='candlestick', barup='green', bardown='red',
-                     # legendindloc='best',
-                     # legendloc='upper right',
-                     # legendloc='upper right',
-                     legenddataloc='upper right',
-                     grid=True,
-                     #  Format string for the display of ticks on the x axis
-                     fmt_x_ticks='%Y-%b-%d %H:%M',
-                     # Format string for the display of data points values
-                     fmt_x_data='%Y-%b-%d %H:%M',
-                     subplot=True,
-                     dpi=900,
-                     # numfigs=1,
-                     # plotymargin=10.0,
-                     iplot=False)
-
-    # save_plots(figs, instrument, strategy, timestamp)
-
-    #  separate plot by data feed. (if there is more than one i.e. multiple data feeds)
-    if len(first_strategy.datas) > 1:
-        for i in range(len(first_strategy.datas)):
-            for j, d in enumerate(first_strategy.datas):
-                d.plotinfo.plot = i == j
-                # only one data feed to be plot. others = False
+    payload_file = None
+    with profiler.phase('plot'):
+        if plot_mode in ('async', 'defer'):
+            # plot data saved now, rendered by a background process (async) or later by plotting.py (defer)
+            file_plot = f'{output_path}/{strategy.__module__}_{session_id}_{current_instrument}.png'
+            payload_file = plot_payload(first_strategy, file_plot[:-len('.png')] + '.plot.npz')
+            if plot_mode == 'async':
+                get_plot_queue().submit(payload_file, file_plot)
+        elif plot_mode == 'sync':
+            plt.style.use('tableau-colorblind10')
+            plt.rc('grid', color='k', linestyle='-', alpha=0.1)
+            plt.rc('legend', loc='best')
+
+            plot_args = dict(style='candlestick', barup='green', bardown='red',
+                             # legendindloc='best',
+                             # legendloc='upper right',
+                             # legendloc='upper right',
+                             legenddataloc='upper right',
+                             grid=True,
+                             #  Format string for the display of ticks on the x axis
+                             fmt_x_ticks='%Y-%b-%d %H:%M',
+                             # Format string for the display of data points values
+                             fmt_x_data='%Y-%b-%d %H:%M',
+                             subplot=True,
+                             dpi=args.dpi,
+                             # numfigs=1,
+                             # plotymargin=10.0,
+                             iplot=False)
+
+            # save_plots(figs, instrument, strategy, timestamp)
+
+            #  separate plot by data feed. (if there is more than one i.e. multiple data feeds)
+            if len(first_strategy.datas) > 1:
+                for i in range(len(first_strategy.datas)):
+                    for j, d in enumerate(first_strategy.datas):
+                        d.plotinfo.plot = i == j
+                        # only one data feed to be plot. others = False
+                        # cerebro.plot(**plot_args)
+                    if show_plot:
+                        figure = cerebro.plot(**plot_args)
+            else:
                 # cerebro.plot(**plot_args)
-            if show_plot:
-                figure = cerebro.plot(**plot_args)
-    else:
-        # cerebro.plot(**plot_args)
-        asset_name = first_strategy.data0._name
-        file_plot = f'{output_path}/{strategy.__module__}_{session_id}_{asset_name}.png'
-        save_plots(cerebro, file_path=file_plot, dpi=600, show=show_plot)  # run it
+                asset_name = first_strategy.data0._name
+                file_plot = f'{output_path}/{strategy.__module__}_{session_id}_{asset_name}.png'
+                save_plots(cerebro, file_path=file_plot, dpi=args.dpi, show=show_plot)  # run it
+
+    profiler.print()
+    profiler.save(f'{output_path}/profile_{strategy.__module__}_{session_id}_{current_instrument}.json')
+
+    return dict(trade_analysis=trade_analysis, analyzers=analyzers_result, series=series, plot_payload=payload_file)
+
+
+def store_results(strategy, session_id, results):
+    """Write the results of a session to the --results_db store, in one transaction."""
+    args = parse_args()
+    if not args.results_db:
+        return
+    store = ResultsStore(args.results_db)
+    try:
+        with store.session(session_id, strategy.__module__) as session:
+            for result in results:
+                session.add(result['analyzers']['instrument'], result['trade_analysis'], result['analyzers'],
+                            series=result.get('series'))
+    finally:
+        store.close()
+
+
+def _init_worker():
+    # worker processes only save figures to file, never open a window
+    plt.switch_backend('Agg')
+
+
+def _backtest_worker(strategy, instrument, session_id, output_path, data_entry=None):
+    # async plots are queued by the parent process, workers only save the plot data
+    plot_mode = 'defer' if parse_args().plot_mode == 'async' else None
+    return start_backtest(strategy, [instrument], session_id=session_id, show_plot=False,
+                          output_path=output_path, save_results=False, plot_mode=plot_mode,
+                          data_plane={instrument: data_entry} if data_entry else None)
+
+
+def publish_instrument(plane, instrument):
+    # parent side of the data plane: the arrays are loaded once and shared with the workers,
+    # None leaves it to the worker (which then reports the error or the missing data itself)
+    args = parse_args()
+    if instrument in plane.manifest:
+        return plane.manifest[instrument]
+    if not exchange_info.is_tradeable(instrument):
+        return None
+    try:
+        arrays = crypto_arrays(instrument, args.from_date, args.to_date, interval=args.granularity[::-1].lower(),
+                               base_interval=args.base_granularity[::-1].lower())
+    except Exception as e:
+        print(instrument, e)
+        return None
+    return plane.publish(instrument, arrays) if len(arrays['time']) else None
+
+
+def json_default(value):
+    # arrays (series) as lists, anything else as its string
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def read_checkpoint(checkpoint_file):
+    records = dict()
+    if os.path.isfile(checkpoint_file):
+        with open(checkpoint_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line may be truncated if the previous run crashed while writing it
+                    continue
+                records[record['instrument']] = record
+    return records
+
+
+def resume_session_id(output_path):
+    checkpoints = sorted(Path(output_path).glob('checkpoint_*.jsonl'))
+    if not checkpoints:
+        raise FileNotFoundError(f'no checkpoint found in {output_path}')
+    return checkpoints[-1].stem[len('checkpoint_'):]
+
+
+def run_independent_accounts(strategy, instruments, session_id, output_path, workers=1, show_plot=False,
+                             data_plane=None):
+    """
+    Run start_backtest for each instrument on its own account, spread over `workers` processes.
+
+    With workers, the parent loads each instrument once into shared memory (providers.shared_data)
+    and the workers attach to it, so the history is in memory once whatever the number of workers.
+    Pass a DataPlane to keep it for further runs over the same instruments (e.g. other strategies),
+    by default the shared memory is freed when the run is done.
+
+    Only this (parent) process writes: every finished instrument is appended to
+    checkpoint_<session_id>.jsonl, and instruments already in the checkpoint are skipped,
+    so an interrupted sweep resumes by calling this again with the same output_path and session_id.
+    The analysis_*.csv and analyzers_result_*.csv files are written once at the end.
+    """
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    checkpoint_file = f'{output_path}/checkpoint_{session_id}.jsonl'
+    records = read_checkpoint(checkpoint_file)
+    pending = [instrument for instrument in instruments
+               if records.get(instrument, {}).get('status') not in ('done', 'empty')]
+    print(f'{len(instruments) - len(pending)} instruments already completed, {len(pending)} to run')
+
+    with open(checkpoint_file, 'a') as checkpoint:
+
+        def record(instrument, result=None, error=None):
+            status = 'error' if error else 'done' if result else 'empty'
+            records[instrument] = dict(instrument=instrument, status=status, result=result, error=error)
+            checkpoint.write(json.dumps(records[instrument], default=json_default) + '\n')
+            checkpoint.flush()
+
+        if workers > 1:
+            plane = data_plane if data_plane is not None else DataPlane()
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                    # published one at a time, the workers start on the first ones while the rest load
+                    futures = {executor.submit(_backtest_worker, strategy, instrument, session_id, output_path,
+                                               publish_instrument(plane, instrument)): instrument
+                               for instrument in pending}
+                    for future in as_completed(futures):
+                        instrument = futures[future]
+                        try:
+                            result = future.result()
+                            record(instrument, result=result)
+                            if result and result.get('plot_payload') and parse_args().plot_mode == 'async':
+                                payload_file = result['plot_payload']
+                                get_plot_queue().submit(payload_file, payload_file[:-len('.plot.npz')] + '.png')
+                        except Exception as e:
+                            print(instrument)
+                            print(e)
+                            record(instrument, error=str(e))
+            finally:
+                if data_plane is None:
+                    plane.close()
+        else:
+            for instrument in pending:
+                try:
+                    record(instrument, result=start_backtest(strategy,
+                                                             [instrument],
+                                                             session_id=session_id,
+                                                             show_plot=show_plot,
+                                                             output_path=output_path,
+                                                             save_results=False))
+                except Exception as e:
+                    print(instrument)
+                    print(e)
+                    record(instrument, error=str(e))
+
+    results = [records[instrument]['result'] for instrument in instruments
+               if records.get(instrument, {}).get('result')]
+    write_csv_rows(f'{output_path}/analysis_{strategy.__module__}_{session_id}.csv',
+                   [result['trade_analysis'] for result in results], mode='w')
+    write_csv_rows(f'{output_path}/analyzers_result_{strategy.__module__}_{session_id}.csv',
+                   [result['analyzers'] for result in results], mode='w')
+    store_results(strategy, session_id, results)
+    return results
 
 
 if __name__ == '__main__':
     # 😏
 
     # parse arguments
-    args = parse_args()
+    args = parse_args(strict=True)
     # get_instruments()
     session_id = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d%H%M%S')
-    all_tickers = binance_client.get_all_tickers()
-    instruments = [ticker.get('symbol') for ticker in all_tickers if ticker.get('symbol').endswith('USDT')]
+    instruments = exchange_info.symbols(quote='USDT')
     # instruments = random.sample(instruments, 15)
     print(instruments)
     # instruments = ['BTCUSDT', 'ETHUSDT']
     strategy_module = importlib.import_module(args.strategy_name)
 
+    # fill the local store for the whole universe concurrently, backtests then read it without downloading
+    # (any --granularity is resampled from the --base_granularity bars)
+    asyncio.run(download_universe(instruments, args.base_granularity[::-1].lower(),
+                                  date_to_milliseconds(args.from_date), date_to_milliseconds(args.to_date),
+                                  concurrency=args.concurrency))
+
     same_account = args.same_account
     show_plot = args.show_plot
     timestamp = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d%H%M%S')
     output_path = f'output/{args.strategy_name}_{timestamp}'
+    if args.resume:
+        output_path = args.resume
+        session_id = resume_session_id(output_path)
 
     if same_account:
         # run all instruments at the same time with the same account
         start_backtest(strategy_module.MyStrategy, instruments, show_plot=show_plot, output_path=output_path)
     else:
         # run each instrument independently starting with a new account each
-        for instrument in instruments:
-            try:
-                start_backtest(strategy_module.MyStrategy,
-                               [instrument],
-                               session_id=session_id,
-                               show_plot=show_plot,
-                               output_path=output_path)
-            except Exception as e:
-                print(instrument)
-                print(e)
+        run_independent_accounts(strategy_module.MyStrategy,
+                                 instruments,
+                                 session_id=session_id,
+                                 output_path=output_path,
+                                 workers=args.workers,
+                                 show_plot=show_plot)
+
+    if plot_queue is not None:
+        print('waiting for the plots to be rendered ...')
+        plot_queue.close(wait=True)
 
     print('======== Completed ========')
     print('from date', args.from_date)
@@ -0,0 +1,247 @@
+"""
+Parameter sweep (grid or random search) over strategy params. Only sweep params the strategy reads:
+every combination is a full backtest, and a param it ignores only repeats the same run. The default
+space (SPACES) of candles_v2 is risk (position sizing) and dev_multiplier (stop loss / take profit ATR multiple).
+
+Each instrument's DataFrame is loaded once; cerebro preloads it once (optdatas) and
+cerebro.optstrategy runs the combinations in parallel worker processes, which receive the
+preloaded lines instead of fetching and parsing the data again.
+The metrics of every combination are appended to one csv as soon as it finishes, and written
+to the --results_db store (with the params) in one transaction per instrument.
+
+    python optimize.py
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import csv
+import datetime
+import importlib
+import itertools
+import random
+import time
+from pathlib import Path
+
+import backtrader as bt
+
+import analyzers
+from bt_args import parse_args
+from helpers_functions import analyzers_row, deep_get, trade_analysis_row
+from providers.resample import feed_timeframe
+from results_store import METRIC_COLUMNS, ResultsStore
+
+# strategy module -> values of the params it reads. Position sizes are capped by max_trade (account
+# value * leverage), so risk values above the cap for the instruments' stop distance repeat the same run.
+SPACES = dict(candles_v2=dict(risk=[0.005, 0.01, 0.02],
+                              dev_multiplier=[2, 3, 4]))
+
+
+def grid_combos(space):
+    """All combinations of a dict of param name -> list of values, as a list of dicts."""
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+
+def random_combos(space, n, seed=None):
+    """n distinct combinations drawn uniformly from the grid, without building the whole grid."""
+    names = list(space)
+    sizes = [len(space[name]) for name in names]
+    total = 1
+    for size in sizes:
+        total *= size
+    combos = []
+    for index in random.Random(seed).sample(range(total), min(n, total)):
+        combo = dict()
+        for name, size in zip(reversed(names), reversed(sizes)):
+            index, position = divmod(index, size)
+            combo[name] = space[name][position]
+        combos.append({name: combo[name] for name in names})
+    return combos
+
+
+def metrics_row(strategy, instrument, start_value):
+    """Sharpe, SQN, drawdown and returns of one finished run (strategy or OptReturn)."""
+    result = strategy.analyzers
+    trade_analysis = trade_analysis_row(result, instrument, start_value)
+    drawdown = result.draw_down.get_analysis()
+    returns = result.returns.get_analysis()
+    row = dict(instrument=instrument)
+    row.update(strategy.p.opt_combo or dict())
+    row.update(sharpe=result.sharpe.get_analysis().get('sharperatio'),
+               sqn=result.sqn.get_analysis().get('sqn'),
+               max_drawdown=deep_get(drawdown, 'max.drawdown'),
+               max_drawdown_len=deep_get(drawdown, 'max.len'),
+               returns_total=returns.get('rtot'),
+               returns_annual=returns.get('rnorm100'),
+               total_closed=trade_analysis['total_closed'],
+               winning_pct=trade_analysis['winning_pct'],
+               pnl_net=trade_analysis['pnl_net'],
+               expectancy=trade_analysis['expectancy'])
+    return row
+
+
+class ResultsTable(object):
+    """
+    Csv file the optimization results are streamed to, one row per finished combination.
+    Rows are flushed as they are written so a long sweep can be followed (or survive a crash).
+    """
+
+    def __init__(self, csv_file, columns):
+        self.csv_file = csv_file
+        self.columns = list(columns)
+        self.file = None
+        self.writer = None
+
+    def write(self, row):
+        if self.writer is None:
+            new_file = not Path(self.csv_file).is_file()
+            self.file = open(self.csv_file, 'a', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+            if new_file:
+                self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = self.writer = None
+
+    def __getstate__(self):
+        # cerebro (and its optcallbacks) is pickled to the worker processes, the open file stays here
+        return dict(vars(self), file=None, writer=None)
+
+
+class OptimizationProgress(object):
+    """
+    cerebro optcallback: writes the metrics of each finished run (and buffers it in the results store
+    session, if any) and keeps count of the throughput.
+    """
+
+    def __init__(self, table, instrument, start_value, total, session=None):
+        self.table = table
+        self.instrument = instrument
+        self.start_value = start_value
+        self.total = total
+        self.session = session
+        self.runs = 0
+        self.start_time = time.perf_counter()
+
+    def __call__(self, strategies):
+        for strategy in strategies:
+            self.table.write(metrics_row(strategy, self.instrument, self.start_value))
+            if self.session is not None:
+                trade_analysis = trade_analysis_row(strategy.analyzers, self.instrument, self.start_value)
+                series = dict()
+                analyzers_result = analyzers_row(strategy, self.instrument, series)
+                self.session.add(self.instrument, trade_analysis, analyzers_result, params=strategy.p.opt_combo,
+                                 series=series)
+        self.runs += 1
+        if self.runs % 10 == 0 or self.runs == self.total:
+            print(f'{self.instrument} {self.runs}/{self.total} runs, {self.runs_per_minute():.1f} runs/min')
+
+    def runs_per_minute(self):
+        elapsed = time.perf_counter() - self.start_time
+        return 60 * self.runs / elapsed if elapsed else 0.0
+
+
+def optimize_instrument(strategy, instrument, df, combos, table, granularity, workers=None, session=None,
+                        **strategy_kwargs):
+    """
+    Run strategy on one instrument for every combination in combos, `workers` processes at a time
+    (None for all cores). The runs buffered in `session` are written when the instrument is done.
+    Returns the number of runs per minute.
+    """
+    args = parse_args()
+    timeframe, compression = feed_timeframe(granularity)
+    cerebro = bt.Cerebro(stdstats=False, optdatas=True, optreturn=True, maxcpus=workers)
+    cerebro.adddata(bt.feeds.PandasData(dataname=df, timeframe=timeframe, compression=compression),
+                    name=instrument)
+    cerebro.broker.setcash(args.cash)
+    cerebro.broker.set_shortcash(False)
+    cerebro.broker.setcommission(commission=args.commission, leverage=args.leverage)
+
+    # trace files off: thousands of runs would each write their own bar by bar csv
+    cerebro.optstrategy(strategy, opt_combo=combos, trace=False, **strategy_kwargs)
+
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="ta")
+    cerebro.addanalyzer(bt.analyzers.SQN, _name="sqn")
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe")
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="draw_down")
+    cerebro.addanalyzer(bt.analyzers.Returns, _name="returns")
+    cerebro.addanalyzer(analyzers.TradeReturn, _name="trade_return")
+
+    progress = OptimizationProgress(table, instrument, cerebro.broker.getvalue(), len(combos), session)
+    cerebro.optcallback(progress)
+    cerebro.run()
+    if session is not None:
+        session.flush()
+    return progress.runs_per_minute()
+
+
+def optimize(strategy, instruments, load_data, space, output_path, search='grid', samples=20, seed=None,
+             workers=None, granularity='H4', results_db=None, **strategy_kwargs):
+    """
+    Sweep `space` (dict of param name -> list of values) for every instrument.
+    load_data(instrument) returns the OHLCV DataFrame, or None/empty to skip the instrument.
+    With results_db (sqlite file) the runs are also stored there, under session optimize_<timestamp>.
+    """
+    combos = grid_combos(space) if search == 'grid' else random_combos(space, samples, seed)
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.strftime(datetime.datetime.now(), '%Y%m%d%H%M%S')
+    csv_file = f'{output_path}/optimization_{strategy.__module__}_{timestamp}.csv'
+    table = ResultsTable(csv_file, ['instrument'] + list(space) + METRIC_COLUMNS)
+    store = ResultsStore(results_db) if results_db else None
+    session = store.session(f'optimize_{timestamp}', strategy.__module__) if store else None
+    print(f'{len(combos)} combinations ({search} search) x {len(instruments)} instruments -> {csv_file}')
+
+    start_time = time.perf_counter()
+    runs = 0
+    try:
+        for instrument in instruments:
+            try:
+                df = load_data(instrument)
+            except Exception as e:
+                print(instrument, e)
+                continue
+            if df is None or df.dropna().empty:
+                continue
+            runs_per_minute = optimize_instrument(strategy, instrument, df.dropna(), combos, table, granularity,
+                                                  workers, session, **strategy_kwargs)
+            runs += len(combos)
+            print(f'{instrument} done, {runs_per_minute:.1f} runs/min')
+    finally:
+        table.close()
+        if store is not None:
+            store.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f'{runs} runs in {elapsed:.1f}s ({60 * runs / elapsed if elapsed else 0:.1f} runs/min)')
+    return csv_file
+
+
+if __name__ == '__main__':
+    from main import crypto_data
+
+    args = parse_args(strict=True)
+    strategy_module = importlib.import_module(args.strategy_name)
+    interval = args.granularity[::-1].lower()
+    base_interval = args.base_granularity[::-1].lower()
+    instruments = ['BTCUSDT', 'ETHUSDT']
+
+    space = SPACES.get(args.strategy_name.rsplit('.', 1)[-1])
+    if space is None:
+        raise SystemExit(f'no parameter space for {args.strategy_name}, add the params it reads to SPACES')
+
+    optimize(strategy_module.MyStrategy,
+             instruments,
+             lambda instrument: crypto_data(instrument, args.from_date, args.to_date,
+                                                interval=interval, base_interval=base_interval),
+             space,
+             output_path=f'output/optimize_{args.strategy_name}',
+             search=args.search,
+             samples=args.samples,
+             workers=args.workers,
+             granularity=args.granularity,
+             results_db=args.results_db,
+             only_long=args.only_long)
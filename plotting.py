@@ -0,0 +1,180 @@
+"""
+Plot rendering off the backtest critical path.
+
+After a run, plot_payload() copies what the figures need out of the strategy (OHLC, buy/sell marks,
+plotted indicator lines, account value) into a small .npz file. render_payload() draws it with
+the headless Agg backend, without backtrader or the strategy objects, so rendering can happen:
+
+    async  in a background process pool (PlotQueue) while the next backtests run
+    defer  later, from the saved .npz files:  python plotting.py output/<run folder> [--dpi 150]
+
+(plot mode sync keeps backtrader's own plotter inside start_backtest, off skips plots.)
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+
+EPOCH_ORDINAL = 719_163
+NS_PER_DAY = 86_400_000_000_000
+
+
+def num2datetime64(nums):
+    """bt date numbers (float days since 0001-01-01) to datetime64[ms], vectorized."""
+    ms = np.round((np.asarray(nums) - EPOCH_ORDINAL) * 86_400_000).astype(np.int64)
+    return ms.astype('datetime64[ms]')
+
+
+def _line(line, size):
+    return np.array(line.array[:size], dtype=float)
+
+
+def plot_payload(strategy, file_path):
+    """
+    Save the plot data of a finished strategy to file_path (.npz). Keys are '<data>/<series>'
+    for the datas and '<data>/ind/<indicator>/<line>' (overlay) or '<data>/sub/<indicator>/<line>'
+    (own panel) for the indicators with plotinfo.plot set, plus 'value' and 'value_datetime'.
+    """
+    arrays = dict()
+    sizes = dict()
+    for d in strategy.datas:
+        size = d.buflen()
+        sizes[id(d)] = size
+        arrays[f'{d._name}/datetime'] = _line(d.datetime, size)
+        for name in ('open', 'high', 'low', 'close'):
+            arrays[f'{d._name}/{name}'] = _line(getattr(d, name), size)
+
+    for i, indicator in enumerate(strategy.getindicators()):
+        clock = getattr(indicator, '_clock', None)
+        if not indicator.plotinfo.plot or id(clock) not in sizes:
+            continue
+        panel = 'sub' if indicator.plotinfo.subplot else 'ind'
+        label = indicator.plotinfo.plotname or type(indicator).__name__
+        for alias in indicator.lines.getlinealiases():
+            arrays[f'{clock._name}/{panel}/{i:02d} {label}/{alias}'] = \
+                _line(getattr(indicator.lines, alias), sizes[id(clock)])
+
+    for observer in strategy.getobservers():
+        name = type(observer).__name__
+        if name == 'BuySell':
+            size = sizes.get(id(observer.data), 0)
+            arrays[f'{observer.data._name}/buy'] = _line(observer.lines.buy, size)
+            arrays[f'{observer.data._name}/sell'] = _line(observer.lines.sell, size)
+        elif name in ('Broker', 'Value'):
+            size = len(strategy)
+            arrays['value'] = _line(observer.lines.value, size)
+            arrays['value_datetime'] = _line(strategy.datetime, size)
+
+    np.savez_compressed(file_path, **arrays)
+    return file_path
+
+
+def render_payload(payload_file, png_file, dpi=150, width=16, height=9):
+    """Draw every data of a payload; with several datas one png per data (<png_file stem>_<data>.png)."""
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with np.load(payload_file) as payload:
+        arrays = {key: payload[key] for key in payload.files}
+    datas = sorted({key.split('/')[0] for key in arrays if key.endswith('/close')})
+    files = []
+    for data_name in datas:
+        prefix = f'{data_name}/'
+        dt = num2datetime64(arrays[prefix + 'datetime'])
+        subplots = sorted({key.split('/')[2] for key in arrays if key.startswith(prefix + 'sub/')})
+        rows = 1 + len(subplots) + ('value' in arrays)
+        fig, axes = plt.subplots(rows, 1, sharex=True, figsize=(width, height), squeeze=False,
+                                 gridspec_kw=dict(height_ratios=[3] + [1] * (rows - 1)))
+        axes = axes[:, 0]
+
+        ax = axes[0]
+        up = arrays[prefix + 'close'] >= arrays[prefix + 'open']
+        for mask, color in ((up, 'green'), (~up, 'red')):
+            ax.vlines(dt[mask], arrays[prefix + 'low'][mask], arrays[prefix + 'high'][mask], color=color, linewidth=0.6)
+        ax.plot(dt, arrays[prefix + 'close'], color='black', linewidth=0.4)
+        for key in sorted(k for k in arrays if k.startswith(prefix + 'ind/')):
+            ax.plot(dt, arrays[key], linewidth=0.7, label=' '.join(key.split('/')[2:]).split(' ', 1)[1])
+        for name, marker, color in (('buy', '^', 'green'), ('sell', 'v', 'red')):
+            if prefix + name in arrays:
+                ax.plot(dt, arrays[prefix + name], linestyle='', marker=marker, color=color, markersize=6)
+        ax.set_title(data_name)
+
+        for ax, indicator in zip(axes[1:], subplots):
+            for key in sorted(k for k in arrays if k.startswith(f'{prefix}sub/{indicator}/')):
+                ax.plot(dt, arrays[key], linewidth=0.7, label=key.split('/')[-1])
+            ax.set_ylabel(indicator.split(' ', 1)[1], fontsize='small')
+
+        if 'value' in arrays:
+            axes[-1].plot(num2datetime64(arrays['value_datetime']), arrays['value'], color='tab:blue', linewidth=0.8)
+            axes[-1].set_ylabel('value')
+
+        for ax in axes:
+            ax.grid(True, alpha=0.1, color='k')
+            if ax.get_legend_handles_labels()[0]:
+                ax.legend(loc='upper right', fontsize='small')
+
+        file_path = png_file if len(datas) == 1 else f'{os.path.splitext(png_file)[0]}_{data_name}.png'
+        fig.savefig(file_path, dpi=dpi, bbox_inches='tight')
+        plt.close(fig)
+        files.append(file_path)
+    return files
+
+
+def _init_worker():
+    matplotlib.use('Agg')
+
+
+class PlotQueue(object):
+    """
+    Background process pool rendering payloads; submit() returns at once.
+    close(wait=True) waits for the queued plots (call it before the program exits).
+    """
+
+    def __init__(self, workers=1, dpi=150):
+        self.workers = workers
+        self.dpi = dpi
+        self.executor = None
+        self.futures = []
+
+    def submit(self, payload_file, png_file):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        future = self.executor.submit(render_payload, payload_file, png_file, self.dpi)
+        self.futures.append(future)
+        return future
+
+    def close(self, wait=True):
+        if self.executor is None:
+            return []
+        self.executor.shutdown(wait=wait)
+        self.executor = None
+        errors = [future.exception() for future in self.futures if future.done() and future.exception()]
+        for error in errors:
+            print('plot failed:', error)
+        self.futures = []
+        return errors
+
+
+def render_deferred(path, dpi=150):
+    """Render every payload (*.plot.npz) under path that has no png yet."""
+    rendered = []
+    for payload_file in sorted(Path(path).rglob('*.plot.npz')):
+        png_file = str(payload_file)[:-len('.plot.npz')] + '.png'
+        if not os.path.isfile(png_file):
+            rendered += render_payload(str(payload_file), png_file, dpi)
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the plots deferred by --plot_mode defer')
+    parser.add_argument('path', help='Output folder of the run')
+    parser.add_argument('--dpi', default=150, type=int)
+    args = parser.parse_args()
+    for file_path in render_deferred(args.path, args.dpi):
+        print(file_path)
@@ -0,0 +1,105 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class PhaseProfiler(object):
+    """
+    Opt-in per phase instrumentation of a backtest.
+
+    with profiler.phase('data_fetch', instrument): ... records wall time, CPU time (process) and the
+    change in allocated memory blocks (sys.getallocatedblocks) for the phase and instrument.
+    run(name, func) also captures func (e.g. cerebro.run) with cProfile and/or tracemalloc when asked.
+    A disabled profiler records nothing and adds no work around the phases.
+    save(file_path) writes the records, the totals per phase and the captures as json.
+    """
+
+    def __init__(self, enabled=True, cprofile=False, trace_malloc=False, top=30):
+        self.enabled = enabled
+        self.cprofile = enabled and cprofile
+        self.trace_malloc = enabled and trace_malloc
+        self.top = top
+        self.records = []
+        self.captures = dict()
+        self.profile = None
+
+    @contextmanager
+    def phase(self, name, instrument=None):
+        if not self.enabled:
+            yield
+            return
+        blocks = sys.getallocatedblocks()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append(dict(phase=name, instrument=instrument,
+                                     wall=time.perf_counter() - wall,
+                                     cpu=time.process_time() - cpu,
+                                     allocated_blocks=sys.getallocatedblocks() - blocks))
+
+    def run(self, name, func, *args, **kwargs):
+        """func(*args, **kwargs) as phase `name`, under cProfile / tracemalloc if enabled."""
+        with self.phase(name):
+            if not (self.cprofile or self.trace_malloc):
+                return func(*args, **kwargs)
+
+            if self.trace_malloc:
+                tracemalloc.start()
+            if self.cprofile:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if self.cprofile:
+                    self.profile.disable()
+                    self.captures[f'{name}_cprofile'] = self._profile_rows()
+                if self.trace_malloc:
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    self.captures[f'{name}_tracemalloc'] = dict(
+                        current_bytes=current, peak_bytes=peak,
+                        top=[dict(location=str(stat.traceback), size_bytes=stat.size, count=stat.count)
+                             for stat in snapshot.statistics('lineno')[:self.top]])
+
+    def _profile_rows(self):
+        stats = pstats.Stats(self.profile, stream=io.StringIO()).sort_stats('cumulative')
+        rows = []
+        for (file_name, line, function), (cc, nc, tt, ct, callers) in stats.stats.items():
+            rows.append(dict(function=f'{file_name}:{line}({function})', calls=nc, tottime=tt, cumtime=ct))
+        return sorted(rows, key=lambda row: row['cumtime'], reverse=True)[:self.top]
+
+    def totals(self):
+        totals = dict()
+        for record in self.records:
+            total = totals.setdefault(record['phase'], dict(wall=0.0, cpu=0.0, allocated_blocks=0, count=0))
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['allocated_blocks'] += record['allocated_blocks']
+            total['count'] += 1
+        return totals
+
+    def save(self, file_path):
+        if not self.enabled:
+            return
+        with open(file_path, 'w') as f:
+            json.dump(dict(totals=self.totals(), phases=self.records, **self.captures), f, indent=2)
+        if self.profile is not None:
+            # full profile for snakeviz / pstats next to the json
+            self.profile.dump_stats(file_path.rsplit('.', 1)[0] + '.prof')
+
+    def print(self):
+        for name, total in self.totals().items():
+            print(f"{name:<16} wall {total['wall']:8.3f}s  cpu {total['cpu']:8.3f}s  "
+                  f"blocks {total['allocated_blocks']:+9d}  x{total['count']}")
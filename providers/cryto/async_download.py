@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import aiohttp
+import pandas as pd
+
+from providers.cryto.get_all import binsizes, batch_size, first_date, klines_to_df, last_closed_bar_ms, next_cursor
+from providers.market_store import market_store
+from retry_decorator import Retry
+
+BINANCE_API_URL = 'https://api.binance.com'
+# request weight budget of the exchange (X-MBX-USED-WEIGHT-1M) and the weight of one /api/v3/klines call
+WEIGHT_PER_MINUTE = 1200
+KLINES_WEIGHT = 2
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class ServerError(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """
+    Async token bucket: `capacity` tokens, refilled continuously at `rate` tokens per second.
+    acquire(weight) waits until `weight` tokens are available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, weight=1):
+        async with self.lock:
+            self._refill()
+            while self.tokens < weight:
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= weight
+
+    def drain(self, seconds):
+        """Remove tokens worth `seconds` of refill, e.g. after the exchange answered 429 with Retry-After."""
+        self._refill()
+        self.tokens -= seconds * self.rate
+
+
+class KlinesDownloader(object):
+    """
+    Concurrent kline downloader for many symbols, writing into the market store.
+
+    At most `concurrency` requests are in flight and the request weight is kept under
+    `weight_per_minute` with a token bucket. Only the ranges missing from the store are fetched
+    (see get_all.fill_gaps). base_url can point to a local stub server.
+    """
+
+    def __init__(self, concurrency=10, weight_per_minute=WEIGHT_PER_MINUTE, request_weight=KLINES_WEIGHT,
+                 limit=batch_size, base_url=BINANCE_API_URL):
+        self.concurrency = concurrency
+        self.request_weight = request_weight
+        self.limit = limit
+        self.base_url = base_url
+        self.bucket = TokenBucket(rate=weight_per_minute / 60, capacity=weight_per_minute)
+        self.semaphore = None
+        self.session = None
+        self.bars = 0
+        self.requests = 0
+
+    # only transient failures are retried: rate limits, 5xx, connection errors and timeouts. Any other
+    # 4xx (bad symbol, bad params) raises the ClientResponseError of raise_for_status at once
+    @Retry(tries=5, exceptions=(aiohttp.ClientConnectionError, asyncio.TimeoutError, RateLimitError, ServerError),
+           delay=1, backoff=2)
+    async def get_klines(self, symbol, interval, start_ms, end_ms):
+        await self.bucket.acquire(self.request_weight)
+        params = dict(symbol=symbol, interval=interval, startTime=start_ms, endTime=end_ms, limit=self.limit)
+        async with self.semaphore:
+            async with self.session.get(f'{self.base_url}/api/v3/klines', params=params) as response:
+                self.requests += 1
+                if response.status in (418, 429):
+                    retry_after = float(response.headers.get('Retry-After', 60))
+                    self.bucket.drain(retry_after)
+                    raise RateLimitError(f'{symbol} rate limited, retry after {retry_after}s')
+                if response.status >= 500:
+                    raise ServerError(f'{symbol} server error {response.status}')
+                response.raise_for_status()
+                return await response.json()
+
+    async def fill_gaps(self, symbol, interval, start_ms, end_ms=None):
+        step = binsizes[interval] * 60_000
+        last_closed = last_closed_bar_ms(interval)
+        end_ms = last_closed if end_ms is None else min(end_ms, last_closed)
+
+        downloaded = 0
+        for gap_lo, gap_hi in market_store.missing('binance', symbol, interval,
+                                                   start_ms * 1_000_000, end_ms * 1_000_000):
+            cursor = -(-gap_lo // (step * 1_000_000)) * step
+            gap_hi_ms = gap_hi // 1_000_000
+            while cursor <= gap_hi_ms:
+                klines = await self.get_klines(symbol, interval, cursor, gap_hi_ms)
+                batch_end = next_cursor(klines, gap_hi_ms, step, self.limit)
+                market_store.write('binance', symbol, interval, klines_to_df(klines),
+                                   covered=(cursor * 1_000_000, batch_end * 1_000_000 - 1))
+                downloaded += len(klines)
+                cursor = batch_end
+        self.bars += downloaded
+        return downloaded
+
+    async def run(self, symbols, interval, start_ms, end_ms=None):
+        """
+        Download symbols concurrently. Returns dict symbol -> number of new bars
+        (or the exception raised for that symbol).
+        """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as self.session:
+            results = await asyncio.gather(*[self.fill_gaps(symbol, interval, start_ms, end_ms) for symbol in symbols],
+                                           return_exceptions=True)
+        return dict(zip(symbols, results))
+
+
+async def download_universe(symbols, interval, start_ms=None, end_ms=None, **kwargs):
+    """Fill the market store for all symbols and print the throughput in bars per second."""
+    if start_ms is None:
+        start_ms = int(pd.Timestamp(first_date).value // 1_000_000)
+    downloader = KlinesDownloader(**kwargs)
+    start_time = time.perf_counter()
+    results = await downloader.run(symbols, interval, start_ms, end_ms)
+    elapsed = time.perf_counter() - start_time
+
+    for symbol, result in results.items():
+        if isinstance(result, Exception):
+            print(symbol, result)
+    print(f'{downloader.bars} bars for {len(symbols)} symbols in {downloader.requests} requests, '
+          f'{elapsed:.1f}s ({downloader.bars / elapsed if elapsed else 0:.0f} bars/s)')
+    return results
@@ -1,57 +1,55 @@
 import random
 
 import pandas as pd
-from binance.client import Client
+from binance.helpers import date_to_milliseconds
 
-from config.keys import binance_keys
-from initialize import APP_PATH
-from providers.cryto.get_all import get_all_binance
+from providers.cryto.exchange_info import exchange_info
+from providers.cryto.get_all import get_all_binance, fill_gaps, last_closed_bar_ms
+from providers.market_store import arrays_to_df
+from providers.resample import resampler
 
-binance_api_key = binance_keys['api']
-binance_api_secret = binance_keys['secret_key']
-binance_client = Client(api_key=binance_api_key, api_secret=binance_api_secret)
 
 def get_symbol_info(symbol):
-    return binance_client.get_symbol_info(symbol)
+    # from the cached exchange info snapshot, no request per symbol
+    return exchange_info.symbol_info(symbol)
 
 def get_random_symbols(n=200, base='BTC'):
-    symbols = binance_client.get_all_tickers()
-    filtered = filter(lambda x: x['symbol'].endswith(base), symbols)
-    samples = random.sample(list(filtered), n)
+    symbols = exchange_info.symbols(quote=base)
+    samples = random.sample(symbols, n)
     final_symbols = []
     for sample in samples:
-        df = get_all_binance(sample.get('symbol'), '1d', save=True)
+        df = get_all_binance(sample, '1d')
         if df.index[0].year < 2019:
-            final_symbols.append(sample.get('symbol'))
+            final_symbols.append(sample)
     return final_symbols
 
 
-def get_historical_data(symbol, params):
-    filename = f'binance_{symbol}'
-    for _, value in params.items():
-        filename += '_' + value
-    filename += '.csv'
-
-    try:
-        df = pd.read_csv(f'{APP_PATH}/data/{filename}')
-    except FileNotFoundError:
-        dict_crypto = binance_client.get_historical_klines(symbol=symbol, **params)
-        columns = ['datetime', 'open', 'high', 'low',
-                   'close', 'volume', 'close time', 'quote asset volume',
-                   'number of trades', 'taker buy base asset volume',
-                   'taker buy quote asset volume', 'ignore']
-
-        df = pd.DataFrame(dict_crypto, columns=columns)
-        df.to_csv(f'{APP_PATH}/data/{filename}', index=False)
-
-    df['Asset'] = symbol
-    df['datetime'] = pd.to_datetime(df['datetime'], unit='ms')
-    df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].apply(pd.to_numeric,
-                                                                                                          errors='coerce')
-    df.dropna(inplace=True)
-    df.set_index('datetime', inplace=True)
-    return df[['open', 'high', 'low', 'close', 'volume']]
+def get_historical_arrays(symbol, params):
+    """
+    time + OHLCV arrays for params = dict(interval=..., start_str=..., end_str=..., base_interval=None) read
+    from the local market store. A range already stored at a finer interval that divides `interval`
+    (e.g. 1h for 4h) is resampled from it; otherwise the missing klines of base_interval
+    (default `interval`) are downloaded and resampled to `interval`.
+    """
+    interval = params['interval']
+    base_interval = params.get('base_interval') or interval
+    start_ms = date_to_milliseconds(params['start_str'])
+    end_ms = date_to_milliseconds(params['end_str']) if params.get('end_str') else None
+    start = pd.Timestamp(start_ms, unit='ms')
+    end = pd.Timestamp(last_closed_bar_ms(base_interval) if end_ms is None else end_ms, unit='ms')
+
+    arrays = resampler.read_arrays('binance', symbol, interval, start, end)
+    if arrays is not None:
+        return arrays
+    # up to the last base bar of the bar holding `end`, so that bar is complete (capped at the last closed bar)
+    last_base_bar_ms = resampler.last_base_bar('binance', interval, base_interval, end) // 1_000_000
+    fill_gaps(symbol, base_interval, start_ms, last_base_bar_ms)
+    return resampler.read_arrays('binance', symbol, interval, start, end, base=base_interval)
+
 
+def get_historical_data(symbol, params):
+    """Same as get_historical_arrays as a DataFrame."""
+    return arrays_to_df(get_historical_arrays(symbol, params))
 
 if __name__ == '__main__':
     # params = dict(interval='4h', start_str='2019-01-01', end_str='2019-03-30')
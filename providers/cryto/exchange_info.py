@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+from initialize import APP_PATH
+
+
+class ExchangeInfoCache(object):
+    """
+    Local snapshot of the Binance exchange info (the `symbols` list of GET /api/v3/exchangeInfo).
+
+    The whole list is fetched in one request, kept in a json file and indexed by symbol, so
+    status / isSpotTradingAllowed checks are dict lookups instead of one REST call per symbol
+    (python-binance's get_symbol_info downloads the full exchange info every time).
+    A snapshot older than `ttl` seconds is refreshed on first use; when the exchange cannot be
+    reached (or offline=True) the cached snapshot is used whatever its age.
+    """
+
+    def __init__(self, cache_file=None, ttl=6 * 3600, offline=False):
+        self.cache_file = cache_file or f'{APP_PATH}/data/exchange_info_binance.json'
+        self.ttl = ttl
+        self.offline = offline
+        self.fetched_at = None
+        self.by_symbol = None
+
+    def age(self):
+        return None if self.fetched_at is None else time.time() - self.fetched_at
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return False
+        with open(self.cache_file) as f:
+            snapshot = json.load(f)
+        self.fetched_at = snapshot['fetched_at']
+        self.by_symbol = {info['symbol']: info for info in snapshot['symbols']}
+        return True
+
+    def refresh(self):
+        """Download the exchange info and replace the cached snapshot."""
+        from providers.cryto.get_all import get_client
+
+        symbols = get_client().get_exchange_info()['symbols']
+        snapshot = dict(fetched_at=time.time(), symbols=symbols)
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+        self.fetched_at = snapshot['fetched_at']
+        self.by_symbol = {info['symbol']: info for info in symbols}
+
+    def index(self):
+        """dict symbol -> symbol info, loaded from the cache file or refreshed when missing/stale."""
+        if self.by_symbol is None:
+            self._load()
+        stale = self.by_symbol is None or self.age() > self.ttl
+        if stale and not self.offline:
+            try:
+                self.refresh()
+            except Exception as e:
+                if self.by_symbol is None:
+                    raise
+                # do not try again on every lookup of this process
+                self.offline = True
+                print(f'exchange info refresh failed ({e}), using the snapshot from {self.age() / 3600:.1f}h ago')
+        if self.by_symbol is None:
+            raise FileNotFoundError(f'no exchange info snapshot in {self.cache_file}')
+        return self.by_symbol
+
+    def symbol_info(self, symbol):
+        """Same dict as binance Client.get_symbol_info(symbol), None for an unknown symbol."""
+        return self.index().get(symbol)
+
+    @staticmethod
+    def _tradeable(info):
+        return info is not None and info.get('status') == 'TRADING' and bool(info.get('isSpotTradingAllowed'))
+
+    def is_tradeable(self, symbol):
+        return self._tradeable(self.index().get(symbol))
+
+    def symbols(self, quote=None, tradeable=True):
+        """Symbols quoted in `quote` (e.g. 'USDT'), only the tradeable ones by default."""
+        return [symbol for symbol, info in self.index().items()
+                if (quote is None or info.get('quoteAsset') == quote)
+                and (not tradeable or self._tradeable(info))]
+
+
+exchange_info = ExchangeInfoCache()
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    usdt = exchange_info.symbols(quote='USDT')
+    print(f'{len(usdt)} tradeable USDT symbols in {1000 * (time.perf_counter() - start):.1f}ms, '
+          f'snapshot age {exchange_info.age() / 60:.0f} min')
@@ -1,90 +1,106 @@
 # https://medium.com/swlh/retrieving-full-historical-data-for-every-cryptocurrency-on-binance-bitmex-using-the-python-apis-27b47fd8137f
 
 # IMPORTS
-import pandas as pd
-import math
-import os.path
 import time
 
+import pandas as pd
 import pendulum as pendulum
-from bitmex import bitmex
 from binance.client import Client
-from datetime import timedelta, datetime
-from dateutil import parser
-from tqdm import tqdm_notebook  # (Optional, used for progress-bars)
 
 ### API
 from config.keys import binance_keys
+from providers.market_store import market_store
 
 binance_api_key = binance_keys['api']  # Enter your own API-key here
 binance_api_secret = binance_keys['secret_key']  # Enter your own API-secret here
 
 ### CONSTANTS
-binsizes = {"1m": 1, "5m": 5, "1h": 60, "4h": 240, "1d": 1440}
-batch_size = 750
-binance_client = Client(api_key=binance_api_key, api_secret=binance_api_secret)
+binsizes = {"1m": 1, "3m": 3, "5m": 5, "15m": 15, "30m": 30, "1h": 60, "2h": 120, "4h": 240, "6h": 360,
+            "8h": 480, "12h": 720, "1d": 1440}
+batch_size = 1000
+first_date = '2017-01-01'
+_client = None
 
 
 ### FUNCTIONS
-def minutes_of_new_data(symbol, kline_size, data, source):
-    if len(data) > 0:
-        old = parser.parse(data["timestamp"].iloc[-1])
-    elif source == "binance":
-        old = datetime.strptime('1 Jan 2017', '%d %b %Y')
-    elif source == "bitmex":
-        old = \
-            bitmex_client.Trade.Trade_getBucketed(symbol=symbol, binSize=kline_size, count=1, reverse=False).result()[
-                0][0][
-                'timestamp']
-    if source == "binance": new = pd.to_datetime(binance_client.get_klines(symbol=symbol, interval=kline_size)[-1][0],
-                                                 unit='ms')
-    if source == "bitmex": new = \
-        bitmex_client.Trade.Trade_getBucketed(symbol=symbol, binSize=kline_size, count=1, reverse=True).result()[0][0][
-            'timestamp']
-    return old, new
-
-
-def get_all_binance(symbol, kline_size, save=False):
-    filename = f'data/{symbol}-{kline_size}-data.zip'
-    if os.path.isfile(filename):
-        data_df = pd.read_csv(filename)
-    else:
-        data_df = pd.DataFrame()
-    oldest_point, newest_point = minutes_of_new_data(symbol, kline_size, data_df, source="binance")
-    delta_min = (newest_point - oldest_point).total_seconds() / 60
-    available_data = math.ceil(delta_min / binsizes[kline_size])
-    if oldest_point == datetime.strptime('1 Jan 2017', '%d %b %Y'):
-        print('Downloading all available %s data for %s. Be patient..!' % (kline_size, symbol))
-    else:
-        print('Downloading %d minutes of new data available for %s, i.e. %d instances of %s data.' % (
-            delta_min, symbol, available_data, kline_size))
-    klines = binance_client.get_historical_klines(symbol, kline_size, oldest_point.strftime("%d %b %Y %H:%M:%S"),
-                                                  newest_point.strftime("%d %b %Y %H:%M:%S"))
-    data = pd.DataFrame(klines,
-                        columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_av',
-                                 'trades', 'tb_base_av', 'tb_quote_av', 'ignore'])
-    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='ms')
-    if len(data_df) > 0:
-        temp_df = pd.DataFrame(data)
-        data_df = data_df.append(temp_df)
-    else:
-        data_df = data
-    data_df.set_index('timestamp', inplace=True)
-    if save:
-        archive_name = f'{symbol}-{kline_size}-data.csv'
-        compression_options = dict(method='zip', archive_name=archive_name)
-        data_df.to_csv(filename, compression=compression_options)
-
-    print('All caught up..!')
-    return data_df
+def get_client():
+    """Binance client created on first use, Client() pings the exchange so importing this module stays offline."""
+    global _client
+    if _client is None:
+        _client = Client(api_key=binance_api_key, api_secret=binance_api_secret, requests_params=dict(timeout=30))
+    return _client
+
+
+def klines_to_df(klines):
+    columns = ['datetime', 'open', 'high', 'low',
+               'close', 'volume', 'close time', 'quote asset volume',
+               'number of trades', 'taker buy base asset volume',
+               'taker buy quote asset volume', 'ignore']
+
+    df = pd.DataFrame(klines, columns=columns)
+    df['datetime'] = pd.to_datetime(df['datetime'], unit='ms')
+    df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].apply(pd.to_numeric,
+                                                                                                          errors='coerce')
+    df.dropna(inplace=True)
+    df.set_index('datetime', inplace=True)
+    return df[['open', 'high', 'low', 'close', 'volume']]
+
+
+def last_closed_bar_ms(kline_size):
+    step = binsizes[kline_size] * 60_000
+    return (int(time.time() * 1000) // step - 1) * step
+
+
+def next_cursor(klines, gap_hi_ms, step, limit):
+    # a full batch continues after its last bar, otherwise the gap is done:
+    # no bar can open between the last requested open time and the next step
+    return klines[-1][0] + step if len(klines) == limit else (gap_hi_ms // step + 1) * step
+
+
+def fill_gaps(symbol, kline_size, start_ms, end_ms=None, limit=batch_size):
+    """
+    Download into the market store only the klines of start_ms..end_ms (open times, inclusive)
+    that are not stored yet, `limit` bars per request.
+    end_ms defaults to (and is capped at) the open time of the last closed bar.
+    Each batch is written and marked as covered as soon as it arrives, so an interrupted
+    download resumes where it stopped. Returns the number of bars downloaded.
+    """
+    step = binsizes[kline_size] * 60_000
+    last_closed = last_closed_bar_ms(kline_size)
+    end_ms = last_closed if end_ms is None else min(end_ms, last_closed)
+
+    downloaded = 0
+    for gap_lo, gap_hi in market_store.missing('binance', symbol, kline_size,
+                                               start_ms * 1_000_000, end_ms * 1_000_000):
+        cursor = -(-gap_lo // (step * 1_000_000)) * step  # first bar open time inside the gap
+        gap_hi_ms = gap_hi // 1_000_000
+        while cursor <= gap_hi_ms:
+            klines = get_client().get_klines(symbol=symbol, interval=kline_size,
+                                             startTime=cursor, endTime=gap_hi_ms, limit=limit)
+            batch_end = next_cursor(klines, gap_hi_ms, step, limit)
+            market_store.write('binance', symbol, kline_size, klines_to_df(klines),
+                               covered=(cursor * 1_000_000, batch_end * 1_000_000 - 1))
+            downloaded += len(klines)
+            cursor = batch_end
+    return downloaded
+
+
+def get_all_binance(symbol, kline_size):
+    """Full kline history of symbol since first_date, downloading only the bars not stored yet."""
+    start_ms = int(pd.Timestamp(first_date).value // 1_000_000)
+    downloaded = fill_gaps(symbol, kline_size, start_ms)
+    print(f'Downloaded {downloaded} new {kline_size} bars for {symbol}')
+    return market_store.read('binance', symbol, kline_size, start=pd.Timestamp(first_date))
 
 
 if __name__ == '__main__':
-    tickers = binance_client.get_all_tickers()
-    tickers_base_usdt = [ticker.get('symbol') for ticker in tickers if ticker.get('symbol').endswith('USDT')]
-    for symbol in tickers_base_usdt:
-        print(f'getting data for {symbol} ...')
-        start_time = pendulum.now()
-        df = get_all_binance(symbol, '1h', save=True)
-        end_time = pendulum.now()
-        print('time taken in minutes ', end_time.diff(start_time).in_minutes())
+    import asyncio
+    from providers.cryto.async_download import download_universe
+    from providers.cryto.exchange_info import exchange_info
+
+    tickers_base_usdt = exchange_info.symbols(quote='USDT')
+    print(f'getting data for {len(tickers_base_usdt)} symbols ...')
+    start_time = pendulum.now()
+    asyncio.run(download_universe(tickers_base_usdt, '1h'))
+    end_time = pendulum.now()
+    print('time taken in minutes ', end_time.diff(start_time).in_minutes())
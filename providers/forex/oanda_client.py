@@ -0,0 +1,221 @@
+"""
+Shared, pooled Oanda REST client.
+
+oandapyV20's API opens a requests.Session per instance, so building an API per call pays for a new
+TCP + TLS connection every time. get_client() returns one PooledAPI per (token, environment) and
+process: its session keeps `pool_size` connections alive, map() runs requests concurrently on them,
+and every request is timed per endpoint (client.stats.summary()).
+
+    client = get_client()
+    rv = client.request(instruments.InstrumentsCandles(instrument='EUR_USD', params=params))
+    responses = client.map(client.request, [r1, r2, r3])    # concurrently, in order
+    for rv in client.imap(client.request, requests, window=4):   # lazily, at most 4 in flight
+        ...
+    client.stats.summary()                                  # {'InstrumentsCandles': {count, errors, mean, p50, p95, max}}
+
+A local fake Oanda server (e.g. for tests) is used with api_url='http://127.0.0.1:<port>':
+
+    python providers/forex/oanda_client.py      fresh API per request vs pooled vs pooled + concurrent
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from oandapyV20 import API
+from oandapyV20.oandapyV20 import TRADING_ENVIRONMENTS
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = int(os.environ.get('OANDA_POOL_SIZE', 8))
+# e.g. http://127.0.0.1:8080 to run everything against a local fake server
+API_URL = os.environ.get('OANDA_API_URL')
+
+
+class RequestStats(object):
+    """Thread safe latencies (seconds) of the last `keep` requests per endpoint, and error counts."""
+
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=self.keep))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def add(self, name, seconds, error=False):
+        with self.lock:
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+            self.errors[name] += error
+
+    def summary(self):
+        with self.lock:
+            samples = {name: np.fromiter(values, dtype=float) for name, values in self.samples.items()}
+            counts, errors = dict(self.counts), dict(self.errors)
+        return {name: dict(count=counts[name], errors=errors[name], mean=float(a.mean()),
+                           p50=float(np.percentile(a, 50)), p95=float(np.percentile(a, 95)), max=float(a.max()))
+                for name, a in samples.items() if len(a)}
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.errors.clear()
+
+
+class PooledAPI(API):
+    """
+    oandapyV20 API on a session with a keep-alive pool of `pool_size` connections (and `retries`
+    retries of failed connections), a thread pool of the same size for map(), and per request stats.
+    api_url / stream_url point the client to another server (environment named after the url).
+    """
+
+    def __init__(self, access_token, environment='practice', pool_size=POOL_SIZE, retries=0, timeout=None,
+                 api_url=None, stream_url=None, headers=None):
+        if api_url:
+            environment = api_url
+            TRADING_ENVIRONMENTS.setdefault(environment, dict(api=api_url.rstrip('/'),
+                                                              stream=(stream_url or api_url).rstrip('/')))
+        super(PooledAPI, self).__init__(access_token=access_token, environment=environment, headers=headers,
+                                        request_params=dict(timeout=timeout) if timeout else None)
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.client.mount('https://', adapter)
+        self.client.mount('http://', adapter)
+        self.client.headers['Connection'] = 'keep-alive'
+        self.stats = RequestStats()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def request(self, endpoint):
+        start = time.perf_counter()
+        error = True
+        try:
+            response = super(PooledAPI, self).request(endpoint)
+            error = False
+            return response
+        finally:
+            self.stats.add(type(endpoint).__name__, time.perf_counter() - start, error)
+
+    @property
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix='oanda')
+            return self._executor
+
+    def map(self, func, items):
+        """[func(item) for item in items], run concurrently on the pool (at most pool_size at a time)."""
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        return list(self.executor.map(func, items))
+
+    def imap(self, func, items, window=None):
+        """
+        Lazy, ordered map(func, items) on the pool with at most `window` (default pool_size) calls
+        submitted ahead of the one being consumed, so results do not pile up when the consumer is slower.
+        """
+        items = iter(items)
+        pending = deque(self.executor.submit(func, item) for item in islice(items, window or self.pool_size))
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(self.executor.submit(func, item))
+            yield result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.client.close()
+
+
+_clients = dict()
+_clients_lock = threading.Lock()
+
+
+def get_client(access_token=None, environment='practice', **kwargs):
+    """
+    The shared PooledAPI of this process for access_token (default config.keys oanda_keys) and
+    environment / api_url (default OANDA_API_URL); kwargs (pool_size, retries, timeout) apply when it
+    is created.
+    """
+    if not kwargs.get('api_url'):
+        kwargs['api_url'] = API_URL
+    if access_token is None:
+        from config.keys import oanda_keys
+        access_token = oanda_keys['access_token']
+    # a forked process gets its own client, connections are not shared across processes
+    key = (os.getpid(), access_token, kwargs.get('api_url') or environment)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = PooledAPI(access_token, environment, **kwargs)
+        return client
+
+
+if __name__ == '__main__':
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import oandapyV20.endpoints.instruments as instruments
+
+    DELAY = 0.02
+    connections = []
+
+    class FakeOanda(BaseHTTPRequestHandler):
+        """Candles endpoint answering after DELAY seconds, on HTTP/1.1 keep-alive connections."""
+        protocol_version = 'HTTP/1.1'
+        # headers and body are separate writes: without this, delayed acks stall reused connections
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            connections.append(self.client_address)
+            super(FakeOanda, self).setup()
+
+        def do_GET(self):
+            time.sleep(DELAY)
+            instrument = self.path.split('/')[3]
+            body = json.dumps(dict(instrument=instrument, granularity='H4', candles=[
+                dict(complete=True, volume=100, time='2017-01-02T22:00:00.000000000Z',
+                     mid=dict(o='1.0', h='1.1', l='0.9', c='1.05'))])).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOanda)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    names = ['EUR_USD', 'GBP_USD', 'AUD_USD', 'NZD_USD', 'XAU_USD', 'XAG_USD', 'USD_JPY', 'USD_CAD']
+    params = dict(granularity='H4', count=1)
+
+    def candles(instrument):
+        return instruments.InstrumentsCandles(instrument=instrument, params=params)
+
+    def run(name, fetch, rounds=5):
+        del connections[:]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            responses = fetch()
+        elapsed = (time.perf_counter() - start) / rounds
+        assert [rv['instrument'] for rv in responses] == names
+        print(f'{name:<28} {len(names)} instruments  {elapsed * 1e3:7.1f}ms per round  '
+              f'{len(connections) / rounds:4.1f} connections per round')
+
+    run('new API per request', lambda: [PooledAPI('token', api_url=url, pool_size=1).request(candles(i))
+                                        for i in names])
+    client = get_client('token', api_url=url, pool_size=8)
+    run('pooled, serial', lambda: [client.request(candles(i)) for i in names])
+    run('pooled, concurrent', lambda: client.map(lambda i: client.request(candles(i)), names))
+    print({name: {key: round(value * 1e3, 2) if key not in ('count', 'errors') else value
+                  for key, value in summary.items()} for name, summary in client.stats.summary().items()}, 'ms')
+    client.close()
+    server.shutdown()
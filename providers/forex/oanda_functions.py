@@ -7,22 +7,30 @@ import os
 
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.endpoints.instruments as instruments
+import numpy as np
 import pandas as pd
-from oandapyV20 import API
 from oandapyV20.contrib.factories import InstrumentsCandlesFactory
 from oandapyV20.contrib.requests import MarketOrderRequest
 import oandapyV20.endpoints.orders as orders
 
 from config.keys import oanda_keys
+from initialize import APP_PATH
+from providers.forex.oanda_client import get_client
+from providers.market_store import COLUMNS, market_store, to_ns
+from providers.resample import resampler
 
 account_id = oanda_keys['account_id']
 access_token = oanda_keys['access_token']
 
+# candles per history request (Oanda's maximum) and history requests in flight per instrument
+CHUNK_COUNT = 5000
+CHUNK_WORKERS = 4
+RFC3339 = '%Y-%m-%dT%H:%M:%SZ'
 
 
 def get_historical_data(instrument, params):
     # Create a Data Feed
-    client = API(access_token=access_token)
+    client = get_client(access_token)
 
     r = instruments.InstrumentsCandles(instrument=instrument, params=params)
     response = client.request(r)
@@ -44,7 +52,7 @@ def get_historical_data(instrument, params):
 
 
 def get_instruments():
-    client = API(access_token=access_token)
+    client = get_client(access_token)
     r = accounts.AccountInstruments(accountID=account_id)
     rv = client.request(r)
     print(json.dumps(rv, indent=2))
@@ -53,57 +61,90 @@ def get_instruments():
             print(item['name'])
 
 
-def get_historical_data_factory(instrument, params):
-    # filename
-    p_to = params['to'][:10]
-    p_from = params['from'][:10]
+def get_historical_data_factory(instrument, params, workers=None):
+    """
+    OHLCV bars for params = {"from": ..., "to": ..., "granularity": ...} read from the local market store,
+    resampled from a finer stored granularity (e.g. H1 for H4 or D) when that covers the range.
+    A range that has not been fetched yet is imported from the matching legacy
+    data/data_oanda_*.csv file when one exists, otherwise downloaded (download_candles, `workers`
+    concurrent chunk requests, default CHUNK_WORKERS).
+    """
     p_granularity = params['granularity']
-    filename = f"data/data_oanda_{instrument}_{p_from}_{p_to}_{p_granularity}.csv"
+    p_from, p_to = params['from'], params['to']
+
+    df = resampler.read('oanda', instrument, p_granularity, p_from, p_to, tz='UTC')
+    if df is not None:
+        return df
+
+    # filename
+    filename = f"{APP_PATH}/data/data_oanda_{instrument}_{p_from[:10]}_{p_to[:10]}_{p_granularity}.csv"
     if os.path.isfile(filename):
         df2 = pd.read_csv(filename)
         df2['datetime'] = pd.to_datetime(df2['datetime'])
         df2 = df2.set_index('datetime')
-        return df2
-
-    # Create a Data Feed
-    client = API(access_token=access_token)
+        market_store.write('oanda', instrument, p_granularity, df2, covered=(p_from, p_to))
+        return market_store.read('oanda', instrument, p_granularity, p_from, p_to, tz='UTC')
 
-    df_list = []
+    download_candles(instrument, params, workers=workers or CHUNK_WORKERS)
+    return market_store.read('oanda', instrument, p_granularity, p_from, p_to, tz='UTC')
 
-    def cnv(response):
-        # for candle in response.get('candles'):
-        #     print(candle)
-        candles = [candle['mid'] for candle in response['candles']]
 
-        ts = pd.DataFrame({'datetime': [candle['time'] for candle in response['candles']]})
-
-        vol = pd.DataFrame({'volume': [candle['volume'] for candle in response['candles']]})
-
-        candles_df = pd.DataFrame(data=candles)
-        ts_df = pd.DataFrame(data=ts)
-        vol_df = pd.DataFrame(data=vol)
-
-        df = pd.concat([ts_df, candles_df, vol_df], axis=1)
-        df.rename({'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close'}, axis=1, inplace=True)
-
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df = df.set_index('datetime')
-        for col in df.columns:
-            df[col] = pd.to_numeric(df[col])
-        df_list.append(df)
+def candles_to_arrays(candles, price='mid'):
+    """
+    time (int64 UTC ns) + OHLCV (float64) arrays of the completed candles of a response, parsed in
+    one pass into a preallocated block. Returns (arrays, time of the first incomplete candle or None).
+    """
+    n = len(candles)
+    times = [None] * n
+    values = np.empty((n, len(COLUMNS)))
+    incomplete = None
+    k = 0
+    for candle in candles:
+        if not candle['complete']:
+            incomplete = incomplete or candle['time']
+            continue
+        bar = candle[price]
+        times[k] = candle['time'].rstrip('Z')
+        values[k] = (float(bar['o']), float(bar['h']), float(bar['l']), float(bar['c']), candle['volume'])
+        k += 1
+    arrays = dict(time=np.array(times[:k], dtype='datetime64[ns]').view(np.int64))
+    arrays.update(zip(COLUMNS, values[:k].T))
+    return arrays, incomplete
+
+
+def download_candles(instrument, params, workers=CHUNK_WORKERS):
+    """
+    Download the ranges of params["from"] .. params["to"] missing from the market store, in
+    InstrumentsCandlesFactory chunks of CHUNK_COUNT candles fetched `workers` at a time on the shared
+    client. Each chunk is written to the store (with its coverage) as soon as it is parsed, in order,
+    so at most `workers` responses are held and an interrupted download resumes where it stopped.
+    Returns the number of candles stored.
+    """
+    granularity = params['granularity']
+    chunk_params = dict(params, count=params.get('count', CHUNK_COUNT))
 
-    for r in InstrumentsCandlesFactory(instrument=instrument, params=params):
-        # print("FACTORY REQUEST: {} {} {}".format(r, r.__class__.__name__, r.params))
-        rv = client.request(r)
-        cnv(rv)
+    def chunks():
+        for lo, hi in market_store.missing('oanda', instrument, granularity, params['from'], params['to']):
+            gap = dict(chunk_params, **{'from': pd.Timestamp(lo).strftime(RFC3339),
+                                        'to': pd.Timestamp(hi).strftime(RFC3339)})
+            yield from InstrumentsCandlesFactory(instrument=instrument, params=gap)
 
-    df2 = pd.concat(df_list)
-    now = datetime.datetime.now()
-    dt_string = now.strftime("%Y%m%d%H%M%S")
+    client = get_client(access_token)
 
-    df2.to_csv(filename)
+    def fetch(r):
+        client.request(r)
+        return r
 
-    return df2
+    stored = 0
+    for r in client.imap(fetch, chunks(), window=workers):
+        arrays, incomplete = candles_to_arrays(r.response['candles'])
+        covered_to = to_ns(r.params['to'])
+        if incomplete:
+            # a candle still forming is left out, and its range is not marked as downloaded
+            covered_to = min(covered_to, to_ns(incomplete) - 1)
+        market_store.write_arrays('oanda', instrument, granularity, arrays, covered=(r.params['from'], covered_to))
+        stored += len(arrays['time'])
+    return stored
 
 
 def get_live_candles(instrument, params):
@@ -113,7 +154,7 @@ def get_live_candles(instrument, params):
     @param params:
     @return: dataframe of live candles data
     """
-    client = API(access_token=access_token)
+    client = get_client(access_token)
     r = instruments.InstrumentsCandles(instrument=instrument,
                                        params=params)
     client.request(r)
@@ -129,7 +170,7 @@ def get_live_candles(instrument, params):
 
 
 def order_long(instrument, units, take_profit=None, stop_loss=None):
-    api = API(access_token=oanda_keys['access_token'])
+    api = get_client(oanda_keys['access_token'])
     mkt_order_long = MarketOrderRequest(instrument=instrument,
                                         units=units,
                                         takeProfitOnFill=take_profit,
@@ -147,7 +188,7 @@ def get_account_info():
     @return: account details
     """
     r = accounts.AccountDetails(account_id)
-    client = API(access_token=access_token)
+    client = get_client(access_token)
     rv = client.request(r)
     details = rv.get('account')
     # return details.get('openTradeCount')
@@ -159,7 +200,7 @@ def get_positions():
     @return: list of positiions
     """
     r = accounts.AccountDetails(account_id)
-    client = API(access_token=access_token)
+    client = get_client(access_token)
     rv = client.request(r)
     return rv.get('account').get('positions')
 
@@ -0,0 +1,232 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from initialize import APP_PATH
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def to_ns(value):
+    """
+    Convert a date string, datetime, Timestamp or epoch-ns int to UTC nanoseconds.
+    Naive values are taken as UTC.
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(np.datetime64(ts.to_datetime64(), 'ns').astype(np.int64))
+
+
+def index_to_ns(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return np.asarray(index.values.astype('datetime64[ns]')).view(np.int64)
+
+
+def arrays_to_df(arrays, tz=None):
+    """DataFrame with a `datetime` index of time + OHLCV arrays, naive UTC unless tz is given (e.g. 'UTC')."""
+    index = pd.DatetimeIndex(np.asarray(arrays['time']).view('datetime64[ns]'), name='datetime')
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pd.DataFrame({column: np.asarray(arrays[column]) for column in COLUMNS}, index=index)
+
+
+class MarketStore(object):
+    """
+    Partitioned on-disk OHLCV store.
+
+    Layout: <root>/<source>/<symbol>/<interval>/<year>/{time,open,high,low,close,volume}.bin
+    `time` is int64 nanoseconds since epoch (UTC), the other columns are float64.
+    Columns are raw little-endian arrays read back with np.memmap, so a date range
+    only touches the yearly partitions it spans and nothing is parsed.
+
+    The time ranges that have been downloaded are kept in coverage.json next to the
+    partitions, so ranges without bars (weekends, before listing) are not fetched again.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or f'{APP_PATH}/data/store'
+
+    def path(self, source, symbol, interval):
+        return os.path.join(self.root, source, symbol, interval)
+
+    def partitions(self, source, symbol, interval):
+        path = self.path(source, symbol, interval)
+        if not os.path.isdir(path):
+            return []
+        return sorted(int(p) for p in os.listdir(path) if p.isdigit())
+
+    # ---------------------------------------------------------------- read
+
+    @staticmethod
+    def _load_column(partition_path, column, dtype):
+        file_path = os.path.join(partition_path, f'{column}.bin')
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode='r')
+
+    def _read_partition(self, partition_path):
+        arrays = dict(time=self._load_column(partition_path, 'time', np.int64))
+        for column in COLUMNS:
+            arrays[column] = self._load_column(partition_path, column, np.float64)
+        # columns are appended before `time`, so an interrupted append leaves them longer, never shorter
+        n = min(len(a) for a in arrays.values())
+        return {k: a[:n] for k, a in arrays.items()}
+
+    def read_arrays(self, source, symbol, interval, start=None, end=None):
+        """
+        Return dict of numpy arrays (time + OHLCV) for bars with start <= time <= end.
+        Arrays are read-only memory maps when the range falls in a single partition.
+        """
+        start_ns = None if start is None else to_ns(start)
+        end_ns = None if end is None else to_ns(end)
+        first_year = None if start_ns is None else pd.Timestamp(start_ns).year
+        last_year = None if end_ns is None else pd.Timestamp(end_ns).year
+
+        chunks = []
+        for year in self.partitions(source, symbol, interval):
+            if (first_year is not None and year < first_year) or (last_year is not None and year > last_year):
+                continue
+            arrays = self._read_partition(os.path.join(self.path(source, symbol, interval), str(year)))
+            times = arrays['time']
+            lo = 0 if start_ns is None else np.searchsorted(times, start_ns, side='left')
+            hi = len(times) if end_ns is None else np.searchsorted(times, end_ns, side='right')
+            if hi > lo:
+                chunks.append({k: a[lo:hi] for k, a in arrays.items()})
+
+        if not chunks:
+            arrays = dict(time=np.empty(0, dtype=np.int64))
+            arrays.update({column: np.empty(0, dtype=np.float64) for column in COLUMNS})
+            return arrays
+        if len(chunks) == 1:
+            return chunks[0]
+        return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+    def read(self, source, symbol, interval, start=None, end=None, tz=None):
+        """
+        Same as read_arrays but as a DataFrame with a `datetime` index.
+        The index is naive UTC unless tz is given (e.g. 'UTC').
+        """
+        return arrays_to_df(self.read_arrays(source, symbol, interval, start, end), tz)
+
+    # --------------------------------------------------------------- write
+
+    def write(self, source, symbol, interval, df, covered=None):
+        """
+        Store the OHLCV bars of df (datetime index) and mark `covered` = (start, end) as downloaded.
+        Bars newer than a partition's last bar are appended to its files; overlapping bars
+        replace the stored ones and only that partition is rewritten.
+        """
+        arrays = dict(time=index_to_ns(df.index))
+        arrays.update({column: df[column].to_numpy(dtype=np.float64) for column in COLUMNS})
+        self.write_arrays(source, symbol, interval, arrays, covered)
+
+    def write_arrays(self, source, symbol, interval, arrays, covered=None):
+        """Same as write for time (int64 UTC ns) + OHLCV arrays, e.g. a parsed download chunk."""
+        times = np.asarray(arrays['time'], dtype=np.int64)
+        if len(times):
+            values = {column: np.asarray(arrays[column], dtype=np.float64) for column in COLUMNS}
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            values = {k: v[order] for k, v in values.items()}
+
+            years = times.view('datetime64[ns]').astype('datetime64[Y]').astype(np.int64) + 1970
+            bounds = np.flatnonzero(np.diff(years)) + 1
+            for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+                self._write_partition(source, symbol, interval, int(years[lo]),
+                                      times[lo:hi], {k: v[lo:hi] for k, v in values.items()})
+
+        if covered is not None:
+            self.add_coverage(source, symbol, interval, *covered)
+
+    def _write_partition(self, source, symbol, interval, year, times, values):
+        partition_path = os.path.join(self.path(source, symbol, interval), str(year))
+        os.makedirs(partition_path, exist_ok=True)
+        stored = self._read_partition(partition_path)
+        stored_times = stored['time']
+
+        if not len(stored_times) or times[0] > stored_times[-1]:
+            # plain append, existing bytes are not touched
+            times, values = self._dedupe(times, values)
+            for column in COLUMNS:
+                file_path = os.path.join(partition_path, f'{column}.bin')
+                if os.path.isfile(file_path):
+                    # drop the tail of an interrupted append
+                    os.truncate(file_path, len(stored_times) * 8)
+                with open(file_path, 'ab') as f:
+                    values[column].astype('<f8').tofile(f)
+            with open(os.path.join(partition_path, 'time.bin'), 'ab') as f:
+                times.astype('<i8').tofile(f)
+            return
+
+        times = np.concatenate([np.asarray(stored_times), times])
+        values = {k: np.concatenate([np.asarray(stored[k]), v]) for k, v in values.items()}
+        order = np.argsort(times, kind='stable')
+        times, values = self._dedupe(times[order], {k: v[order] for k, v in values.items()})
+        del stored, stored_times
+
+        for column, array, dtype in [(c, values[c], '<f8') for c in COLUMNS] + [('time', times, '<i8')]:
+            file_path = os.path.join(partition_path, f'{column}.bin')
+            array.astype(dtype).tofile(file_path + '.tmp')
+            os.replace(file_path + '.tmp', file_path)
+
+    @staticmethod
+    def _dedupe(times, values):
+        # keep the last (most recently written) bar for each timestamp
+        keep = np.ones(len(times), dtype=bool)
+        keep[:-1] = times[1:] != times[:-1]
+        return times[keep], {k: v[keep] for k, v in values.items()}
+
+    # ------------------------------------------------------------ coverage
+
+    def coverage(self, source, symbol, interval):
+        """Sorted, non overlapping list of [start_ns, end_ns] ranges already downloaded."""
+        file_path = os.path.join(self.path(source, symbol, interval), 'coverage.json')
+        if not os.path.isfile(file_path):
+            return []
+        with open(file_path) as f:
+            return json.load(f)
+
+    def add_coverage(self, source, symbol, interval, start, end):
+        ranges = sorted(self.coverage(source, symbol, interval) + [[to_ns(start), to_ns(end)]])
+        merged = [ranges[0]]
+        for lo, hi in ranges[1:]:
+            if lo <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+
+        path = self.path(source, symbol, interval)
+        os.makedirs(path, exist_ok=True)
+        file_path = os.path.join(path, 'coverage.json')
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(merged, f)
+        os.replace(file_path + '.tmp', file_path)
+
+    def covers(self, source, symbol, interval, start, end):
+        return not self.missing(source, symbol, interval, start, end)
+
+    def missing(self, source, symbol, interval, start, end):
+        """List of [start_ns, end_ns] sub-ranges of start..end that have not been downloaded yet."""
+        lo, hi = to_ns(start), to_ns(end)
+        gaps = []
+        for covered_lo, covered_hi in self.coverage(source, symbol, interval):
+            if covered_hi < lo:
+                continue
+            if covered_lo > hi:
+                break
+            if covered_lo > lo:
+                gaps.append([lo, covered_lo - 1])
+            lo = covered_hi + 1
+        if lo <= hi:
+            gaps.append([lo, hi])
+        return gaps
+
+
+market_store = MarketStore()
@@ -0,0 +1,92 @@
+from array import array
+from math import fsum
+
+import backtrader as bt
+import numpy as np
+from backtrader.utils.dateintern import HOURS_PER_DAY, MINUTES_PER_DAY, SECONDS_PER_DAY, MUSECONDS_PER_DAY
+
+NS_PER_DAY = 86_400_000_000_000
+# proleptic Gregorian ordinal of 1970-01-01 (date.toordinal)
+EPOCH_ORDINAL = 719_163
+ORDINAL_BINADE = 2.0 ** 19
+
+
+def date2num_array(times):
+    """
+    bt date2num for int64 UTC nanoseconds, bit for bit.
+
+    date2num is fsum(ordinal, hour / 24, minute / 1440, second / 86400, microsecond / 86400e6).
+    For ordinals in [2**19, 2**20) (years 1436 to 2871) every result has the same ulp, so the rounded
+    time-of-day part G = fsum(2**19, ...) - 2**19 is exact and date2num = ordinal + G. G is computed
+    once per distinct time of day, the rest is vectorized.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    days, time_of_day = np.divmod(times, NS_PER_DAY)
+    ordinals = (days + EPOCH_ORDINAL).astype(np.float64)
+    if len(times) and not (ordinals.min() >= ORDINAL_BINADE and ordinals.max() < 2 * ORDINAL_BINADE - 1):
+        raise ValueError('dates outside the years 1436-2871')
+
+    unique, inverse = np.unique(time_of_day // 1000, return_inverse=True)
+    fractions = np.empty(len(unique))
+    for i, us in enumerate(unique.tolist()):
+        seconds, microsecond = divmod(us, 1_000_000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        fractions[i] = fsum((ORDINAL_BINADE, hour / HOURS_PER_DAY, minute / MINUTES_PER_DAY,
+                             second / SECONDS_PER_DAY, microsecond / MUSECONDS_PER_DAY)) - ORDINAL_BINADE
+    return ordinals + fractions[inverse.reshape(-1)]
+
+
+class NumpyData(bt.feed.DataBase):
+    """
+    backtrader feed over NumPy arrays, e.g. MarketStore.read_arrays or Resampler.read_arrays.
+
+    dataname: dict with `time` (int64 UTC nanoseconds, sorted) and float64 `open`, `high`, `low`,
+    `close`, `volume` and optionally `openinterest` arrays (missing lines stay NaN, like PandasData).
+    preload() appends the arrays to the line buffers in bulk instead of loading bar by bar;
+    with filters or tzinput set it falls back to the regular per bar load.
+    """
+    columns = ('open', 'high', 'low', 'close', 'volume', 'openinterest')
+
+    def start(self):
+        super(NumpyData, self).start()
+        arrays = self.p.dataname
+        self._datetimes = date2num_array(arrays['time'])
+        self._values = {name: np.ascontiguousarray(arrays[name], dtype=np.float64)
+                        for name in self.columns if name in arrays}
+        self._idx = -1
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._datetimes):
+            return False
+        self.lines.datetime[0] = self._datetimes[self._idx]
+        for name, values in self._values.items():
+            getattr(self.lines, name)[0] = values[self._idx]
+        return True
+
+    def preload(self):
+        lines = [getattr(self.lines, name) for name in self.lines.getlinealiases()]
+        if self._filters or self._tzinput or self._barstack or \
+                not all(isinstance(line.array, array) for line in lines):
+            return super(NumpyData, self).preload()
+
+        # same bars load() would let through: before fromdate skipped, stop at the first one after todate
+        datetimes = self._datetimes
+        lo = np.searchsorted(datetimes, self.fromdate, side='left')
+        hi = np.searchsorted(datetimes, self.todate, side='right')
+        n = max(hi - lo, 0)
+        nan = np.full(n, np.nan).tobytes()
+        for name, line in zip(self.lines.getlinealiases(), lines):
+            if name == 'datetime':
+                line.array.frombytes(datetimes[lo:hi].tobytes())
+            elif name in self._values:
+                line.array.frombytes(self._values[name][lo:hi].tobytes())
+            else:
+                line.array.frombytes(nan)
+            line.idx += n
+            line.lencount += n
+        self._idx = len(datetimes)
+
+        self._last()
+        self.home()
@@ -0,0 +1,202 @@
+import os
+import re
+from collections import OrderedDict
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from providers.market_store import arrays_to_df, market_store, to_ns
+
+# bt.feeds timeframe/compression of the --granularity values
+GRANULARITIES = dict(M1=(bt.TimeFrame.Minutes, 1), M5=(bt.TimeFrame.Minutes, 5), M15=(bt.TimeFrame.Minutes, 15),
+                     M30=(bt.TimeFrame.Minutes, 30), H1=(bt.TimeFrame.Minutes, 60), H4=(bt.TimeFrame.Minutes, 240),
+                     D1=(bt.TimeFrame.Days, 1))
+UNIT_MINUTES = dict(m=1, h=60, d=1440, w=10080)
+
+
+def interval_minutes(interval):
+    """Length in minutes of a Binance ('1m', '4h', '1d') or Oanda/--granularity ('M1', 'H4', 'D', 'D1') interval."""
+    match = re.fullmatch(r'(\d+)([mhdw])', interval) or re.fullmatch(r'([MHDW])(\d*)', interval)
+    if match is None:
+        raise ValueError(f'unknown interval {interval}')
+    if interval[0].isdigit():
+        number, unit = match.groups()
+    else:
+        unit, number = match.groups()
+    return int(number or 1) * UNIT_MINUTES[unit.lower()]
+
+
+def feed_timeframe(granularity):
+    """(bt.TimeFrame, compression) for a --granularity value."""
+    if granularity in GRANULARITIES:
+        return GRANULARITIES[granularity]
+    return bt.TimeFrame.Minutes, interval_minutes(granularity)
+
+
+def resample_arrays(arrays, minutes, tz=None, offset_minutes=0):
+    """
+    Aggregate time + OHLCV arrays (time in UTC ns, sorted) into bars of `minutes`.
+
+    Buckets start at multiples of `minutes` (+ offset_minutes) of the wall clock in `tz`
+    (UTC when None) and are labelled with their start, like the exchanges label candles.
+    One pass with np.*.reduceat, no Python loop over bars.
+    """
+    times = np.asarray(arrays['time'])
+    if len(times) == 0:
+        return {k: np.asarray(a)[:0] for k, a in arrays.items()}
+    step = minutes * 60_000_000_000
+    offset = offset_minutes * 60_000_000_000
+
+    wall = times
+    if tz is not None:
+        index = pd.DatetimeIndex(times.view('datetime64[ns]')).tz_localize('UTC').tz_convert(tz).tz_localize(None)
+        wall = np.asarray(index.values.astype('datetime64[ns]')).view(np.int64)
+    buckets = (wall - offset) // step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+
+    # label = bucket start, taken back to UTC through the first bar of the bucket (no DST ambiguity)
+    first = times[starts]
+    labels = first - (wall[starts] - offset - buckets[starts] * step)
+    return dict(time=labels,
+                open=np.asarray(arrays['open'])[starts],
+                high=np.maximum.reduceat(np.asarray(arrays['high']), starts),
+                low=np.minimum.reduceat(np.asarray(arrays['low']), starts),
+                close=np.asarray(arrays['close'])[ends],
+                volume=np.add.reduceat(np.asarray(arrays['volume']), starts))
+
+
+def bucket_end(time_ns, minutes, tz=None, offset_minutes=0):
+    """
+    UTC ns at which the bucket of `minutes` holding time_ns (as resample_arrays buckets it) ends, exclusive.
+    In `tz` the bucket is `minutes` of wall clock, so across a DST change it lasts an hour more or less.
+    """
+    step = minutes * 60_000_000_000
+    offset = offset_minutes * 60_000_000_000
+    if tz is None:
+        return ((time_ns - offset) // step + 1) * step + offset
+    wall = to_ns(pd.Timestamp(time_ns, tz='UTC').tz_convert(tz).tz_localize(None))
+    wall_end = pd.Timestamp(((wall - offset) // step + 1) * step + offset)
+    # both passes of the hour repeated when DST ends fall in the next bucket, which starts on the first one
+    return to_ns(wall_end.tz_localize(tz, ambiguous=True, nonexistent='shift_forward'))
+
+
+class Resampler(object):
+    """
+    Serves any timeframe from the finest stored bars of the market store.
+
+    For a request (source, symbol, interval, start, end) the finest stored interval that divides
+    `interval` and covers the range is aggregated with resample_arrays, so H4 or D1 backtests run from
+    stored H1 (or 1h) bars without a download and the store keeps one copy per instrument.
+    Resampled arrays are cached in memory (least recently used first out).
+    Oanda aligns candles of an hour and more at 17:00 America/New_York, Binance at 00:00 UTC.
+
+    Only complete bars are returned: a first bucket starting before `start` is dropped, and so is the
+    last one unless its base bars are stored or have been downloaded up to its end (it is still forming
+    when `end` is the last closed base bar, or the download stopped at `end`).
+    """
+    alignment = dict(oanda=('America/New_York', 17 * 60), binance=(None, 0))
+
+    def __init__(self, store=market_store, cache_size=32):
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def stored_intervals(self, source, symbol):
+        path = os.path.dirname(self.store.path(source, symbol, 'interval'))
+        if not os.path.isdir(path):
+            return []
+        intervals = []
+        for name in os.listdir(path):
+            try:
+                intervals.append((interval_minutes(name), name))
+            except ValueError:
+                continue
+        return [name for _, name in sorted(intervals)]
+
+    def bucket_alignment(self, source, minutes):
+        """(tz, offset_minutes) of the buckets of `minutes` of source, see resample_arrays."""
+        if minutes < 60:
+            return None, 0
+        tz, offset = self.alignment.get(source, (None, 0))
+        return tz, offset % minutes
+
+    def last_base_bar(self, source, interval, base, end):
+        """Open time (UTC ns) of the last `base` bar of the `interval` bar holding end."""
+        minutes = interval_minutes(interval)
+        end_ns = bucket_end(to_ns(end), minutes, *self.bucket_alignment(source, minutes))
+        return end_ns - interval_minutes(base) * 60_000_000_000
+
+    def base_interval(self, source, symbol, interval, start, end):
+        """
+        Finest stored interval that can build `interval` for the whole range, None if there is none.
+        The range runs to the last base bar of the bar holding `end`, so that bar is complete.
+        """
+        minutes = interval_minutes(interval)
+        for name in self.stored_intervals(source, symbol):
+            base_minutes = interval_minutes(name)
+            if base_minutes > minutes or minutes % base_minutes:
+                continue
+            last = end if base_minutes == minutes else self.last_base_bar(source, interval, name, end)
+            if self.store.covers(source, symbol, name, start, last):
+                return name
+        return None
+
+    def read_arrays(self, source, symbol, interval, start, end, base=None):
+        """
+        time + OHLCV arrays of the complete `interval` bars starting in start..end, None when no stored
+        interval covers it.
+        """
+        base = base or self.base_interval(source, symbol, interval, start, end)
+        if base is None:
+            return None
+        key = (source, symbol, base, interval, to_ns(start), to_ns(end))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        minutes, base_minutes = interval_minutes(interval), interval_minutes(base)
+        if minutes == base_minutes:
+            arrays = self.store.read_arrays(source, symbol, base, start, end)
+        else:
+            tz, offset = self.bucket_alignment(source, minutes)
+            # the bar holding `end` is built from its base bars up to its own end, also past `end`
+            base_arrays = self.store.read_arrays(source, symbol, base, start,
+                                                 self.last_base_bar(source, interval, base, end))
+            arrays = resample_arrays(base_arrays, minutes, tz, offset)
+            # a first bucket starting before `start` only holds part of its bars
+            keep = arrays['time'] >= key[4]
+            arrays = {k: a[keep] for k, a in arrays.items()}
+            if len(arrays['time']):
+                label = int(arrays['time'][-1])
+                last_end = bucket_end(label, minutes, tz, offset)
+                complete = base_arrays['time'][-1] >= last_end - base_minutes * 60_000_000_000 or \
+                    self.store.covers(source, symbol, base, label, last_end - 1)
+                if not complete:
+                    arrays = {k: a[:-1] for k, a in arrays.items()}
+                    # still forming: a later read with the same range may find it complete
+                    return arrays
+
+        self.cache[key] = arrays
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return arrays
+
+    def read(self, source, symbol, interval, start, end, tz=None, base=None):
+        """Same as read_arrays as a DataFrame with a `datetime` index (naive UTC unless tz is given)."""
+        arrays = self.read_arrays(source, symbol, interval, start, end, base)
+        return None if arrays is None else arrays_to_df(arrays, tz)
+
+    def feed(self, source, symbol, interval, start, end, granularity=None, **kwargs):
+        """NumpyData feed of the resampled bars, timeframe/compression taken from granularity (or interval)."""
+        from providers.numpy_feed import NumpyData
+
+        arrays = self.read_arrays(source, symbol, interval, start, end)
+        if arrays is None:
+            return None
+        timeframe, compression = feed_timeframe(granularity or interval)
+        return NumpyData(dataname=arrays, timeframe=timeframe, compression=compression, **kwargs)
+
+
+resampler = Resampler()
@@ -0,0 +1,97 @@
+"""
+Shared memory data plane: each instrument's time + OHLCV arrays are published once by the parent
+process, and worker processes attach to them without copying or parsing anything.
+
+    plane = DataPlane()
+    plane.publish('BTCUSDT', arrays)        # copies the arrays once into a shared memory block
+    entry = plane.manifest['BTCUSDT']       # small and picklable, sent to the worker
+    ...
+    arrays = attach(entry)                  # in the worker: read-only NumPy views on the block
+    plane.close()                           # parent: frees the blocks once the workers are done
+
+However many workers read an instrument, its history is in memory once; a worker only adds the
+bt line buffers of the backtest it is running.
+"""
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# blocks attached by this process, kept open for as long as views on them may exist
+_attached = dict()
+
+
+def _open(name):
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached blocks too; workers share the resource tracker of the
+        # parent (set of names), so that is a no-op and the parent's close() unregisters the block
+        return SharedMemory(name=name)
+
+
+def attach(entry):
+    """Read-only arrays (column -> np.ndarray) of a manifest entry, views on the shared block."""
+    name, layout = entry
+    shm = _attached.get(name)
+    if shm is None:
+        shm = _attached[name] = _open(name)
+    arrays = dict()
+    for column, dtype, length, offset in layout:
+        a = np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=offset)
+        a.flags.writeable = False
+        arrays[column] = a
+    return arrays
+
+
+def detach(name=None):
+    """Close the attached block `name` (all of them by default); views on it must be gone."""
+    for key in [name] if name else list(_attached):
+        shm = _attached.pop(key, None)
+        if shm is not None:
+            shm.close()
+
+
+class DataPlane(object):
+    """
+    Owner of the shared blocks, one per published key (instrument). manifest maps each key to
+    (block name, [(column, dtype, length, offset)]), all a worker needs to attach.
+    """
+
+    def __init__(self):
+        self.blocks = dict()
+        self.manifest = dict()
+
+    def publish(self, key, arrays):
+        """Copy arrays (column -> 1d array) into a new shared block; returns the manifest entry."""
+        if key in self.manifest:
+            return self.manifest[key]
+        columns = [(column, np.ascontiguousarray(a)) for column, a in arrays.items()]
+        # 8 byte aligned columns
+        sizes = [-(-a.nbytes // 8) * 8 for _, a in columns]
+        shm = SharedMemory(create=True, size=max(sum(sizes), 1))
+        layout = []
+        offset = 0
+        for (column, a), size in zip(columns, sizes):
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf, offset=offset)[:] = a
+            layout.append((column, a.dtype.str, len(a), offset))
+            offset += size
+        self.blocks[key] = shm
+        self.manifest[key] = (shm.name, layout)
+        return self.manifest[key]
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in self.blocks.values())
+
+    def close(self):
+        for shm in self.blocks.values():
+            shm.close()
+            shm.unlink()
+        self.blocks.clear()
+        self.manifest.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,281 @@
+"""
+SQLite warehouse of backtest results, instead of globbing analysis_*.csv / analyzers_result_*.csv.
+
+One row per run in `runs`: session, strategy, instrument, params (json, sorted keys) and the
+headline metrics as indexed columns; the full trade analysis and analyzers rows are kept as json.
+List valued analyzer outputs (e.g. TradeReturn returns_close) go to `run_series`, one float64 blob
+per run and name, instead of being stringified into the rows.
+Rows are written per session in one transaction, and (session, strategy, instrument, params)
+is unique, so writing a session again (e.g. --resume) replaces its rows.
+
+    store = ResultsStore()
+    with store.session(session_id, 'strategies_bt.candles_v2') as session:
+        session.add(instrument, trade_analysis, analyzers_result, series=series)
+    store.leaderboard('sharpe', per='strategy', top=5)
+
+    python results_store.py --import output            load the existing csv files
+    python results_store.py --metric sharpe --per strategy --top 5
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import datetime
+import json
+import math
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from initialize import APP_PATH
+
+# column -> key in analyzers_row (flattened analyzer names) or trade_analysis_row
+ANALYZER_METRICS = dict(sharpe='SharpeRatio_sharperatio',
+                        sqn='SQN_sqn',
+                        max_drawdown='DrawDown_max_drawdown',
+                        max_drawdown_len='DrawDown_max_len',
+                        returns_total='Returns_rtot',
+                        returns_annual='Returns_rnorm100')
+TRADE_METRICS = ('total_closed', 'winning_pct', 'pnl_net', 'expectancy')
+METRIC_COLUMNS = list(ANALYZER_METRICS) + list(TRADE_METRICS)
+KEY_COLUMNS = ('session_id', 'strategy', 'instrument', 'params')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{{}}',
+    created_at TEXT NOT NULL,
+    {', '.join(f'{column} REAL' for column in METRIC_COLUMNS)},
+    trade_analysis TEXT,
+    analyzers TEXT,
+    UNIQUE (session_id, strategy, instrument, params)
+);
+CREATE INDEX IF NOT EXISTS runs_strategy_sharpe ON runs (strategy, sharpe);
+CREATE INDEX IF NOT EXISTS runs_instrument ON runs (instrument);
+CREATE INDEX IF NOT EXISTS runs_session ON runs (session_id);
+CREATE INDEX IF NOT EXISTS runs_params ON runs (params);
+CREATE TABLE IF NOT EXISTS run_series (
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+"""
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _csv_series(row):
+    # older csv files have the list outputs stringified in their cells
+    arrays = dict()
+    for key, value in row.items():
+        if isinstance(value, str) and value.startswith('['):
+            try:
+                arrays[key] = json.loads(value.replace('nan', 'NaN'))
+            except ValueError:
+                continue
+    return arrays
+
+
+def run_row(session_id, strategy, instrument, trade_analysis, analyzers, params=None, created_at=None):
+    """Values of one `runs` row, in the column order of ResultsStore.insert_sql."""
+    trade_analysis = trade_analysis or dict()
+    analyzers = analyzers or dict()
+    metrics = [_number(analyzers.get(key)) for key in ANALYZER_METRICS.values()]
+    metrics += [_number(trade_analysis.get(key)) for key in TRADE_METRICS]
+    return (session_id, strategy, str(instrument), json.dumps(params or dict(), sort_keys=True, default=str),
+            created_at or datetime.datetime.now().isoformat(timespec='seconds'), *metrics,
+            json.dumps(trade_analysis, default=str), json.dumps(analyzers, default=str))
+
+
+class ResultsStore(object):
+    """Results database (sqlite file). The connection is opened on first use and not pickled."""
+
+    columns = (*KEY_COLUMNS, 'created_at', *METRIC_COLUMNS, 'trade_analysis', 'analyzers')
+    insert_sql = f"INSERT OR REPLACE INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    # series of the run a row replaces
+    delete_series_sql = ('DELETE FROM run_series WHERE run_id IN (SELECT run_id FROM runs WHERE '
+                         'session_id = ? AND strategy = ? AND instrument = ? AND params = ?)')
+
+    def __init__(self, db_file=None):
+        self.db_file = str(db_file or f'{APP_PATH}/output/results.db')
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            Path(self.db_file).parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_file)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getstate__(self):
+        return dict(vars(self), _connection=None)
+
+    def write(self, rows, series=None):
+        """
+        Insert run_row tuples in one transaction, with series[i] (dict of name -> values, or None)
+        the list valued outputs of rows[i].
+        """
+        if not rows:
+            return 0
+        series = series or [None] * len(rows)
+        with self.connection as connection:
+            connection.executemany(self.delete_series_sql, [row[:len(KEY_COLUMNS)] for row in rows])
+            if not any(series):
+                connection.executemany(self.insert_sql, rows)
+            else:
+                for row, arrays in zip(rows, series):
+                    run_id = connection.execute(self.insert_sql, row).lastrowid
+                    if arrays:
+                        connection.executemany('INSERT INTO run_series VALUES (?, ?, ?)', [
+                            (run_id, name, np.asarray(values, dtype=np.float64).tobytes())
+                            for name, values in arrays.items()])
+        return len(rows)
+
+    def session(self, session_id, strategy):
+        return ResultsSession(self, session_id, strategy)
+
+    # ---------------------------------------------------------------- queries
+
+    @staticmethod
+    def _where(strategy=None, instrument=None, session_id=None, min_trades=None):
+        clauses, values = [], []
+        for column, value in (('strategy', strategy), ('instrument', instrument), ('session_id', session_id)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                values.append(value)
+        if min_trades is not None:
+            clauses.append('total_closed >= ?')
+            values.append(min_trades)
+        return clauses, values
+
+    def runs(self, **filters):
+        """DataFrame of the runs (without the json columns) matching strategy / instrument / session_id / min_trades."""
+        clauses, values = self._where(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        columns = ', '.join(('run_id', *KEY_COLUMNS, 'created_at', *METRIC_COLUMNS))
+        return pd.read_sql_query(f'SELECT {columns} FROM runs {where} ORDER BY run_id', self.connection,
+                                 params=values)
+
+    def leaderboard(self, metric='sharpe', per='strategy', top=10, ascending=False, **filters):
+        """
+        Best `top` runs by `metric` for each strategy (per='strategy'), instrument, session_id or
+        overall (per=None). Runs without a value for the metric are left out.
+        """
+        if metric not in METRIC_COLUMNS:
+            raise ValueError(f'metric must be one of {METRIC_COLUMNS}')
+        if per not in (None, 'strategy', 'instrument', 'session_id'):
+            raise ValueError('per must be strategy, instrument, session_id or None')
+        clauses, values = self._where(**filters)
+        where = ' AND '.join([f'{metric} IS NOT NULL'] + clauses)
+        order = f"{metric} {'ASC' if ascending else 'DESC'}"
+        partition = f'PARTITION BY {per} ' if per else ''
+        columns = ', '.join(('run_id', *KEY_COLUMNS, *METRIC_COLUMNS))
+        sql = (f'SELECT * FROM (SELECT {columns}, ROW_NUMBER() OVER ({partition}ORDER BY {order}) AS rank '
+               f'FROM runs WHERE {where}) WHERE rank <= ? ORDER BY {per + ", " if per else ""}rank')
+        return pd.read_sql_query(sql, self.connection, params=values + [top])
+
+    def analysis(self, run_id):
+        """Full trade analysis and analyzers rows of one run."""
+        row = self.connection.execute('SELECT trade_analysis, analyzers FROM runs WHERE run_id = ?',
+                                      (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(run_id)
+        return dict(trade_analysis=json.loads(row[0]), analyzers=json.loads(row[1]))
+
+    def series(self, run_id):
+        """List valued outputs of one run, name -> float64 array."""
+        return {name: np.frombuffer(data, dtype=np.float64) for name, data in self.connection.execute(
+            'SELECT name, data FROM run_series WHERE run_id = ? ORDER BY name', (run_id,))}
+
+    # ---------------------------------------------------------------- csv import
+
+    def import_csv(self, path):
+        """
+        Load the analysis_<strategy>_<session>.csv files under path with their analyzers_result_*.csv
+        (rows paired in order, as start_backtest / run_independent_accounts write them). Returns the rows written.
+        """
+        written = 0
+        for analysis_file in sorted(Path(path).rglob('analysis_*.csv')):
+            strategy, session_id = analysis_file.stem[len('analysis_'):].rsplit('_', 1)
+            analyzers_file = analysis_file.with_name(f'analyzers_result_{strategy}_{session_id}.csv')
+            trade_rows = pd.read_csv(analysis_file).to_dict('records')
+            analyzer_rows = pd.read_csv(analyzers_file).to_dict('records') if analyzers_file.is_file() else []
+            created_at = datetime.datetime.fromtimestamp(analysis_file.stat().st_mtime).isoformat(timespec='seconds')
+            rows, series = [], []
+            for i, trade_analysis in enumerate(trade_rows):
+                analyzers = analyzer_rows[i] if i < len(analyzer_rows) else dict()
+                arrays = _csv_series(analyzers)
+                analyzers = {key: value for key, value in analyzers.items() if key not in arrays}
+                instrument = analyzers.get('instrument', trade_analysis.get('instrument'))
+                rows.append(run_row(session_id, strategy, instrument, trade_analysis, analyzers,
+                                    created_at=created_at))
+                series.append(arrays)
+            written += self.write(rows, series)
+        return written
+
+
+class ResultsSession(object):
+    """
+    Rows of one session, buffered and written in one transaction by flush() (or at the end of a
+    `with` block). Picklable, so it can live in a cerebro optcallback.
+    """
+
+    def __init__(self, store, session_id, strategy):
+        self.store = store
+        self.session_id = session_id
+        self.strategy = strategy
+        self.rows = []
+        self.series = []
+
+    def add(self, instrument, trade_analysis, analyzers, params=None, series=None):
+        self.rows.append(run_row(self.session_id, self.strategy, instrument, trade_analysis, analyzers, params))
+        self.series.append(series)
+
+    def flush(self):
+        written = self.store.write(self.rows, self.series)
+        self.rows = []
+        self.series = []
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest results store')
+    parser.add_argument('--db', default=None, help='sqlite file (default output/results.db)')
+    parser.add_argument('--import', dest='import_path', default=None,
+                        help='Load the analysis_*.csv / analyzers_result_*.csv files under this folder')
+    parser.add_argument('--metric', default='sharpe', choices=METRIC_COLUMNS)
+    parser.add_argument('--per', default='strategy', choices=['strategy', 'instrument', 'session_id', 'all'])
+    parser.add_argument('--top', default=10, type=int)
+    parser.add_argument('--min_trades', default=None, type=int)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.import_path:
+        print(f'{store.import_csv(args.import_path)} runs imported into {store.db_file}')
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(store.leaderboard(args.metric, per=None if args.per == 'all' else args.per, top=args.top,
+                                min_trades=args.min_trades))
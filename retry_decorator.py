@@ -1,35 +1,71 @@
+import asyncio
+import functools
+import random
 import time
 
 
 class Retry(object):
 	default_exceptions = (Exception,)
 
-	def __init__(self, tries, exceptions=None, delay=0):
+	def __init__(self, tries, exceptions=None, delay=0, backoff=2, max_delay=60, jitter=0.1):
 		"""
-		Decorator for retrying a function if exception occurs
+		Decorator for retrying a function or coroutine function if exception occurs
 
 		tries -- num tries
 		exceptions -- exceptions to catch
-		delay -- wait between retries
+		delay -- wait before the first retry
+		backoff -- multiplier applied to the wait after each failed try
+		max_delay -- upper bound for the wait
+		jitter -- random fraction of the wait added to it, so concurrent callers do not retry in lockstep
+
+		Coroutine functions wait with asyncio.sleep and do not block the event loop.
 		"""
 		self.tries = tries
 		if exceptions is None:
 			exceptions = Retry.default_exceptions
 		self.exceptions = exceptions
 		self.delay = delay
+		self.backoff = backoff
+		self.max_delay = max_delay
+		self.jitter = jitter
+
+	def delays(self):
+		delay = self.delay
+		for _ in range(self.tries - 1):
+			yield delay * (1 + random.uniform(0, self.jitter))
+			delay = min(delay * self.backoff, self.max_delay)
 
 	def __call__(self, f):
+		if asyncio.iscoroutinefunction(f):
+			@functools.wraps(f)
+			async def afn(*args, **kwargs):
+				delays = self.delays()
+				while True:
+					try:
+						return await f(*args, **kwargs)
+					except self.exceptions as e:
+						delay = next(delays, None)
+						if delay is None:
+							print(f'unsuccessful after {self.tries} attempts', f.__name__, e)
+							raise
+						print("Retry, exception: " + str(e))
+						await asyncio.sleep(delay)
+
+			return afn
+
+		@functools.wraps(f)
 		def fn(*args, **kwargs):
-			exception = None
-			for _ in range(self.tries):
+			delays = self.delays()
+			while True:
 				try:
 					return f(*args, **kwargs)
 				except self.exceptions as e:
+					delay = next(delays, None)
+					if delay is None:
+						# if no success after tries, raise last exception
+						print(f'unsuccessful after {self.tries} attempts', f.__name__, e)
+						raise
 					print("Retry, exception: " + str(e))
-					time.sleep(self.delay)
-					exception = e
-			# if no success after tries, raise last exception
-			print(f'unsuccessful after {self.tries} attempts', f.__name__, exception)
-			raise exception
+					time.sleep(delay)
 
 		return fn
@@ -4,7 +4,6 @@ import datetime
 import backtrader as bt
 from strategies_bt.generic import GenericStrategy
 from indicators import custom_indicators
-import pandas as pd
 
 
 class MyStrategy(GenericStrategy):
@@ -37,6 +36,7 @@ class MyStrategy(GenericStrategy):
                     add_header.append(key)
 
         self.top_five = None
+        self.add_ranker('pct_change')
         self.setup_csv_files(add_header=add_header)
 
         current_time_frame = bt.TimeFrame.Names[self.data._timeframe]
@@ -61,21 +61,11 @@ class MyStrategy(GenericStrategy):
 
     def next(self):
 
-        pct_change_list = []
-        pos = {}
-        for i, d in enumerate(self.datas):
-            dt, dn = self.datetime.datetime(0), d._name
-            pos[dn] = self.getposition(d).size
-            indicators = self.indicators[d]
-            pct_change_list.append(dict(symbol=dn, pct_change=indicators['pct_change'][0]))
-        df_pct_change = pd.DataFrame(pct_change_list)
-        df_pct_change.sort_values(by='pct_change', ascending=False, inplace=True)
-        print(df_pct_change.head())
-
         if self.top_five is None:
             return
-        self.top_five = df_pct_change[df_pct_change['pct_change'] > 0.1].head()['symbol'].to_list()
-
+        ranker = self.rankers['pct_change']
+        ranker.update()
+        self.top_five = ranker.top_names(5, threshold=0.1)
 
 
     def run_strategy(self, **kwargs):
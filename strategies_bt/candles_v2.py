@@ -2,21 +2,61 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import datetime
 import backtrader as bt
+import numpy as np
+import talib
 from strategies_bt.generic import GenericStrategy
-from indicators import custom_indicators
+from indicators import custom_indicators, vectorized
+
+
+def compute_signals(open_, high, low, close):
+    """
+    Entry/exit conditions of run_strategy for a whole price history in one vectorized pass.
+    Returns a dict of boolean arrays aligned with the input bars.
+    """
+    ichimoku = vectorized.ichimoku(high, low)
+    span_a, span_b = ichimoku['senkou_span_a'], ichimoku['senkou_span_b']
+    ema_10, ema_20, ema_50 = vectorized.ema(close, 10), vectorized.ema(close, 20), vectorized.ema(close, 50)
+    engulfing = talib.CDLENGULFING(open_, high, low, close)
+    morning_star = talib.CDLMORNINGSTAR(open_, high, low, close)
+    evening_star = talib.CDLEVENINGSTAR(open_, high, low, close)
+    hammer = talib.CDLHAMMER(open_, high, low, close)
+    shooting_star = talib.CDLSHOOTINGSTAR(open_, high, low, close)
+
+    above_cloud = (close > span_a) & (close > span_b)
+    below_cloud = (close < span_a) & (close < span_b)
+    any_bull_candles_pattern = (engulfing == 100) | (morning_star == 100) | (hammer == 100)
+    any_bear_candles_pattern = (engulfing == -100) | (evening_star == -100) | (shooting_star == -100)
+    is_uptrend = (ema_10 > ema_20) & (ema_20 > ema_50)
+    is_downtrend = (ema_10 < ema_20) & (ema_20 < ema_50)
+
+    return dict(
+        long_signal=any_bull_candles_pattern & ~any_bear_candles_pattern & above_cloud & is_uptrend,
+        short_signal=any_bear_candles_pattern & ~any_bull_candles_pattern & below_cloud & is_downtrend,
+        is_uptrend=is_uptrend,
+        is_downtrend=is_downtrend,
+        rsi_overbought=vectorized.rsi(close) > 70,
+    )
 
 
 class MyStrategy(GenericStrategy):
+    # precompute_signals: evaluate the entry/exit conditions for the whole (preloaded) history
+    # before the event loop, next() then only looks them up. Together with trace=False only the
+    # ATR is kept as a bt indicator (order sizing), so RSI is not plotted either.
+    # dev_multiplier: stop loss at dev_multiplier * ATR from the entry, take profit at twice that
+    params = dict(precompute_signals=False, dev_multiplier=3)
 
     def __init__(self, **kwargs):
         super().__init__()
         self.taken_first_profit = dict()
+        self.signals = dict()
+        self.warmup = dict()
 
         for k, v in kwargs.items():
             self.__setattr__(k, v)
 
         add_header = []
-        self.params.dev_multiplier = 3
+        # with precomputed signals and no trace the bt indicators behind the signals are not needed
+        self.signals_only = self.p.precompute_signals and not self.p.trace and self.env.params.preload
 
         for i, d in enumerate(self.datas):
             self.order_refs[d._name] = []
@@ -27,36 +67,13 @@ class MyStrategy(GenericStrategy):
 
             self.indicators[d] = dict()
             self.indicators[d]['atr'] = bt.indicators.AverageTrueRange(d)
-            self.indicators[d]['bollinger inner'] = bt.indicators.BollingerBands(d, devfactor=1)
-            self.indicators[d]['bollinger outer'] = bt.indicators.BollingerBands(d, devfactor=2)
-            self.indicators[d]['ichimoku'] = bt.indicators.Ichimoku(d)
-            self.indicators[d]['stdev'] = bt.indicators.StandardDeviation(d, period=self.p.window_s)
-            self.indicators[d]['rsi'] = bt.indicators.RelativeStrengthIndex(d)
-            self.indicators[d]['ema_50'] = bt.indicators.EMA(d, period=50)
-            self.indicators[d]['ema_20'] = bt.indicators.EMA(d, period=20)
-            self.indicators[d]['ema_10'] = bt.indicators.EMA(d, period=10)
-            self.indicators[d]['ema_15'] = bt.indicators.EMA(d, period=15)
-            self.indicators[d]['emava_15'] = custom_indicators.EMA_VA(d, period=15)
-
-            self.indicators[d]['ema_15'].plotinfo.plot = False
-            self.indicators[d]['emava_15'].plotinfo.plot = False
-            self.indicators[d]['ema_10'].plotinfo.plot = False
-            self.indicators[d]['ema_50'].plotinfo.plot = False
-            self.indicators[d]['ema_20'].plotinfo.plot = False
-            self.indicators[d]['ichimoku'].plotinfo.plot = False
-            self.indicators[d]['stdev'].plotinfo.plot = False
-            self.indicators[d]['bollinger inner'].plotinfo.plot = False
-            self.indicators[d]['bollinger outer'].plotinfo.plot = False
-
-            self.indicators[d]['bollinger inner'].plotinfo.subplot = False
-            self.indicators[d]['bollinger outer'].plotinfo.subplot = False
-            self.indicators[d]['stdev'].plotinfo.subplot = False
-
-            self.add_candles_indicators(d, candle_list=['CDLENGULFING',
-                                                        'CDLMORNINGSTAR',
-                                                        'CDLEVENINGSTAR',
-                                                        'CDLHAMMER',
-                                                        'CDLSHOOTINGSTAR'])
+            if self.signals_only:
+                # signals come from compute_signals, the other indicators would only be traced/plotted.
+                # Their warmup (the ichimoku cloud's, the longest) still holds next() back on this data
+                self.warmup[d] = custom_indicators.WarmUp(d, period=bt.indicators.Ichimoku.params.senkou +
+                                                          bt.indicators.Ichimoku.params.senkou_lead)
+            else:
+                self.add_signal_indicators(d)
 
             if i == 0:
                 for key in self.indicators[d]:
@@ -75,6 +92,38 @@ class MyStrategy(GenericStrategy):
 
         self.valid_hours = valid_candles * multiplier
 
+    def add_signal_indicators(self, d):
+        self.indicators[d]['bollinger inner'] = bt.indicators.BollingerBands(d, devfactor=1)
+        self.indicators[d]['bollinger outer'] = bt.indicators.BollingerBands(d, devfactor=2)
+        self.indicators[d]['ichimoku'] = bt.indicators.Ichimoku(d)
+        self.indicators[d]['stdev'] = bt.indicators.StandardDeviation(d, period=self.p.window_s)
+        self.indicators[d]['rsi'] = bt.indicators.RelativeStrengthIndex(d)
+        self.indicators[d]['ema_50'] = bt.indicators.EMA(d, period=50)
+        self.indicators[d]['ema_20'] = bt.indicators.EMA(d, period=20)
+        self.indicators[d]['ema_10'] = bt.indicators.EMA(d, period=10)
+        self.indicators[d]['ema_15'] = bt.indicators.EMA(d, period=15)
+        self.indicators[d]['emava_15'] = custom_indicators.EMA_VA(d, period=15)
+
+        self.indicators[d]['ema_15'].plotinfo.plot = False
+        self.indicators[d]['emava_15'].plotinfo.plot = False
+        self.indicators[d]['ema_10'].plotinfo.plot = False
+        self.indicators[d]['ema_50'].plotinfo.plot = False
+        self.indicators[d]['ema_20'].plotinfo.plot = False
+        self.indicators[d]['ichimoku'].plotinfo.plot = False
+        self.indicators[d]['stdev'].plotinfo.plot = False
+        self.indicators[d]['bollinger inner'].plotinfo.plot = False
+        self.indicators[d]['bollinger outer'].plotinfo.plot = False
+
+        self.indicators[d]['bollinger inner'].plotinfo.subplot = False
+        self.indicators[d]['bollinger outer'].plotinfo.subplot = False
+        self.indicators[d]['stdev'].plotinfo.subplot = False
+
+        self.add_candles_indicators(d, candle_list=['CDLENGULFING',
+                                                    'CDLMORNINGSTAR',
+                                                    'CDLEVENINGSTAR',
+                                                    'CDLHAMMER',
+                                                    'CDLSHOOTINGSTAR'])
+
     @property
     def description(self):
         return """
@@ -85,15 +134,38 @@ class MyStrategy(GenericStrategy):
             *) is_uptrend = ema_10 > ema_20 > ema_50
         3) bull candle patterns ENGULFING, MORNINGSTAR, HAMMER
         4) bear candle patterns ENGULTING, EVENINGSTAR, SHOOTINGSTAR
-        5) take profit = close price + 6 * (ATR) where ATR = Average True Range
-        6) stop loss = close price - 3 * (ATR) where ATR = Average True Range
+        5) take profit = close price + 2 * dev_multiplier * (ATR) where ATR = Average True Range (default 6 * ATR)
+        6) stop loss = close price - dev_multiplier * (ATR) where ATR = Average True Range (default 3 * ATR)
         7) take profit only if (is_downtrend or rsi > 70) where is_downtrend = ema_10 < ema_20 < ema_50
         8) if price > take profit price, sell 1/2 of position if is_uptrend where is_uptrend = ema_10 > ema_20 > ema_50
         9) if long_signal triggered when in position, buy more and re-adjust take profit and stop loss to new entry price.
         
         """
 
+    def start(self):
+        if not self.p.precompute_signals:
+            return
+        if not self.env.params.preload:
+            print('precompute_signals needs preloaded data, evaluating signals bar by bar')
+            return
+        for d in self.datas:
+            arrays = [np.frombuffer(line.array, dtype=float)[:d.buflen()] for line in (d.open, d.high, d.low, d.close)]
+            self.signals[d] = compute_signals(*arrays)
+
     def run_strategy(self, d, data_name, indicators):
+        if self.signals:
+            signals, i = self.signals[d], len(d) - 1
+            self.long_signal = bool(signals['long_signal'][i])
+            self.short_signal = bool(signals['short_signal'][i])
+            is_uptrend = signals['is_uptrend'][i]
+            is_downtrend = signals['is_downtrend'][i]
+            rsi_overbought = signals['rsi_overbought'][i]
+        else:
+            is_uptrend, is_downtrend, rsi_overbought = self.evaluate_signals(d, indicators)
+
+        self.manage_position(d, data_name, indicators, is_uptrend, is_downtrend, rsi_overbought)
+
+    def evaluate_signals(self, d, indicators):
         atr = indicators['atr']
         engulfing = indicators['CDLENGULFING']
         morning_star = indicators['CDLMORNINGSTAR']
@@ -124,6 +196,11 @@ class MyStrategy(GenericStrategy):
         # self.long_signal = (engulfing == 100) and above_cloud
         # self.short_signal = (engulfing == -100) and below_cloud
 
+        return is_uptrend, is_downtrend, rsi > 70
+
+    def manage_position(self, d, data_name, indicators, is_uptrend, is_downtrend, rsi_overbought):
+        atr = indicators['atr']
+
         # current position size
         pos = self.getposition(d).size
 
@@ -140,7 +217,7 @@ class MyStrategy(GenericStrategy):
             if pos > 0:  # currently long
 
                 take_profit = self.take_profit[d]
-                if (d[0] >= take_profit and (is_downtrend or rsi > 70)) or d[0] <= self.stop_loss[d]:
+                if (d[0] >= take_profit and (is_downtrend or rsi_overbought)) or d[0] <= self.stop_loss[d]:
                     self.sell_order[data_name] = self.sell(data=d, exectype=bt.Order.Market, size=pos)
                     self.order_refs[data_name] = [self.sell_order[data_name].ref]
                     self.stop_loss[d] = None
@@ -153,8 +230,8 @@ class MyStrategy(GenericStrategy):
                     # sell half and readjust stop loss and take profit
                     self.sell_order[data_name] = self.sell(data=d, exectype=bt.Order.Market, size=pos // 2)
                     self.order_refs[data_name] = [self.sell_order[data_name].ref]
-                    self.stop_loss[d] = d[0] - 3 * atr
-                    self.take_profit[d] = d[0] + 6 * atr
+                    self.stop_loss[d] = d[0] - self.p.dev_multiplier * atr
+                    self.take_profit[d] = d[0] + 2 * self.p.dev_multiplier * atr
 
     @staticmethod
     def rsi_region(rsi):
@@ -175,8 +252,8 @@ class MyStrategy(GenericStrategy):
 
     def long_action(self, d, dn, indicators):
         self.entry_price[d] = d[0]
-        self.stop_loss[d] = d[0] - 3 * indicators['atr'][0]
-        self.take_profit[d] = d[0] + 6 * indicators['atr'][0]
+        self.stop_loss[d] = d[0] - self.p.dev_multiplier * indicators['atr'][0]
+        self.take_profit[d] = d[0] + 2 * self.p.dev_multiplier * indicators['atr'][0]
 
         qty = self.size_position(price=self.entry_price[d], stop=self.stop_loss[d], risk=self.params.risk)
 
@@ -9,6 +9,8 @@ import logging
 from loguru import logger
 
 from initialize import APP_PATH
+from strategies_bt.ranking import CrossSectionalRanker
+from strategies_bt.trace_writer import TraceWriter
 
 logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='w',
                     format='%(name)s - %(levelname)s - %(message)s')
@@ -17,9 +19,16 @@ logger.add(f"{APP_PATH}/logs/update_eri_dates_{datetime.date.today().strftime('%
 
 
 class GenericStrategy(bt.Strategy):
-    params = dict(window_s=21, window_m=50, window_l=100, window_xs=5, risk=0.05, stop_dist=0.05, dev_multiplier=2)
+    params = dict(window_s=21, window_m=50, window_l=100, window_xs=5, risk=0.05, stop_dist=0.05, dev_multiplier=2,
+                  # trace files written by setup_csv_files: on/off, keep one bar in trace_every,
+                  # 'csv' or 'parquet', rows buffered before each write
+                  trace=True, trace_every=1, trace_format='csv', trace_chunk=1000,
+                  # dict of param values applied over the ones above, one combination of a sweep (see optimize.py)
+                  opt_combo=None)
 
     def __init__(self):
+        for name, value in (self.p.opt_combo or dict()).items():
+            setattr(self.p, name, value)
         # turn on history
         self.set_tradehistory(True)
         # custom parameter
@@ -35,11 +44,14 @@ class GenericStrategy(bt.Strategy):
         self.buy_order = dict()
         self.sell_order = dict()
         self.indicators = dict()
+        self.rankers = dict()
         self.entry_price = dict()
         self.stop_loss = dict()
         self.take_profit = dict()
         self.long_signal = False
         self.short_signal = False
+        self.trace_writer = None
+        self.order_writer = None
 
     def next(self):
 
@@ -49,12 +61,10 @@ class GenericStrategy(bt.Strategy):
             pos = self.getposition(d).size
             indicators = self.indicators[d]
 
-            with open(self.csv_file, 'a+') as f:
-                df_log = f'{dn}, {dt}, {d.open[0]}, {d.high[0]}, {d.low[0]}, {d.close[0]}, {d.volume[0]}, {self.long_signal}, {self.short_signal}'
-                for key in indicators:
-                    df_log += f', {round(indicators[key][0], 5)}'
-
-                f.write(df_log + '\n')
+            if self.trace_writer is not None and self.trace_writer.wants(len(self)):
+                self.trace_writer.add([dn, dt, d.open[0], d.high[0], d.low[0], d.close[0], d.volume[0],
+                                       self.long_signal, self.short_signal] +
+                                      [indicators[key][0] for key in indicators])
 
             cash = self.broker.get_cash()
 
@@ -92,13 +102,13 @@ class GenericStrategy(bt.Strategy):
                         'short_signal']
         # Write the header to the trade log.
         header = basic_header + add_header
+        trace_args = dict(fmt=self.p.trace_format, chunk_size=self.p.trace_chunk, enabled=self.p.trace)
 
-        with open(self.csv_file, 'w') as file:
-            file.write(','.join(header) + "\n")
+        self.trace_writer = TraceWriter(self.csv_file, header, every=self.p.trace_every,
+                                        round_from=len(basic_header), **trace_args)
 
         header_order = ['instrument', 'datetime', 'buy/sell', 'status', 'size', 'order ref', 'executed price']
-        with open(self.csv_file_orders, 'w') as file:
-            file.write(','.join(header_order) + "\n")
+        self.order_writer = TraceWriter(self.csv_file_orders, header_order, **trace_args)
 
     def notify_order(self, order):
 
@@ -116,9 +126,8 @@ class GenericStrategy(bt.Strategy):
         else:
             price_info = None
 
-        with open(self.csv_file_orders, 'a+') as f:
-            log_order = f'{data_name}, {dt}, {buy_or_sell}, {order.getstatusname()}, {order.size}, {order.ref}, {price_info}'
-            f.write(log_order + '\n')
+        if self.order_writer is not None and self.order_writer.enabled:
+            self.order_writer.add([data_name, dt, buy_or_sell, order.getstatusname(), order.size, order.ref, price_info])
 
         if not order.alive():
             for i, d in enumerate(self.datas):
@@ -136,7 +145,9 @@ class GenericStrategy(bt.Strategy):
             # print('-' * 80)
 
     def stop(self):
-        pass
+        for writer in (self.trace_writer, self.order_writer):
+            if writer is not None:
+                writer.close()
         # print('stopping')
         # result = list()
         # result.append(pd.DataFrame({'kijun_sen': self.ichimoku.kijun_sen.get(size=len(self.ichimoku))}))
@@ -209,6 +220,15 @@ class GenericStrategy(bt.Strategy):
         # print(f'quantity reduced from {quantity} to {reduced_quantity}')
         return floor(reduced_quantity)
 
+    def add_ranker(self, key):
+        """
+        Rank indicator `key` of self.indicators across all datas.
+        Call ranker.update() once per bar, then ranker.top_names(k, threshold).
+        """
+        self.rankers[key] = CrossSectionalRanker([d._name for d in self.datas],
+                                                 [self.indicators[d][key].lines[0] for d in self.datas])
+        return self.rankers[key]
+
     def add_candles_indicators(self, d, candle_list=None):
         if candle_list is None:
             cdl_methods = [m for m in dir(bt.talib) if 'CDL' in m]
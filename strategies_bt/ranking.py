@@ -0,0 +1,41 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+
+class CrossSectionalRanker(object):
+    """
+    Ranks the current value of one line (e.g. an indicator) across the datas of a strategy.
+
+    The values live in a preallocated float array with one slot per data, refreshed in place
+    by update(); top() picks the k largest with np.argpartition, so ranking is O(n) per bar.
+    NaN values (indicator not ready yet) never make it to the top.
+    """
+
+    def __init__(self, names, lines):
+        self.names = np.array(names, dtype=object)
+        self.lines = list(lines)
+        self.values = np.full(len(self.lines), np.nan)
+
+    def update(self):
+        values = self.values
+        for i, line in enumerate(self.lines):
+            values[i] = line[0]
+        return values
+
+    def top(self, k, threshold=None):
+        """Indices of the k largest values in descending order, only values > threshold if given."""
+        scores = np.where(np.isnan(self.values), -np.inf, self.values)
+        if threshold is not None:
+            scores[scores <= threshold] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=int)
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx], kind='stable')]
+        return idx[scores[idx] > -np.inf]
+
+    def top_names(self, k, threshold=None):
+        return self.names[self.top(k, threshold)].tolist()
+
@@ -0,0 +1,84 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+import pandas as pd
+
+
+class TraceWriter(object):
+    """
+    Buffered sink for the per-bar and per-order trace of a strategy.
+
+    Rows are kept in memory and written `chunk_size` rows at a time with a single open/write.
+    - fmt='csv' (default) keeps the layout setup_csv_files always produced: comma separated
+      header, rows joined with ', ' and columns from `round_from` on rounded to 5 decimals.
+    - fmt='parquet' writes the same columns to a .parquet file (needs pyarrow).
+    - every=N keeps the rows of one bar in N, enabled=False writes nothing at all.
+    """
+
+    def __init__(self, file_path, header, fmt='csv', chunk_size=1000, every=1, enabled=True, round_from=None):
+        self.header = list(header)
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.every = max(int(every), 1)
+        self.enabled = enabled
+        self.round_from = round_from
+        self.rows = []
+        self._parquet_writer = None
+
+        if fmt == 'parquet':
+            self.file_path = os.path.splitext(file_path)[0] + '.parquet'
+        elif fmt == 'csv':
+            self.file_path = file_path
+            if enabled:
+                with open(self.file_path, 'w') as file:
+                    file.write(','.join(self.header) + "\n")
+        else:
+            raise ValueError(f'unknown trace format {fmt}')
+
+    def wants(self, bar):
+        """Whether rows of bar number `bar` are kept, check it before building the row."""
+        return self.enabled and bar % self.every == 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.fmt == 'csv':
+            self._flush_csv()
+        else:
+            self._flush_parquet()
+        self.rows = []
+
+    def _flush_csv(self):
+        n = self.round_from
+        if n is None:
+            lines = [', '.join(map(str, row)) for row in self.rows]
+        else:
+            lines = [', '.join([str(v) for v in row[:n]] + [str(round(v, 5)) for v in row[n:]]) for row in self.rows]
+        with open(self.file_path, 'a+') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        df = pd.DataFrame(self.rows, columns=self.header)
+        for column in df.columns[df.isna().all()]:
+            # keep the schema of chunks where a column happens to be empty (e.g. order price)
+            df[column] = df[column].astype('float64')
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.file_path, table.schema)
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def close(self):
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
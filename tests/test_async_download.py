@@ -0,0 +1,62 @@
+import asyncio
+import importlib.util
+import sys
+import types
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+if importlib.util.find_spec('config') is None:
+    # get_all reads the binance keys at import, none are needed against a local server
+    config, keys = types.ModuleType('config'), types.ModuleType('config.keys')
+    keys.binance_keys = dict(api='', secret_key='')
+    config.keys = keys
+    sys.modules.update({'config': config, 'config.keys': keys})
+
+from providers.cryto.async_download import KlinesDownloader  # noqa: E402
+
+KLINE = [1483228800000, '1.0', '1.1', '0.9', '1.05', '10.0', 1483232399999, '10.5', 5, '5.0', '5.2', '0']
+
+
+def run_klines(statuses):
+    """get_klines against a server answering with `statuses` in turn (then 200). Returns (result, requests)."""
+    statuses = list(statuses)
+
+    async def klines(request):
+        status = statuses.pop(0) if statuses else 200
+        if status != 200:
+            return web.json_response(dict(code=-1, msg='error'), status=status, headers={'Retry-After': '0'})
+        return web.json_response([KLINE])
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/api/v3/klines', klines)
+        async with TestServer(app) as server:
+            downloader = KlinesDownloader(base_url=str(server.make_url('')).rstrip('/'))
+            downloader.semaphore = asyncio.Semaphore(1)
+            async with aiohttp.ClientSession() as downloader.session:
+                try:
+                    result = await downloader.get_klines('BTCUSDT', '1h', 0, 1)
+                except Exception as e:
+                    result = e
+            return result, downloader.requests
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_transient_errors_are_retried(status):
+    result, requests = run_klines([status])
+    assert result == [KLINE]
+    assert requests == 2
+
+
+@pytest.mark.parametrize('status', [400, 404])
+def test_client_errors_are_not_retried(status):
+    result, requests = run_klines([status])
+    assert isinstance(result, aiohttp.ClientResponseError)
+    assert result.status == status
+    assert requests == 1
+
@@ -0,0 +1,21 @@
+import sys
+
+import pytest
+
+from bt_args import parse_args
+
+
+def test_reads_the_command_line(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['main.py', '--workers', '8', '--granularity', 'H4'])
+    args = parse_args(strict=True)
+    assert (args.workers, args.granularity) == (8, 'H4')
+
+
+@pytest.mark.parametrize('argv', [['--worker', '8'], ['--resum', 'out/run']])
+def test_strict_rejects_unknown_flags(monkeypatch, argv):
+    monkeypatch.setattr(sys, 'argv', ['main.py'] + argv)
+    with pytest.raises(SystemExit):
+        parse_args(strict=True)
+    # the tolerant parse (main imported from elsewhere) ignores them
+    args = parse_args()
+    assert (args.workers, args.resume) == (1, None)
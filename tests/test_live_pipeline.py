@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from traders.live_pipeline import AsyncWriter, BarWindow, LivePipeline, ReplaySource
+
+INSTRUMENTS = ['EUR_USD', 'XAU_USD']
+WINDOW = 20
+
+
+def bars(periods, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, periods))
+    index = pd.date_range('2017-01-02 22:00', periods=periods, freq='4h', name='datetime')
+    return pd.DataFrame(dict(open=close + 0.1, high=close + 1, low=close - 1, close=close,
+                             volume=rng.integers(100, 1000, periods).astype(float)), index=index)
+
+
+@pytest.fixture
+def frames():
+    return {instrument: bars(200, seed) for seed, instrument in enumerate(INSTRUMENTS)}
+
+
+class Recorder(object):
+    """Strategy keeping the window's last close and length at each call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, instrument, window):
+        self.calls.append((instrument, window.arrays()['close'][-1], len(window)))
+        return len(self.calls)
+
+
+def test_bar_window_ring_buffer():
+    window = BarWindow(size=3)
+    assert window.last_time is None and len(window) == 0
+    for t in range(1, 6):
+        assert window.append(t, [t, t, t, t, t])
+    assert not window.append(5, [0, 0, 0, 0, 0])
+    assert not window.append(4, [0, 0, 0, 0, 0])
+    arrays = window.arrays()
+    assert arrays['time'].tolist() == [3, 4, 5]
+    assert arrays['close'].tolist() == [3.0, 4.0, 5.0]
+    assert window.last_time == 5 and len(window) == 3
+
+
+def test_windows_match_source(frames):
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW)
+    pipeline.run(polls=60, interval=0)
+    # cursor is the incomplete bar, the windows end at the one before
+    for instrument, df in frames.items():
+        expected = df.iloc[:source.cursor].tail(WINDOW)
+        got = pipeline.windows[instrument].to_df()
+        assert np.array_equal(got['close'].to_numpy(), expected['close'].to_numpy())
+        assert (got.index == expected.index.tz_localize('UTC')).all()
+
+
+def test_incomplete_candles_are_skipped(frames):
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW)
+    assert pipeline.poll() == {instrument: WINDOW - 1 for instrument in INSTRUMENTS}
+    forming = frames['EUR_USD'].index[source.cursor].tz_localize('UTC')
+    assert pipeline.windows['EUR_USD'].to_df().index[-1] < forming
+    # one more completed bar per poll, the one that was forming before
+    assert pipeline.poll() == {instrument: 1 for instrument in INSTRUMENTS}
+    assert pipeline.windows['EUR_USD'].to_df().index[-1] == forming
+
+
+def test_strategies_run_per_new_bar(frames):
+    source = ReplaySource(frames, 'H4', start=50, step=3)
+    recorder = Recorder()
+    pipeline = LivePipeline(source, ['EUR_USD'], 'H4', window=WINDOW, strategies=[recorder])
+    pipeline.poll()
+    recorder.calls.clear()
+    new_bars = pipeline.poll()
+    assert new_bars == {'EUR_USD': 3}
+    # one call per bar, each on the window ending at that bar
+    closes = frames['EUR_USD']['close'].to_numpy()[source.cursor - 3:source.cursor]
+    assert [call[1] for call in recorder.calls] == closes.tolist()
+    assert pipeline.signals['EUR_USD'] == [len(recorder.calls)]
+    assert pipeline.latency()['signal']['count'] == WINDOW - 1 + 3
+
+
+def test_no_duplicate_writes(frames):
+    stored = []
+    writer = AsyncWriter(stored.append)
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW, writer=writer)
+    pipeline.run(polls=30, interval=0)
+    writer.close()
+    persisted = pd.concat(stored)
+    assert not persisted.duplicated(['time', 'instrument']).any()
+    assert persisted['complete'].all()
+    assert len(persisted) == len(INSTRUMENTS) * (WINDOW - 1 + 29)
+    assert writer.rows_written == len(persisted) and not writer.errors
+
+
+def test_params_from_last_time(frames):
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW)
+    assert pipeline.params() == dict(granularity='H4', count=WINDOW)
+    pipeline.poll()
+    params = pipeline.params()
+    last_time = pipeline.windows['EUR_USD'].to_df().index[-1]
+    assert params == {'granularity': 'H4', 'from': last_time.timestamp()}
+    # the source answers from the last bar on: it is not appended twice, only the new one is
+    df = source.get_prices(INSTRUMENTS, params)
+    assert df.groupby('instrument')['time'].min().eq(last_time).all()
+    source.cursor -= 1  # undo the cursor step of the request above
+    assert pipeline.poll() == {instrument: 1 for instrument in INSTRUMENTS}
+
+
+def test_params_wait_for_every_instrument(frames):
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW)
+    seed = source.get_prices(['EUR_USD'], dict(count=10))
+    pipeline.seed(seed[seed['complete']])
+    assert pipeline.last_time() is None
+    assert 'from' not in pipeline.params()
+
+
+def test_seed_does_not_signal_or_write(frames):
+    stored = []
+    writer = AsyncWriter(stored.append)
+    recorder = Recorder()
+    source = ReplaySource(frames, 'H4', start=50)
+    pipeline = LivePipeline(source, INSTRUMENTS, 'H4', window=WINDOW, strategies=[recorder], writer=writer)
+    seed = source.get_prices(INSTRUMENTS, dict(count=WINDOW))
+    pipeline.seed(seed[seed['complete']])
+    writer.close()
+    assert recorder.calls == [] and stored == []
+    assert len(pipeline.windows['XAU_USD']) == WINDOW - 1
@@ -0,0 +1,93 @@
+import datetime
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+
+from providers.market_store import index_to_ns
+from providers.numpy_feed import NumpyData, date2num_array
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+RANGES = [dict(),
+          dict(fromdate=datetime.datetime(2019, 2, 1)),
+          dict(todate=datetime.datetime(2019, 2, 10, 12)),
+          dict(fromdate=datetime.datetime(2019, 1, 20, 5, 30), todate=datetime.datetime(2019, 2, 3))]
+
+
+@pytest.fixture(scope='module')
+def df():
+    rng = np.random.default_rng(0)
+    # 4h bars with a few missing ones and times off the hour
+    index = pd.date_range('2019-01-01', periods=400, freq='4h')
+    index = index[rng.random(len(index)) > 0.05]
+    index = index + pd.to_timedelta(rng.integers(0, 10_000_000, len(index)), unit='us')
+    return pd.DataFrame(rng.random((len(index), 5)) + 1, index=index, columns=COLUMNS)
+
+
+def to_arrays(df):
+    arrays = dict(time=index_to_ns(df.index))
+    arrays.update({column: df[column].to_numpy(dtype=float) for column in COLUMNS})
+    return arrays
+
+
+def preload(feed):
+    """Preload feed like cerebro does and return its lines as numpy arrays."""
+    feed.setenvironment(bt.Cerebro())
+    feed._start()
+    feed.preload()
+    return {name: np.array(getattr(feed.lines, name).array) for name in feed.lines.getlinealiases()}
+
+
+def assert_same_lines(a, b):
+    assert a.keys() == b.keys()
+    for name in a:
+        np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+
+
+class Recorder(bt.Strategy):
+    def __init__(self):
+        self.sma = bt.indicators.SMA(self.data.close, period=5)
+        self.bars = []
+
+    def next(self):
+        self.bars.append((self.data.datetime[0], self.data.open[0], self.data.high[0], self.data.low[0],
+                          self.data.close[0], self.data.volume[0], self.sma[0]))
+
+
+def next_calls(feed, **kwargs):
+    cerebro = bt.Cerebro(stdstats=False, **kwargs)
+    cerebro.adddata(feed)
+    cerebro.addstrategy(Recorder)
+    return cerebro.run()[0].bars
+
+
+def test_date2num_bit_for_bit():
+    rng = np.random.default_rng(1)
+    times = rng.integers(pd.Timestamp('1990-01-01').value, pd.Timestamp('2040-01-01').value, 2000)
+    times = times // 1000 * 1000
+    expected = [bt.date2num(ts.to_pydatetime()) for ts in pd.DatetimeIndex(times.view('datetime64[ns]'))]
+    assert date2num_array(times).tolist() == expected
+
+
+@pytest.mark.parametrize('dates', RANGES)
+def test_preloaded_lines(df, dates):
+    assert_same_lines(preload(NumpyData(dataname=to_arrays(df), **dates)),
+                      preload(bt.feeds.PandasData(dataname=df, **dates)))
+
+
+@pytest.mark.parametrize('dates', RANGES)
+@pytest.mark.parametrize('mode', [dict(), dict(runonce=False), dict(preload=False)])
+def test_strategy_sees_the_same_bars(df, dates, mode):
+    expected = next_calls(bt.feeds.PandasData(dataname=df, **dates), **mode)
+    assert len(expected) > 10
+    assert next_calls(NumpyData(dataname=to_arrays(df), **dates), **mode) == expected
+
+
+def test_missing_lines_stay_nan(df):
+    arrays = to_arrays(df)
+    del arrays['volume']
+    lines = preload(NumpyData(dataname=arrays))
+    assert np.isnan(lines['volume']).all() and np.isnan(lines['openinterest']).all()
+    assert_same_lines({k: v for k, v in lines.items() if k != 'volume'},
+                      {k: v for k, v in preload(bt.feeds.PandasData(dataname=df)).items() if k != 'volume'})
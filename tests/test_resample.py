@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from providers.market_store import MarketStore, to_ns
+from providers.resample import Resampler, bucket_end, resample_arrays
+
+HOUR = 3_600_000_000_000
+
+
+def hourly(start, end):
+    """1h bars from start to end (inclusive, UTC): close = hours since 2019-01-01, volume 1."""
+    times = pd.date_range(start, end, freq='h').values.astype('datetime64[ns]').view(np.int64)
+    close = (times - to_ns('2019-01-01')) / HOUR
+    return dict(time=times, open=close - 0.5, high=close + 1, low=close - 1, close=close, volume=np.ones(len(times)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MarketStore(root=str(tmp_path))
+
+
+def write_hours(store, source, symbol, interval, start, end, covered_end=None):
+    """Store the 1h bars of start..end, covered up to covered_end (default: the end of the last bar)."""
+    covered_end = to_ns(end) + HOUR - 1 if covered_end is None else to_ns(covered_end)
+    store.write_arrays(source, symbol, interval, hourly(start, end), covered=(to_ns(start), covered_end))
+
+
+def utc(arrays):
+    return pd.DatetimeIndex(arrays['time'].view('datetime64[ns]')).tz_localize('UTC')
+
+
+def test_resample_arrays_utc():
+    arrays = resample_arrays(hourly('2019-12-30 00:00', '2019-12-30 23:00'), 240)
+    assert utc(arrays).hour.tolist() == [0, 4, 8, 12, 16, 20]
+    assert arrays['volume'].tolist() == [4.0] * 6
+    assert arrays['open'][0] == hourly('2019-12-30', '2019-12-30')['open'][0]
+    assert arrays['close'][-1] == hourly('2019-12-30 23:00', '2019-12-30 23:00')['close'][0]
+    assert arrays['high'][1] == hourly('2019-12-30 07:00', '2019-12-30 07:00')['high'][0]
+
+
+def test_partial_last_bar_is_dropped(store):
+    # --to_date 2019-12-31: the base bars stop at the 00:00 bar, the 4h bar of 00:00 has 1 of its 4
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-31 00:00')
+    resampler = Resampler(store)
+    # the stored 1h bars do not cover the last 4h bar
+    assert resampler.read_arrays('binance', 'BTCUSDT', '4h', '2019-12-30', '2019-12-31') is None
+    arrays = resampler.read_arrays('binance', 'BTCUSDT', '4h', '2019-12-30', '2019-12-31', base='1h')
+    assert utc(arrays)[-1] == pd.Timestamp('2019-12-30 20:00', tz='UTC')
+    assert (arrays['volume'] == 4.0).all()
+
+
+def test_last_bar_built_past_end(store):
+    # once its base bars are downloaded, the bar of `end` is complete, as the direct 4h download returned it
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-31 03:00')
+    resampler = Resampler(store)
+    assert resampler.last_base_bar('binance', '4h', '1h', '2019-12-31') == to_ns('2019-12-31 03:00')
+    arrays = resampler.read_arrays('binance', 'BTCUSDT', '4h', '2019-12-30', '2019-12-31')
+    assert utc(arrays)[-1] == pd.Timestamp('2019-12-31 00:00', tz='UTC')
+    assert arrays['volume'][-1] == 4.0
+    assert arrays['close'][-1] == hourly('2019-12-31 03:00', '2019-12-31 03:00')['close'][0]
+    assert len(arrays['time']) == 7
+
+
+def test_partial_first_bar_is_dropped(store):
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-30 23:00')
+    arrays = Resampler(store).read_arrays('binance', 'BTCUSDT', '4h', '2019-12-30 01:00', '2019-12-30 20:00')
+    assert utc(arrays)[0] == pd.Timestamp('2019-12-30 04:00', tz='UTC')
+    assert (arrays['volume'] == 4.0).all()
+
+
+def test_covered_bar_without_all_base_bars_is_complete(store):
+    # downloaded up to the end of the bar, but the exchange had no trades in its last hours
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-30 21:00',
+                covered_end=to_ns('2019-12-31') - 1)
+    arrays = Resampler(store).read_arrays('binance', 'BTCUSDT', '4h', '2019-12-30', '2019-12-30 20:00', base='1h')
+    assert utc(arrays)[-1] == pd.Timestamp('2019-12-30 20:00', tz='UTC')
+    assert arrays['volume'][-1] == 2.0
+
+
+def test_forming_bar_is_not_cached(store):
+    # live read: `end` is the last closed 1h bar, the 4h bar holding it is still forming
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-30 21:00')
+    resampler = Resampler(store)
+    args = ('binance', 'BTCUSDT', '4h', '2019-12-30', '2019-12-30 21:00')
+    arrays = resampler.read_arrays(*args, base='1h')
+    assert utc(arrays)[-1] == pd.Timestamp('2019-12-30 16:00', tz='UTC')
+    assert not resampler.cache
+    # its last two bars close: the same read now gets it, complete, and keeps it
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 22:00', '2019-12-30 23:00')
+    arrays = resampler.read_arrays(*args, base='1h')
+    assert utc(arrays)[-1] == pd.Timestamp('2019-12-30 20:00', tz='UTC')
+    assert arrays['volume'][-1] == 4.0
+    assert resampler.read_arrays(*args) is arrays
+
+
+def test_same_interval_is_not_resampled(store):
+    write_hours(store, 'binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-30 05:00')
+    arrays = Resampler(store).read_arrays('binance', 'BTCUSDT', '1h', '2019-12-30 00:00', '2019-12-30 05:00')
+    assert len(arrays['time']) == 6
+
+
+@pytest.mark.parametrize('start, end, long_bar, hours', [
+    # DST ends 2019-11-03 02:00 EDT: the 01:00 - 05:00 bar lasts 5 hours
+    ('2019-11-01 00:00', '2019-11-05 00:00', '2019-11-03 01:00', 5),
+    # DST starts 2019-03-10 02:00 EST: the 01:00 - 05:00 bar lasts 3 hours
+    ('2019-03-08 00:00', '2019-03-12 00:00', '2019-03-10 01:00', 3),
+])
+def test_oanda_alignment_across_dst(store, start, end, long_bar, hours):
+    # and the rest of the bar holding `end`
+    write_hours(store, 'oanda', 'EUR_USD', 'H1', start, pd.Timestamp(end) + pd.Timedelta(hours=5))
+    resampler = Resampler(store)
+    arrays = resampler.read_arrays('oanda', 'EUR_USD', 'H4', start, end)
+    labels = utc(arrays).tz_convert('America/New_York')
+    # every bar starts at 17:00 New York + a multiple of 4 hours of wall clock, before and after the change
+    assert set(labels.hour) == {1, 5, 9, 13, 17, 21}
+    assert (labels.minute == 0).all()
+    volume = pd.Series(arrays['volume'], index=labels.tz_localize(None))
+    assert volume[pd.Timestamp(long_bar)] == hours
+    assert (volume.drop(pd.Timestamp(long_bar)) == 4).all()
+    # bucket_end of each bar is the start of the next one
+    ends = [bucket_end(int(t), 240, 'America/New_York', 60) for t in arrays['time'][:-1]]
+    assert ends == arrays['time'][1:].tolist()
+
+
+def test_oanda_daily_bars_across_dst(store):
+    write_hours(store, 'oanda', 'EUR_USD', 'H1', '2019-11-01 00:00', '2019-11-06 00:00')
+    arrays = Resampler(store).read_arrays('oanda', 'EUR_USD', 'D', '2019-11-01', '2019-11-05')
+    labels = utc(arrays).tz_convert('America/New_York')
+    assert (labels.hour == 17).all()
+    # 17:00 to 17:00 New York: 25 hours over the change, the first (partial) day is dropped
+    assert labels[0] == pd.Timestamp('2019-11-01 17:00', tz='America/New_York')
+    assert arrays['volume'].tolist() == [24.0, 25.0, 24.0, 24.0]
+
+
+def test_coverage_missing_and_covers(store):
+    assert store.missing('binance', 'X', '1h', 0, 99) == [[0, 99]]
+    store.add_coverage('binance', 'X', '1h', 10, 19)
+    store.add_coverage('binance', 'X', '1h', 40, 49)
+    # adjacent ranges are merged
+    store.add_coverage('binance', 'X', '1h', 20, 29)
+    assert store.coverage('binance', 'X', '1h') == [[10, 29], [40, 49]]
+    assert store.missing('binance', 'X', '1h', 0, 99) == [[0, 9], [30, 39], [50, 99]]
+    assert store.missing('binance', 'X', '1h', 12, 25) == []
+    assert store.covers('binance', 'X', '1h', 40, 49)
+    assert not store.covers('binance', 'X', '1h', 25, 45)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from results_store import ResultsStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(tmp_path / 'results.db')
+    yield store
+    store.close()
+
+
+def analyzers(sharpe):
+    return dict(SharpeRatio_sharperatio=sharpe, SQN_sqn=1.0)
+
+
+def add_runs(store, session_id, strategy, sharpes, total_closed=10):
+    with store.session(session_id, strategy) as session:
+        for instrument, sharpe in sharpes.items():
+            session.add(instrument, dict(total_closed=total_closed), analyzers(sharpe))
+
+
+def series_rows(store):
+    return store.connection.execute('SELECT COUNT(*) FROM run_series').fetchone()[0]
+
+
+def test_rewrite_replaces_run_and_series(store):
+    with store.session('s1', 'candles_v2') as session:
+        session.add('EUR_USD', dict(total_closed=3), analyzers(0.5), params=dict(risk=0.01),
+                    series=dict(returns_close=[0.1, 0.2], returns_open=[0.3]))
+        session.add('GBP_USD', dict(total_closed=4), analyzers(0.7), series=dict(returns_close=[0.4]))
+    assert series_rows(store) == 3
+
+    # same session, strategy, instrument and params (e.g. --resume): the row and its series are replaced
+    with store.session('s1', 'candles_v2') as session:
+        session.add('EUR_USD', dict(total_closed=5), analyzers(0.9), params=dict(risk=0.01),
+                    series=dict(returns_close=[1.0, 2.0, 3.0]))
+    runs = store.runs()
+    assert len(runs) == 2
+    eur = runs[runs['instrument'] == 'EUR_USD'].iloc[0]
+    assert (eur['sharpe'], eur['total_closed']) == (0.9, 5)
+    assert series_rows(store) == 2
+    assert list(store.series(int(eur['run_id']))) == ['returns_close']
+    np.testing.assert_array_equal(store.series(int(eur['run_id']))['returns_close'], [1.0, 2.0, 3.0])
+
+    # rewritten without series: the old ones go too
+    with store.session('s1', 'candles_v2') as session:
+        session.add('EUR_USD', dict(total_closed=5), analyzers(0.9), params=dict(risk=0.01))
+    assert series_rows(store) == 1
+    gbp = store.runs(instrument='GBP_USD').iloc[0]
+    np.testing.assert_array_equal(store.series(int(gbp['run_id']))['returns_close'], [0.4])
+
+
+def test_other_params_are_other_runs(store):
+    with store.session('s1', 'candles_v2') as session:
+        session.add('EUR_USD', dict(), analyzers(0.5), params=dict(risk=0.01))
+        session.add('EUR_USD', dict(), analyzers(0.6), params=dict(risk=0.02))
+    assert len(store.runs()) == 2
+
+
+def test_leaderboard_per_strategy(store):
+    add_runs(store, 's1', 'a', dict(EUR_USD=1.0, GBP_USD=3.0, AUD_USD=2.0, NZD_USD=None))
+    add_runs(store, 's1', 'b', dict(EUR_USD=0.5, GBP_USD=-1.0))
+    board = store.leaderboard('sharpe', per='strategy', top=2)
+    assert list(zip(board['strategy'], board['instrument'], board['rank'])) == [
+        ('a', 'GBP_USD', 1), ('a', 'AUD_USD', 2), ('b', 'EUR_USD', 1), ('b', 'GBP_USD', 2)]
+
+    board = store.leaderboard('sharpe', per='strategy', top=1, ascending=True)
+    assert list(zip(board['strategy'], board['sharpe'])) == [('a', 1.0), ('b', -1.0)]
+
+
+def test_leaderboard_overall_and_filters(store):
+    add_runs(store, 's1', 'a', dict(EUR_USD=1.0, GBP_USD=3.0))
+    add_runs(store, 's2', 'b', dict(EUR_USD=2.0), total_closed=2)
+    board = store.leaderboard('sharpe', per=None, top=10)
+    assert board['sharpe'].tolist() == [3.0, 2.0, 1.0]
+    assert board['rank'].tolist() == [1, 2, 3]
+    assert store.leaderboard('sharpe', per=None, min_trades=5)['sharpe'].tolist() == [3.0, 1.0]
+    assert store.leaderboard('sharpe', per='instrument', session_id='s1')['instrument'].tolist() == [
+        'EUR_USD', 'GBP_USD']
+    # runs without the metric are left out
+    assert store.leaderboard('max_drawdown').empty
+
+
+def test_leaderboard_rejects_unknown_columns(store):
+    with pytest.raises(ValueError):
+        store.leaderboard('sharpe; DROP TABLE runs')
+    with pytest.raises(ValueError):
+        store.leaderboard('sharpe', per='params')
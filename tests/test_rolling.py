@@ -0,0 +1,172 @@
+import statistics
+from math import fsum, nan
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+from indicators import rolling
+
+PERIOD = 20
+
+
+@pytest.fixture(scope='module')
+def values():
+    rng = np.random.default_rng(0)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 1_000)))
+
+
+def reference_slope(y):
+    x = list(range(1, len(y) + 1))
+    x_mean = fsum(x) / len(y)
+    return fsum((a - x_mean) * b for a, b in zip(x, y)) / fsum((a - x_mean) ** 2 for a in x)
+
+
+def reference_ema(values, period, alpha=None):
+    alpha = 2.0 / (1.0 + period) if alpha is None else alpha
+    out = [nan] * (period - 1) + [fsum(values[:period]) / period]
+    for x in values[period:]:
+        out.append(out[-1] * (1.0 - alpha) + x * alpha)
+    return out
+
+
+# kernel factory -> reference function of one window (statistics / plain Python)
+WINDOW_REFERENCES = dict(
+    sum=(rolling.RollingSum, fsum),
+    mean=(rolling.RollingMean, statistics.fmean),
+    variance=(rolling.RollingVariance, statistics.variance),
+    pvariance=(lambda period: rolling.RollingVariance(period, ddof=0), statistics.pvariance),
+    stdev=(rolling.RollingStdev, statistics.stdev),
+    pstdev=(lambda period: rolling.RollingStdev(period, ddof=0), statistics.pstdev),
+    max=(rolling.RollingMax, max),
+    min=(rolling.RollingMin, min),
+    slope=(rolling.RollingSlope, reference_slope),
+)
+
+# kernel factory -> numpy reduction over the sliding windows
+NUMPY_REFERENCES = dict(
+    sum=(rolling.RollingSum, lambda w: w.sum(axis=1)),
+    mean=(rolling.RollingMean, lambda w: w.mean(axis=1)),
+    variance=(rolling.RollingVariance, lambda w: w.var(axis=1, ddof=1)),
+    stdev=(rolling.RollingStdev, lambda w: w.std(axis=1, ddof=1)),
+    max=(rolling.RollingMax, lambda w: w.max(axis=1)),
+    min=(rolling.RollingMin, lambda w: w.min(axis=1)),
+    slope=(rolling.RollingSlope, lambda w: np.polyfit(np.arange(1, PERIOD + 1), w.T, 1)[0]),
+)
+
+
+def reference(name, values):
+    if name == 'ema':
+        return np.array(reference_ema(values.tolist(), PERIOD))
+    _, func = WINDOW_REFERENCES[name]
+    windows = [values[i + 1 - PERIOD:i + 1].tolist() for i in range(PERIOD - 1, len(values))]
+    return np.r_[np.full(PERIOD - 1, nan), [func(w) for w in windows]]
+
+
+def kernel(name):
+    return rolling.EMA(PERIOD) if name == 'ema' else WINDOW_REFERENCES[name][0](PERIOD)
+
+
+def assert_close(result, expected):
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-12, equal_nan=True)
+
+
+NAMES = list(WINDOW_REFERENCES) + ['ema']
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_update(name, values):
+    k = kernel(name)
+    assert_close([k.update(x) for x in values], reference(name, values))
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_compute(name, values):
+    assert_close(kernel(name).compute(values), reference(name, values))
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_replace(name, values):
+    # a wrong value pushed first and corrected, as on a bt bar seen twice
+    k = kernel(name)
+    replaced = []
+    for x in values:
+        k.update(x + 1.0)
+        replaced.append(k.replace(x))
+    assert_close(replaced, reference(name, values))
+
+
+@pytest.mark.parametrize('name', NAMES)
+def test_seed(name, values):
+    k = kernel(name)
+    k.update(-1e6)
+    seeded = k.seed(values[:200])
+    expected = reference(name, values[:200])[-1] if name != 'ema' else reference(name, values[200 - PERIOD:200])[-1]
+    assert seeded == pytest.approx(expected, rel=1e-9)
+    # and goes on like the streaming kernel
+    streamed = [k.update(x) for x in values[200:]]
+    if name != 'ema':
+        assert_close(streamed, reference(name, values)[200:])
+
+
+@pytest.mark.parametrize('name', list(NUMPY_REFERENCES))
+def test_numpy_reference(name, values):
+    factory, func = NUMPY_REFERENCES[name]
+    expected = np.r_[np.full(PERIOD - 1, nan), func(sliding_window_view(values, PERIOD))]
+    assert_close(factory(PERIOD).compute(values), expected)
+
+
+def test_ema_per_update_alpha(values):
+    alphas = np.linspace(0.05, 0.5, len(values))
+    k = rolling.EMA(PERIOD)
+    streamed = [k.update(x, alpha) for x, alpha in zip(values, alphas)]
+    expected = [nan] * (PERIOD - 1) + [fsum(values[:PERIOD].tolist()) / PERIOD]
+    for x, alpha in zip(values[PERIOD:], alphas[PERIOD:]):
+        expected.append(expected[-1] * (1.0 - alpha) + x * alpha)
+    assert_close(streamed, expected)
+    assert_close(rolling.EMA(PERIOD).compute(values, alphas), expected)
+
+
+def test_short_input():
+    for name in NAMES:
+        assert np.isnan(kernel(name).compute(np.arange(PERIOD - 1.0))).all()
+
+
+def test_kernel_is_abstract():
+    with pytest.raises(TypeError):
+        rolling.RollingKernel(PERIOD)
+
+
+BT_KERNELS = dict(sum=(rolling.RollingSum, bt.indicators.SumN),
+                  mean=(rolling.RollingMean, bt.indicators.SMA),
+                  stdev=(lambda period: rolling.RollingStdev(period, ddof=0), bt.indicators.StdDev),
+                  max=(rolling.RollingMax, bt.indicators.Highest),
+                  min=(rolling.RollingMin, bt.indicators.Lowest),
+                  ema=(rolling.EMA, bt.indicators.EMA))
+
+
+class ReferenceStrategy(bt.Strategy):
+    def __init__(self):
+        self.ind = {name: indicator(self.data.close, period=PERIOD) for name, (_, indicator) in BT_KERNELS.items()}
+
+
+@pytest.fixture(scope='module')
+def bt_lines(values):
+    index = pd.date_range('2020-01-01', periods=len(values), freq='h')
+    df = pd.DataFrame(dict(open=values, high=values, low=values, close=values, volume=1.0), index=index)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(bt.feeds.PandasData(dataname=df))
+    cerebro.addstrategy(ReferenceStrategy)
+    strategy = cerebro.run()[0]
+    return {name: np.asarray(ind.lines[0].array) for name, ind in strategy.ind.items()}
+
+
+@pytest.mark.parametrize('name', list(BT_KERNELS))
+def test_backtrader_reference(name, values, bt_lines):
+    factory, _ = BT_KERNELS[name]
+    expected = bt_lines[name]
+    np.testing.assert_allclose(factory(PERIOD).compute(values), expected, rtol=1e-8, equal_nan=True)
+    k = factory(PERIOD)
+    np.testing.assert_allclose([k.update(x) for x in values], expected, rtol=1e-8, equal_nan=True)
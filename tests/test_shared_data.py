@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from providers.shared_data import DataPlane, attach, detach
+
+
+@pytest.fixture
+def arrays():
+    return dict(time=np.arange(0, 50 * 3_600_000_000_000, 3_600_000_000_000, dtype=np.int64),
+                close=np.linspace(1.0, 2.0, 50),
+                volume=np.arange(50, dtype=np.float32))
+
+
+@pytest.fixture
+def plane():
+    plane = DataPlane()
+    yield plane
+    detach()
+    plane.close()
+
+
+def set_close(plane, entry, value):
+    """Write close[0] through the block the parent published."""
+    name, layout = entry
+    block = next(shm for shm in plane.blocks.values() if shm.name == name)
+    _, dtype, length, offset = next(column for column in layout if column[0] == 'close')
+    np.ndarray(length, dtype=dtype, buffer=block.buf, offset=offset)[0] = value
+
+
+def worker_read(entry):
+    """In the worker: copies of the attached arrays (to send back) and whether each was a view on the block."""
+    attached = attach(entry)
+    views = {column: not a.flags.owndata and not a.flags.writeable for column, a in attached.items()}
+    result = {column: a.copy() for column, a in attached.items()}, views
+    detach()
+    return result
+
+
+def test_attach_returns_views_on_the_block(arrays, plane):
+    entry = plane.publish('BTCUSDT', arrays)
+    attached = attach(entry)
+    assert list(attached) == list(arrays)
+    for column, a in arrays.items():
+        np.testing.assert_array_equal(attached[column], a)
+        assert attached[column].dtype == a.dtype
+        assert not attached[column].flags.owndata and not attached[column].flags.writeable
+    # a change made through the parent's mapping shows up in the attached views
+    set_close(plane, entry, 42.0)
+    assert attached['close'][0] == 42.0
+    # publishing the same key again is a no-op
+    assert plane.publish('BTCUSDT', dict(close=np.zeros(3))) == entry
+    del attached
+
+
+def test_worker_attaches_without_copying(arrays, plane):
+    entry = plane.publish('BTCUSDT', arrays)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        attached, views = executor.submit(worker_read, entry).result()
+        assert all(views.values())
+        for column, a in arrays.items():
+            np.testing.assert_array_equal(attached[column], a)
+
+        # the worker reads the block itself: a change made in the parent shows up there
+        set_close(plane, entry, 42.0)
+        attached, _ = executor.submit(worker_read, entry).result()
+        assert attached['close'][0] == 42.0
+
+
+def test_close_unlinks_the_blocks(arrays):
+    plane = DataPlane()
+    entries = [plane.publish(key, arrays) for key in ('BTCUSDT', 'ETHUSDT')]
+    assert plane.nbytes >= 2 * sum(a.nbytes for a in arrays.values())
+    plane.close()
+    assert not plane.blocks and not plane.manifest
+    for entry in entries:
+        with pytest.raises(FileNotFoundError):
+            attach(entry)
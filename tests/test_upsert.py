@@ -0,0 +1,116 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql, mysql, postgresql
+
+import helpers_functions
+from helpers_functions import ensure_unique_index, insert_ignore, upsert_df
+
+KEYS = ['time', 'instrument', 'granularity']
+
+
+def candles(start, periods, instrument='EUR_USD'):
+    times = pd.date_range('2017-01-02 22:00', periods=start + periods, freq='4h', tz='UTC')[start:]
+    return pd.DataFrame(dict(complete=True, volume=range(start, start + periods), time=times,
+                             close=[1.0 + i / 100 for i in range(start, start + periods)],
+                             instrument=instrument, granularity='H4'))
+
+
+@pytest.fixture
+def engine():
+    engine = sa.create_engine('sqlite://')
+    yield engine
+    helpers_functions._upsert_tables.clear()
+    engine.dispose()
+
+
+def read(engine):
+    return pd.read_sql('SELECT * FROM fx_data ORDER BY instrument, time', engine)
+
+
+def test_creates_table_and_index(engine):
+    assert upsert_df(candles(0, 5), 'fx_data', engine, KEYS) == 5
+    indexes = sa.inspect(engine).get_indexes('fx_data')
+    assert [(index['column_names'], index['unique']) for index in indexes] == [(KEYS, 1)]
+    assert upsert_df(candles(0, 5), 'fx_data', engine, KEYS) == 0
+    assert len(read(engine)) == 5
+
+
+def test_tz_aware_times_match_rows_written_by_to_sql(engine):
+    candles(0, 10).to_sql('fx_data', engine, index=False)
+    # 3 rows already in the table (as stored by to_sql) and 4 new ones
+    assert upsert_df(candles(7, 7), 'fx_data', engine, KEYS) == 4
+    rows = read(engine)
+    assert len(rows) == 14
+    assert not rows.duplicated(KEYS).any()
+    assert rows['time'].str.len().nunique() == 1
+    assert (pd.to_datetime(rows['time'], utc=True) == candles(0, 14)['time']).all()
+
+
+def test_other_key_values_are_inserted(engine):
+    upsert_df(candles(0, 3), 'fx_data', engine, KEYS)
+    assert upsert_df(candles(0, 3, instrument='GBP_USD'), 'fx_data', engine, KEYS) == 3
+    assert len(read(engine)) == 6
+
+
+def test_batch_duplicates_keep_last(engine):
+    df = pd.concat([candles(0, 3), candles(0, 3).assign(close=2.0)], ignore_index=True)
+    assert upsert_df(df, 'fx_data', engine, KEYS, batch_size=2) == 3
+    assert (read(engine)['close'] == 2.0).all()
+
+
+def test_missing_values(engine):
+    df = candles(0, 3)
+    df.loc[1, 'close'] = None
+    upsert_df(df, 'fx_data', engine, KEYS)
+    assert read(engine)['close'].isna().tolist() == [False, True, False]
+
+
+def test_empty_df(engine):
+    assert upsert_df(candles(0, 0), 'fx_data', engine, KEYS) == 0
+    assert not sa.inspect(engine).has_table('fx_data')
+
+
+def test_existing_duplicates_raise(engine):
+    pd.concat([candles(0, 2), candles(0, 2)]).to_sql('fx_data', engine, index=False)
+    with pytest.raises(ValueError):
+        upsert_df(candles(0, 3), 'fx_data', engine, KEYS)
+
+
+def test_missing_table_without_df(engine):
+    with pytest.raises(ValueError):
+        ensure_unique_index(engine, 'fx_data', KEYS)
+
+
+def test_reflection_is_cached(engine, monkeypatch):
+    upsert_df(candles(0, 2), 'fx_data', engine, KEYS)
+    calls = []
+    monkeypatch.setattr(sa, 'inspect', lambda *args: calls.append(args))
+    assert upsert_df(candles(1, 3), 'fx_data', engine, KEYS) == 2
+    assert calls == []
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (postgresql.dialect(), 'ON CONFLICT (time, instrument, granularity) DO NOTHING'),
+    (mysql.dialect(), 'INSERT IGNORE INTO fx_data'),
+    (mssql.dialect(), 'WHERE NOT (EXISTS (SELECT'),
+])
+def test_statement_per_dialect(dialect, expected):
+    table = sa.Table('fx_data', sa.MetaData(), sa.Column('time', sa.DateTime), sa.Column('instrument', sa.Text),
+                     sa.Column('granularity', sa.Text), sa.Column('close', sa.Float))
+    cols = ['time', 'instrument', 'granularity', 'close']
+    sql = str(insert_ignore(table, cols, KEYS, dialect.name).compile(dialect=dialect))
+    assert expected in ' '.join(sql.split())
+
+
+def test_not_exists_fallback(engine):
+    candles(0, 3).to_sql('fx_data', engine, index=False)
+    table = ensure_unique_index(engine, 'fx_data', KEYS)
+    df = candles(2, 3)
+    statement = insert_ignore(table, list(df.columns), KEYS, 'other')
+    rows = [dict(zip(df.columns, row)) for row in zip(*(helpers_functions._db_values(df[col]) for col in df))]
+    with engine.begin() as connection:
+        for row in rows:
+            connection.execute(statement, row)
+    assert len(read(engine)) == 5
+    assert not read(engine).duplicated(KEYS).any()
@@ -0,0 +1,287 @@
+"""
+Event driven live bar pipeline for the traders.
+
+    source -> poll() -> completed new candles -> BarWindow per instrument -> strategies(instrument, window)
+                                             \\-> AsyncWriter (database, off the critical path)
+
+source is anything with the broker's get_prices(instruments, params) (e.g. OandaBroker2), returning
+a DataFrame with complete, volume, time, open, high, low, close, instrument and granularity columns.
+The windows keep the last `window` bars of each instrument in NumPy ring buffers, so strategies
+get their history without any SQL read; the last bar time per instrument replaces the MAX(time) query.
+Latency from the start of a poll to the strategies' signals is recorded per new bar.
+
+ReplaySource replays stored bars (e.g. data/data_oanda_*.csv) as if they were arriving live,
+see tests/test_live_pipeline.py.
+"""
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+GRANULARITY_SECONDS = dict(M1=60, M5=300, M15=900, M30=1800, H1=3600, H4=14400, D=86400)
+
+
+class BarWindow(object):
+    """The last `size` bars of an instrument: int64 UTC ns `time` and float64 OHLCV columns in a ring buffer."""
+
+    def __init__(self, size=100):
+        self.size = size
+        self.time = np.zeros(size, dtype=np.int64)
+        self.values = np.zeros((len(COLUMNS), size))
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    @property
+    def last_time(self):
+        return int(self.time[(self.pos - 1) % self.size]) if self.count else None
+
+    def append(self, time_ns, values):
+        """Add one bar (values in COLUMNS order); bars not newer than the last one are ignored."""
+        if self.count and time_ns <= self.time[(self.pos - 1) % self.size]:
+            return False
+        self.time[self.pos] = time_ns
+        self.values[:, self.pos] = values
+        self.pos = (self.pos + 1) % self.size
+        self.count += 1
+        return True
+
+    def arrays(self):
+        """time + OHLCV arrays, oldest first (copies)."""
+        n = len(self)
+        order = np.arange(self.pos - n, self.pos) % self.size
+        arrays = dict(time=self.time[order])
+        arrays.update(zip(COLUMNS, self.values[:, order]))
+        return arrays
+
+    def to_df(self):
+        arrays = self.arrays()
+        index = pd.DatetimeIndex(arrays.pop('time').view('datetime64[ns]'), name='time').tz_localize('UTC')
+        return pd.DataFrame(arrays, index=index)
+
+
+class LatencyStats(object):
+    """Latencies (seconds) of the last `keep` events, summarized as count / mean / p50 / p95 / max."""
+
+    def __init__(self, keep=1000):
+        self.samples = deque(maxlen=keep)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return dict(count=0)
+        a = np.fromiter(self.samples, dtype=float)
+        return dict(count=self.count, mean=float(a.mean()), p50=float(np.percentile(a, 50)),
+                    p95=float(np.percentile(a, 95)), max=float(a.max()))
+
+
+class AsyncWriter(object):
+    """
+    Background thread calling write(df) with the queued DataFrames, concatenated up to `max_rows`
+    rows per call. put() returns at once; flush() waits for what is queued. Errors are kept in
+    `errors` (and printed), the rows of a failed write are not retried.
+    """
+
+    def __init__(self, write, max_rows=5000):
+        self.write = write
+        self.max_rows = max_rows
+        self.queue = queue.Queue()
+        self.errors = []
+        self.rows_written = 0
+        self.thread = threading.Thread(target=self._run, name='AsyncWriter', daemon=True)
+        self.thread.start()
+
+    def put(self, df):
+        if len(df):
+            self.queue.put(df)
+
+    def _run(self):
+        while True:
+            frames = [self.queue.get()]
+            rows = len(frames[0]) if frames[0] is not None else 0
+            while rows < self.max_rows and frames[-1] is not None:
+                try:
+                    frames.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                rows += len(frames[-1]) if frames[-1] is not None else 0
+            stop = frames[-1] is None
+            batch = [df for df in frames if df is not None]
+            if batch:
+                try:
+                    df = pd.concat(batch, ignore_index=True) if len(batch) > 1 else batch[0]
+                    self.write(df)
+                    self.rows_written += len(df)
+                except Exception as e:
+                    print('[AsyncWriter] write failed:', e)
+                    self.errors.append(e)
+            for _ in frames:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class LivePipeline(object):
+    """
+    Polls `source` for the candles of `instruments`, feeds the completed new ones into the windows,
+    calls each strategy(instrument, window) once per new bar, on the window ending at that bar
+    (signals[instrument] keeps the results for the last one), and hands the new rows to `writer`
+    (an AsyncWriter, or None not to persist). on_bars(new_bars) is called after each poll with new
+    bars (instrument -> number of new bars), e.g. to update positions.
+    """
+
+    def __init__(self, source, instruments, granularity, window=100, strategies=(), writer=None, on_bars=None):
+        self.source = source
+        self.instruments = list(instruments)
+        self.granularity = granularity
+        self.windows = {instrument: BarWindow(window) for instrument in self.instruments}
+        self.strategies = list(strategies)
+        self.writer = writer
+        self.on_bars = on_bars
+        self.signals = dict()
+        self.fetch_latency = LatencyStats()
+        self.signal_latency = LatencyStats()
+
+    def seed(self, df):
+        """Fill the windows from earlier bars (same columns as get_prices), without signals or writes."""
+        for instrument, group in df.groupby('instrument'):
+            if instrument in self.windows:
+                self._append(instrument, group)
+
+    def last_time(self):
+        times = [w.last_time for w in self.windows.values() if w.last_time is not None]
+        return pd.Timestamp(min(times), unit='ns', tz='UTC') if len(times) == len(self.windows) else None
+
+    def params(self):
+        last_time = self.last_time()
+        if last_time is None:
+            return dict(granularity=self.granularity, count=self.windows[self.instruments[0]].size)
+        return {'granularity': self.granularity, 'from': last_time.timestamp()}
+
+    def _append(self, instrument, df, on_bar=None):
+        """Add the bars of df newer than the window's last one, calling on_bar(instrument, window) after each."""
+        window = self.windows[instrument]
+        times = pd.DatetimeIndex(df['time'])
+        if times.tz is not None:
+            times = times.tz_convert('UTC').tz_localize(None)
+        times = times.values.astype('datetime64[ns]').view(np.int64)
+        values = df[list(COLUMNS)].to_numpy(dtype=float)
+        added = []
+        for i, (t, row) in enumerate(zip(times, values)):
+            if window.append(t, row):
+                added.append(i)
+                if on_bar is not None:
+                    on_bar(instrument, window)
+        return df.iloc[added]
+
+    def poll(self):
+        """One round trip: fetch, update the windows, signal, persist. Returns {instrument: new bars}."""
+        start = time.perf_counter()
+        df = self.source.get_prices(self.instruments, self.params())
+        self.fetch_latency.add(time.perf_counter() - start)
+
+        def signal(instrument, window):
+            self.signals[instrument] = [strategy(instrument, window) for strategy in self.strategies]
+            self.signal_latency.add(time.perf_counter() - start)
+
+        df = df[df['complete']]
+        new_bars = dict()
+        new_rows = []
+        for instrument, group in df.groupby('instrument', sort=False):
+            if instrument not in self.windows:
+                continue
+            added = self._append(instrument, group.sort_values('time'), signal)
+            if not len(added):
+                continue
+            new_bars[instrument] = len(added)
+            new_rows.append(added)
+
+        if new_rows and self.writer is not None:
+            self.writer.put(pd.concat(new_rows, ignore_index=True))
+        if new_bars and self.on_bars is not None:
+            self.on_bars(new_bars)
+        return new_bars
+
+    def seconds_till_next_candle(self, now=None):
+        last_time = self.last_time()
+        if last_time is None:
+            return 0.0
+        now = now or pd.Timestamp.now(tz='UTC')
+        # the last completed bar opened at last_time, the next one completes two bar lengths later
+        return (last_time + pd.Timedelta(seconds=2 * GRANULARITY_SECONDS[self.granularity]) - now).total_seconds()
+
+    def run(self, polls=None, interval=None, stop=None):
+        """
+        Poll until `stop` (threading.Event) is set or after `polls` polls; sleeps `interval` seconds
+        between polls, by default until the next candle completes (plus 5 seconds).
+        """
+        done = 0
+        while (polls is None or done < polls) and not (stop is not None and stop.is_set()):
+            self.poll()
+            done += 1
+            wait = interval if interval is not None else max(self.seconds_till_next_candle() + 5, 5)
+            if wait and (polls is None or done < polls):
+                if stop is not None:
+                    stop.wait(wait)
+                else:
+                    time.sleep(wait)
+
+    def latency(self):
+        return dict(fetch=self.fetch_latency.summary(), signal=self.signal_latency.summary())
+
+
+class ReplaySource(object):
+    """
+    Mock price source: get_prices returns the stored bars of each instrument (DataFrames with a
+    datetime index and OHLCV columns) as the broker would, one more completed bar per call, followed
+    by the incomplete current bar. `from` / `count` params are honoured like the Oanda API.
+    """
+
+    def __init__(self, frames, granularity, start=1, step=1):
+        self.granularity = granularity
+        self.frames = dict()
+        for instrument, df in frames.items():
+            index = pd.DatetimeIndex(df.index)
+            index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+            self.frames[instrument] = df.set_axis(index).sort_index()
+        self.cursor = start
+        self.step = step
+        self.requests = 0
+
+    def get_prices(self, instruments, params):
+        self.requests += 1
+        self.cursor += self.step
+        frames = []
+        for instrument in instruments if isinstance(instruments, list) else [instruments]:
+            df = self.frames[instrument].iloc[:self.cursor + 1]
+            if 'from' in params:
+                df = df[df.index >= pd.Timestamp(params['from'], unit='s', tz='UTC')]
+            else:
+                df = df.iloc[-params.get('count', 500):]
+            frame = pd.DataFrame(dict(complete=True, volume=df['volume'].to_numpy(), time=df.index,
+                                      open=df['open'].to_numpy(), high=df['high'].to_numpy(),
+                                      low=df['low'].to_numpy(), close=df['close'].to_numpy(),
+                                      instrument=instrument, granularity=self.granularity))
+            if len(frame) and self.cursor < len(self.frames[instrument]):
+                # the last bar is still forming
+                frame.loc[frame.index[-1], 'complete'] = False
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
@@ -3,13 +3,13 @@ import datetime as dt
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.endpoints.instruments as instruments
 import pytz
-from oandapyV20 import API
 from oandapyV20.contrib.factories import InstrumentsCandlesFactory
 from oandapyV20.contrib.requests import MarketOrderRequest
 from oandapyV20.contrib.requests import TakeProfitDetails, StopLossDetails
 import oandapyV20.endpoints.orders as orders
 import oandapyV20.endpoints.positions as positions
 from config.keys import oanda_keys
+from providers.forex.oanda_client import get_client
 
 PRACTICE_API_HOST = 'api-fxpractice.forex.com'
 PRACTICE_STREAM_HOST = 'stream-fxpractice.forex.com'
@@ -21,7 +21,7 @@ PORT = '443'
 class OandaBroker2:
     # tz = pytz.timezone('America/New_York')
 
-    def __init__(self, account_id, access_token, is_live=False):
+    def __init__(self, account_id, access_token, is_live=False, api_url=None):
         if is_live:
             host = LIVE_API_HOST
             stream_host = LIVE_STREAM_HOST
@@ -31,7 +31,8 @@ class OandaBroker2:
 
         self.account_id = account_id
         self.access_token = access_token
-        self.client = API(access_token=self.access_token)
+        # shared keep-alive client, see providers.forex.oanda_client (api_url: e.g. a local fake server)
+        self.client = get_client(self.access_token, api_url=api_url)
         self.support = None
         self.resistance = None
 
@@ -92,9 +93,8 @@ class OandaBroker2:
 
     def get_prices(self, instruments_, params):
         if isinstance(instruments_, list):
-            df_list = []
-            for instrument in instruments_:
-                df_list.append(self.get_prices(instrument, params))
+            # one request per instrument, concurrently on the client's connection pool
+            df_list = self.client.map(lambda instrument: self.get_prices_instrument(instrument, params), instruments_)
             return pd.concat(df_list)
 
         return self.get_prices_instrument(instruments_, params)
@@ -125,6 +125,10 @@ class OandaBroker2:
         df['granularity'] = granularity
         return df
 
+    def request_stats(self):
+        """Latency of the broker's requests per endpoint (count, errors, mean, p50, p95, max in seconds)."""
+        return self.client.stats.summary()
+
     def on_order_event(self, instrument, quantity, is_buy, transaction_id, status):
         print(
             dt.datetime.now(), '[ORDER]',
@@ -7,11 +7,11 @@ import pytz
 from plotly.offline import iplot
 import plotly.offline as plyo
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 
 from config.keys import oanda_keys, connection_strings
-from helpers_functions import clean_df_db_dups
-from strategies_live.strategy_test import StrategyTest
+from helpers_functions import upsert_df
+from traders.live_pipeline import AsyncWriter, LivePipeline
 from traders.oanda.broker_oanda import OandaBroker2
 
 con_str = connection_strings['ep_fx']
@@ -23,12 +23,17 @@ cf.set_config_file(offline=True)
 
 class Trader(object):
 
-    def __init__(self, broker, instruments, granularity, db_engine=None):
+    def __init__(self, broker, instruments, granularity, db_engine=None, strategies=(), window=100):
         """
         A trading platform
         :param broker: Broker object
         :param instruments: A list of instruments recognized by the broker for trading
-        :param strategy: function that takes in latest prices in dataframe and returns orders
+        :param strategies: functions called as strategy(instrument, window) on each new completed candle,
+                           window being the instrument's traders.live_pipeline.BarWindow
+        :param window: number of recent candles kept in memory per instrument
+
+        Candles are kept in memory by a LivePipeline: the database is read once at start to fill the
+        windows, and new candles are written to it in the background.
         """
         self.broker = broker
         self.granularity = granularity
@@ -41,14 +46,19 @@ class Trader(object):
         self.update_positions()
         self.table_name = "fx_data"
 
-        self.last_timestamp = None
-        self.set_last_timestamp()
-
         if isinstance(instruments, list):
             self.instruments = instruments
         else:
             self.instruments = [instruments]
 
+        self.writer = AsyncWriter(self.write_db) if db_engine is not None else None
+        self.pipeline = LivePipeline(broker, self.instruments, granularity, window=window,
+                                     strategies=strategies, writer=self.writer, on_bars=self.on_price_event)
+        self.last_timestamp = None
+        if db_engine is not None:
+            self.load_window()
+        self.set_last_timestamp()
+
         self.is_order_pending = False
         self.data = None
         self.run_id = random.randint(1000, 9999)
@@ -65,31 +75,30 @@ class Trader(object):
             pos = None
         return pos
 
-    def run_strategy(self):
-        self.get_latest_prices()
+    def run_strategy(self, polls=None, stop=None):
+        self.pipeline.run(polls=polls, stop=stop)
 
     def get_latest_prices(self):
+        new_bars = self.pipeline.poll()
+        print('new completed candles', new_bars)
         self.set_last_timestamp()
-        if self.last_timestamp is None:
-            params = dict(granularity=self.granularity, count=1000)
-        else:
-            unixtime = time.mktime(self.last_timestamp.timetuple())
-            params = {'granularity': self.granularity, 'from': unixtime}
-
-        self.update_db(params)
+        return new_bars
 
-    def update_db(self, params):
-        df = self.broker.get_prices(self.instruments, params)
-        print('all candles', len(df))
-        print('completed candles', len(df[df['complete']]))
-        df = df[df['complete']]
-
-        # df['time'] = df.apply(lambda x: self.change_tz(x['time'], tz=pytz.timezone('America/New_York')), axis=1)
+    def load_window(self):
+        # fill the in memory windows once, later candles come from the broker
+        if not inspect(self.db_engine).has_table(self.table_name):
+            return
+        size = self.pipeline.windows[self.instruments[0]].size
+        for instrument in self.instruments:
+            sql = (f"SELECT * FROM {self.table_name} WHERE instrument='{instrument}' "
+                   f"AND granularity='{self.granularity}' ORDER BY time DESC LIMIT {size}")
+            df = pd.read_sql(text(sql), self.db_engine)
+            if len(df):
+                self.pipeline.seed(df.iloc[::-1])
 
-        df = clean_df_db_dups(df, self.table_name, self.db_engine, ['time', 'instrument', 'granularity'])
-        if len(df) > 0:
-            df.to_sql(self.table_name, self.db_engine, if_exists='append', index=False)
-            self.set_last_timestamp()
+    def write_db(self, df):
+        # runs on the AsyncWriter thread; candles already in the table are skipped by its unique index
+        upsert_df(df, self.table_name, self.db_engine, ['time', 'instrument', 'granularity'])
 
     @staticmethod
     def change_tz(ts, tz=pytz.timezone('America/New_York')):
@@ -97,62 +106,45 @@ class Trader(object):
         return pd.Timestamp(year=y, month=m, day=d, hour=h, minute=minute, second=s, tz=tz)
 
     def set_last_timestamp(self):
-        # get last timestamp from db and set it to property last_timestamp
-        sql = f"SELECT Max(time) as last_timestamp from fx_data WHERE granularity='{self.granularity}'"
-        df = pd.read_sql(text(sql), self.db_engine)
-
-        if len(df) > 0:
-            # self.last_timestamp = df['last_timestamp'].dt.tz_convert('America/New_York').iloc[0]
-            if self.last_timestamp != df['last_timestamp'].iloc[0]:
-                self.last_timestamp = df['last_timestamp'].iloc[0]
-                self.on_price_event()
-            return
-
-    def generate_signals(self):
-        for instrument in self.instruments:
-            sql = f"SELECT * FROM fx_data WHERE instrument='{instrument}' ORDER BY time DESC LIMIT 100"
-            df = pd.read_sql(text(sql), self.db_engine)
-            self.strategy()
+        # last completed candle held in memory (oldest of the instruments' last candles)
+        self.last_timestamp = self.pipeline.last_time()
 
     def candle_plot(self, selected_instrument):
-
-        sql = f"SELECT * FROM fx_data WHERE instrument='{selected_instrument}' ORDER BY time DESC LIMIT 100"
-        df = pd.read_sql(text(sql), self.db_engine)
-
-        df.set_index('time', inplace=True)
+        df = self.pipeline.windows[selected_instrument].to_df()
         qf = cf.QuantFig(df, title=f'{selected_instrument}',
                          legend='right', name=f'{selected_instrument}')
         plyo.iplot(qf.iplot(asFigure=True), image='png', filename=f'{selected_instrument}.html')
 
-    def seconds_elapse_since_last_candle(self):
-        now = datetime.datetime.now(pytz.timezone('America/New_York'))
-        last = self.change_tz(self.last_timestamp).to_pydatetime()
-        delta = now - last
-        return delta.seconds
-
     def seconds_till_next_candle(self):
-        return 4 * 3600 - self.seconds_elapse_since_last_candle()
+        return self.pipeline.seconds_till_next_candle()
 
     def sleep_or_run(self):
         s = self.seconds_till_next_candle()
         if s > 0:
             time.sleep(s)
             return
-        if s < -10:
-            self.get_latest_prices()
-            return
+        self.get_latest_prices()
 
-    def on_price_event(self):
+    def on_price_event(self, new_bars):
         self.price_event_counter += 1
         self.update_positions()
-        self.generate_signals_and_think()
+        self.generate_signals_and_think(new_bars)
 
-    def generate_signals_and_think(self):
-        for instrument in self.instruments:
+    def generate_signals_and_think(self, new_bars):
+        for instrument in new_bars:
             pos = self.get_position_instrument(instrument)
-            if not pos:
-                sql = f"SELECT * FROM fx_data WHERE instrument='{instrument}' ORDER BY time DESC LIMIT 100"
-                df = pd.read_sql(text(sql), self.db_engine)
+            signals = self.pipeline.signals.get(instrument, [])
+            print(instrument, 'position:', pos is not None, 'signals:', signals)
+
+    def latency(self):
+        latency = self.pipeline.latency()
+        if hasattr(self.broker, 'request_stats'):
+            latency['requests'] = self.broker.request_stats()
+        return latency
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
 
 
 if __name__ == '__main__':
@@ -164,5 +156,7 @@ if __name__ == '__main__':
     # trader.candle_plot('EUR_USD')
     print(trader.last_timestamp)
     trader.get_latest_prices()
+    print(trader.latency())
+    trader.close()
     print('end')
     # trader.run_strategy()